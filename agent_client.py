@@ -0,0 +1,283 @@
+"""
+Agent client — one warm, in-process way to talk to the Mistral agents.
+
+`await ask(agent, message, conversation_id=None)` starts (or continues) a
+Conversations API exchange and returns an AgentReply: text replies and
+function-call replies (Anansi answers with a FunctionCallEntry whose
+arguments carry the story) come back as fields, never as printed output to
+be scraped. The SDK client is built once per process on the pooled Mistral
+connection from http_clients, so a call costs one HTTPS request on a warm
+keep-alive connection — no interpreter start, SDK import or file rewrite.
+
+team.py (the CLI), main.py and orchestrator.py all go through here.
+
+Worker mode (AGENT_CLIENT_MODE=worker) forwards calls to one long-lived
+`python agent_client.py --worker` child over JSON lines, for isolating the
+SDK from the server process; a child that dies is restarted on the next call.
+
+Tuning (env):
+  AGENT_CLIENT_MODE        inprocess (default) or worker
+  AGENT_CLIENT_TIMEOUT     seconds to wait for a worker reply (default 120)
+  MISTRAL_SERVER_URL       alternative Mistral API base URL (proxies, local stubs)
+"""
+import os
+import sys
+import asyncio
+import json
+import time
+from typing import Optional
+import http_clients
+
+MISTRAL_API_KEY = os.environ.get("MISTRAL_API_KEY", "")
+SERVER_URL = os.environ.get("MISTRAL_SERVER_URL", "")
+MODE = os.environ.get("AGENT_CLIENT_MODE", "inprocess")
+WORKER_TIMEOUT = float(os.environ.get("AGENT_CLIENT_TIMEOUT", 120))
+
+# Pre-registered agents on Mistral platform
+AGENTS = {
+    "papa_bois": "ag_019ca24ec2c271458172692e54fc0c94",  # orchestrator, Trinidad mythology
+    "anansi": "ag_019ca24f110677d7a92ec83a5c85704a",     # storyteller, West African mythology
+    "firefly": "ag_019ca24f601773e1a953fac560ff4d71",    # builder/assembler
+    "devi": "ag_019ca24f147876f2ab26526f6cf8c4b4",       # voice/audio specialist, Hindu mythology
+    "ogma": None,                                        # language guardian, Celtic mythology — pending
+}
+
+_client = None
+_client_http = None
+_worker: Optional["_Worker"] = None
+_counters = {"calls": 0, "errors": 0, "seconds": 0.0, "worker_restarts": 0}
+
+
+class AgentError(Exception):
+    """Unknown agent, missing configuration, or an empty/failed agent reply."""
+
+
+class AgentReply:
+    """One agent turn. `kind` is "text" or "function_call" (then `arguments` holds the call's arguments)."""
+    __slots__ = ("agent", "agent_id", "conversation_id", "kind", "text", "arguments", "function")
+
+    def __init__(self, agent: str, agent_id: str, conversation_id: str, kind: str, text: str,
+                 arguments=None, function: Optional[str] = None):
+        self.agent = agent
+        self.agent_id = agent_id
+        self.conversation_id = conversation_id
+        self.kind = kind
+        self.text = text
+        self.arguments = arguments
+        self.function = function
+
+    def to_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "AgentReply":
+        return cls(**d)
+
+
+def agent_id(agent: str) -> str:
+    """Mistral agent id for a team name; ids ("ag_...") pass through."""
+    if agent.startswith("ag_"):
+        return agent
+    name = agent.lower()
+    if name not in AGENTS:
+        raise AgentError(f"Unknown agent '{agent}'. Available agents: {', '.join(AGENTS)}")
+    if not AGENTS[name]:
+        raise AgentError(f"Agent '{agent}' has no Mistral Agent ID configured yet")
+    return AGENTS[name]
+
+
+def client():
+    """The process-wide Mistral SDK client (rebuilt only if the pooled connection was replaced)."""
+    global _client, _client_http
+    http = http_clients.get("mistral")
+    if _client is None or _client_http is not http:
+        if not MISTRAL_API_KEY:
+            raise AgentError("MISTRAL_API_KEY environment variable not set")
+        _client, _client_http = http_clients.mistral(MISTRAL_API_KEY, SERVER_URL), http
+    return _client
+
+
+def text_of(response) -> str:
+    """Text from a Conversations API response (string or chunked content)."""
+    parts = []
+    for output in response.outputs or []:
+        content = getattr(output, "content", None)
+        if isinstance(content, str) and content.strip():
+            parts.append(content.strip())
+        elif isinstance(content, list):
+            for chunk in content:
+                if getattr(chunk, "text", None):
+                    parts.append(chunk.text)
+    return "\n".join(parts)
+
+
+def parse(response, agent: str, aid: str, conversation_id: str) -> AgentReply:
+    for output in response.outputs or []:
+        if type(output).__name__ == "FunctionCallEntry":
+            arguments = output.arguments
+            if isinstance(arguments, str):
+                try:
+                    arguments = json.loads(arguments)
+                except json.JSONDecodeError:
+                    pass
+            text = arguments if isinstance(arguments, str) else json.dumps(arguments, ensure_ascii=False)
+            return AgentReply(agent, aid, conversation_id, "function_call", text, arguments, output.name)
+    text = text_of(response)
+    if not text:
+        raise AgentError(f"No usable response from agent '{agent}'")
+    return AgentReply(agent, aid, conversation_id, "text", text)
+
+
+async def _ask_inprocess(agent: str, message: str, conversation_id: Optional[str]) -> AgentReply:
+    aid = agent_id(agent)
+    c = client()
+    if conversation_id:
+        response = await c.beta.conversations.append_async(conversation_id=conversation_id, inputs=message)
+    else:
+        response = await c.beta.conversations.start_async(agent_id=aid, inputs=message)
+        conversation_id = response.conversation_id
+    return parse(response, agent, aid, conversation_id)
+
+
+async def ask(agent: str, message: str, conversation_id: Optional[str] = None) -> AgentReply:
+    """Send `message` to `agent` (team name or agent id), continuing `conversation_id` if given."""
+    _counters["calls"] += 1
+    t0 = time.perf_counter()
+    try:
+        if MODE == "worker":
+            return await _get_worker().ask(agent, message, conversation_id)
+        return await _ask_inprocess(agent, message, conversation_id)
+    except Exception:
+        _counters["errors"] += 1
+        raise
+    finally:
+        _counters["seconds"] += time.perf_counter() - t0
+
+
+# ---- Worker mode ----
+
+class _Worker:
+    """A long-lived `agent_client.py --worker` child; requests are multiplexed by id over JSON lines."""
+
+    def __init__(self):
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.pending: dict[int, asyncio.Future] = {}
+        self.next_id = 0
+        self.reader: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+
+    async def _ensure(self):
+        async with self.lock:
+            if self.proc is not None and self.proc.returncode is None:
+                return
+            if self.proc is not None:
+                _counters["worker_restarts"] += 1
+                print(f"⚠️ agent worker exited ({self.proc.returncode}), restarting")
+            self.proc = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), "--worker",
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                limit=16 * 1024 * 1024,
+            )
+            self.reader = asyncio.create_task(self._read(self.proc))
+
+    async def _read(self, proc):
+        while True:
+            line = await proc.stdout.readline()
+            if not line:
+                break
+            msg = json.loads(line)
+            future = self.pending.pop(msg["id"], None)
+            if future is None or future.done():
+                continue
+            if "error" in msg:
+                future.set_exception(AgentError(msg["error"]))
+            else:
+                future.set_result(AgentReply.from_dict(msg["reply"]))
+        await proc.wait()
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(AgentError(f"agent worker exited ({proc.returncode})"))
+        self.pending.clear()
+
+    async def ask(self, agent: str, message: str, conversation_id: Optional[str]) -> AgentReply:
+        await self._ensure()
+        self.next_id += 1
+        request_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        line = json.dumps({"id": request_id, "agent": agent, "message": message, "conversation_id": conversation_id})
+        self.proc.stdin.write(line.encode() + b"\n")
+        await self.proc.stdin.drain()
+        try:
+            return await asyncio.wait_for(future, WORKER_TIMEOUT)
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def stop(self):
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.stdin.close()
+            try:
+                await asyncio.wait_for(self.proc.wait(), 5)
+            except asyncio.TimeoutError:
+                self.proc.kill()
+        if self.reader:
+            await asyncio.gather(self.reader, return_exceptions=True)
+
+
+def _get_worker() -> _Worker:
+    global _worker
+    if _worker is None:
+        _worker = _Worker()
+    return _worker
+
+
+async def start():
+    """Warm the client (and start the worker in worker mode) before the first request."""
+    if MODE == "worker":
+        await _get_worker()._ensure()
+    elif MISTRAL_API_KEY:
+        client()
+
+
+async def stop():
+    global _worker
+    if _worker is not None:
+        await _worker.stop()
+        _worker = None
+
+
+def stats() -> dict:
+    calls = _counters["calls"]
+    return {"mode": MODE, **{k: v for k, v in _counters.items() if k != "seconds"},
+            "avg_ms": round(_counters["seconds"] / calls * 1000, 1) if calls else None,
+            "worker_pid": _worker.proc.pid if _worker and _worker.proc and _worker.proc.returncode is None else None}
+
+
+async def _serve_worker():
+    """Worker side: one JSON request per stdin line, one JSON reply per stdout line, handled concurrently."""
+    out = sys.stdout
+    sys.stdout = sys.stderr  # Keep log prints off the reply channel
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=16 * 1024 * 1024)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    tasks = set()
+
+    async def handle(msg: dict):
+        try:
+            reply = await _ask_inprocess(msg["agent"], msg["message"], msg.get("conversation_id"))
+            result = {"id": msg["id"], "reply": reply.to_dict()}
+        except Exception as e:
+            result = {"id": msg["id"], "error": str(e)}
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+
+    while line := await reader.readline():
+        task = asyncio.create_task(handle(json.loads(line)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await http_clients.close()
+
+
+if __name__ == "__main__" and "--worker" in sys.argv:
+    asyncio.run(_serve_worker())
@@ -0,0 +1,189 @@
+"""
+Agent registry — Mistral agents provisioned once at startup, never on the request path.
+
+Definitions are registered at import time with `define(key, handoffs=[...], **create_kwargs)`
+and fingerprinted (create kwargs plus the ids of the agents they hand off to).
+Created ids persist in `agent_registry` (database.py), so a restart or a new
+worker whose definitions haven't changed reuses them without a single API call.
+Anything missing or changed is created by a background task at startup,
+retried with backoff until it succeeds; meanwhile `get(name)` returns None and
+callers use the pre-registered agents. Only the worker holding the
+"agent_registry" advisory lock (singleflight.held) creates agents; the others
+wait for its ids to appear in the table, so workers never orphan each
+other's agents.
+
+`probe()` (served at /api/agents/health) checks the provisioned agents still
+exist, at most once per AGENT_PROBE_TTL seconds; a vanished agent is dropped
+and re-provisioned in the background.
+"""
+import os
+import asyncio
+import hashlib
+import json
+import random
+import time
+from typing import Optional
+import database as db
+import agent_client
+import singleflight
+
+PROBE_TTL = float(os.environ.get("AGENT_PROBE_TTL", 60))
+RETRY_CAP = float(os.environ.get("AGENT_PROVISION_RETRY_CAP", 300))
+WAIT_INTERVAL = float(os.environ.get("AGENT_PROVISION_WAIT_INTERVAL", 2))
+LOCK_KEY = "agent_registry"
+
+_specs: list[tuple[str, list[str], dict]] = []  # (key, handoffs, create kwargs), in creation order
+_ids: dict[str, str] = {}
+_task: Optional[asyncio.Task] = None
+_probe: dict = {"checked_at": 0.0, "result": None}
+_state = {"state": "idle", "source": None, "attempts": 0, "create_calls": 0, "last_error": None,
+          "provisioned_at": None}
+
+
+def define(key: str, handoffs: tuple = (), **create_kwargs):
+    """Register an agent under `key` (after any agents it hands off to); `create_kwargs` go to agents.create."""
+    _specs.append((key, list(handoffs), create_kwargs))
+
+
+def get(name: str) -> Optional[str]:
+    """Provisioned agent id, or None if not (yet) available."""
+    return _ids.get(name)
+
+
+def ready() -> bool:
+    return bool(_specs) and all(name in _ids for name, _, _ in _specs)
+
+
+def fingerprint(name: str, handoffs: list[str], create_kwargs: dict) -> Optional[str]:
+    """Hash of everything the agent is created from; None until its handoff targets have ids."""
+    if any(h not in _ids for h in handoffs):
+        return None
+    payload = json.dumps([name, create_kwargs, [_ids[h] for h in handoffs]], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def _persisted() -> dict:
+    rs = await db.execute("SELECT name, agent_id, fingerprint FROM agent_registry")
+    return {name: (agent_id, fp) for name, agent_id, fp in rs.rows}
+
+
+async def _provision(persisted: dict, create: bool) -> bool:
+    """Reuse persisted ids whose fingerprint still matches; create the rest if `create`. True when all are ready."""
+    client = agent_client.client() if create else None
+    for name, handoffs, kwargs in _specs:
+        fp = fingerprint(name, handoffs, kwargs)
+        if fp is None:
+            return False
+        agent_id, stored_fp = persisted.get(name, (None, None))
+        if agent_id and stored_fp == fp:
+            _ids[name] = agent_id
+            continue
+        _ids.pop(name, None)
+        if not create:
+            return False
+        _state["create_calls"] += 1
+        agent = await client.beta.agents.create_async(
+            **kwargs, **({"handoffs": [_ids[h] for h in handoffs]} if handoffs else {}))
+        _ids[name] = agent.id
+        persisted[name] = (agent.id, fp)
+        await db.execute(
+            "INSERT OR REPLACE INTO agent_registry (name, agent_id, fingerprint, created_at) VALUES (?, ?, ?, ?)",
+            [name, agent.id, fp, time.time()]
+        )
+        print(f"✅ Provisioned agent {name}={agent.id}")
+    return True
+
+
+async def _provision_forever():
+    attempt = 0
+    while True:
+        try:
+            created_before = _state["create_calls"]
+            async with singleflight.held(LOCK_KEY) as creator:
+                # Re-read under the lock: the previous holder may have created everything already
+                persisted = await _persisted()
+                if creator:
+                    _state["attempts"] += 1
+                done = await _provision(persisted, create=creator)
+            if done:
+                source = "created" if _state["create_calls"] > created_before else "persisted"
+                _state.update(state="ready", source=source, last_error=None, provisioned_at=time.time())
+                return
+            if not creator:
+                await asyncio.sleep(WAIT_INTERVAL)  # Another worker is creating them
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _state.update(state="degraded", last_error=str(e)[:200])
+            print(f"⚠️ Agent provisioning (attempt {_state['attempts']}): {e}")
+        delay = min(RETRY_CAP, 5 * 2 ** attempt) * random.uniform(0.5, 1)
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+def _spawn():
+    global _task
+    if _task is None or _task.done():
+        if _state["state"] != "degraded":
+            _state["state"] = "provisioning"
+        _task = asyncio.create_task(_provision_forever())
+
+
+async def start():
+    """Load persisted ids (no API calls if nothing changed); create the rest in the background."""
+    if not _specs:
+        return
+    if not agent_client.MISTRAL_API_KEY:
+        _state["state"] = "disabled"
+        return
+    try:
+        persisted = await _persisted()
+    except Exception as e:
+        print(f"⚠️ Agent registry load: {e}")
+        persisted = {}
+    if await _provision(persisted, create=False):
+        _state.update(state="ready", source="persisted", provisioned_at=time.time())
+        print(f"✅ Agents from registry: {', '.join(f'{k}={v}' for k, v in _ids.items())}")
+        return
+    _spawn()
+
+
+async def stop():
+    global _task
+    if _task:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+
+
+async def probe(force: bool = False) -> dict:
+    """Check each provisioned agent still exists; cached for PROBE_TTL seconds."""
+    if not force and _probe["result"] is not None and time.monotonic() - _probe["checked_at"] < PROBE_TTL:
+        return _probe["result"]
+    agents, missing = {}, []
+    if _ids:
+        client = agent_client.client()
+        for name, agent_id in list(_ids.items()):
+            try:
+                await client.beta.agents.get_async(agent_id=agent_id)
+                agents[name] = "ok"
+            except Exception as e:
+                if getattr(e, "status_code", None) == 404:
+                    agents[name] = "missing"
+                    missing.append(name)
+                else:
+                    agents[name] = f"error: {str(e)[:120]}"
+    if missing:
+        await db.batch([("DELETE FROM agent_registry WHERE name = ?", [name]) for name in missing])
+        for name in missing:
+            _ids.pop(name, None)
+        _state["state"] = "degraded"
+        _spawn()
+    result = {"ok": ready() and all(v == "ok" for v in agents.values()), "state": _state["state"], "agents": agents}
+    _probe.update(checked_at=time.monotonic(), result=result)
+    return result
+
+
+def stats() -> dict:
+    return {**_state, "agents": dict(_ids)}
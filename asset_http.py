@@ -0,0 +1,94 @@
+"""
+HTTP semantics for generated story assets: strong ETags from content hashes,
+immutable caching, If-None-Match → 304 and single Range → 206.
+File-backed bodies are streamed in fixed-size chunks, so memory per request
+stays bounded regardless of asset size.
+"""
+from typing import Optional
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # Weak comparison per RFC 9110 §13.1.2 for If-None-Match
+    candidates = [c.strip().removeprefix("W/") for c in header.split(",")]
+    return etag in candidates
+
+
+def parse_range(header: str, size: int):
+    """
+    Parse a single `bytes=` range into inclusive (start, end).
+    Returns None to ignore the header (serve 200), or "unsatisfiable" for a 416.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None  # Unknown unit or multipart ranges: fall back to the full body
+    first, sep, last = spec.strip().partition("-")
+    if not sep or not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None  # Not a valid byte-range-spec (e.g. "bytes=5--3"): ignore it
+    if first == "":
+        length = int(last)
+        if length == 0:
+            return "unsatisfiable"
+        start, end = max(0, size - length), size - 1
+    else:
+        start = int(first)
+        if last and int(last) < start:
+            return None  # last-pos before first-pos is invalid, not unsatisfiable
+        end = int(last) if last else size - 1
+    if start >= size:
+        return "unsatisfiable"
+    return start, min(end, size - 1)
+
+
+def _iter_file(path: str, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def asset_response(request: Request, digest: str, size: int, mime: str,
+                   path: Optional[str] = None, data: Optional[bytes] = None) -> Response:
+    """Respond with an immutable, content-addressed asset from a file path or in-memory bytes."""
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE, "Accept-Ranges": "bytes"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    applies = range_header is not None and (if_range is None or if_range.strip() == etag)
+    if applies:
+        byte_range = parse_range(range_header, size)
+    if byte_range == "unsatisfiable":
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        if path and (not applies or "," in range_header):
+            return FileResponse(path, media_type=mime, headers=headers)  # Also serves multipart ranges
+        if path:
+            # An ignored header would still be parsed (and refused) by FileResponse: send the whole file
+            headers["Content-Length"] = str(size)
+            return StreamingResponse(_iter_file(path, 0, size), media_type=mime, headers=headers)
+        return Response(content=data, media_type=mime, headers=headers)
+
+    start, end = byte_range
+    length = end - start + 1
+    headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(length)})
+    if path:
+        return StreamingResponse(_iter_file(path, start, length), status_code=206, media_type=mime, headers=headers)
+    return Response(content=data[start:end + 1], status_code=206, media_type=mime, headers=headers)
@@ -0,0 +1,203 @@
+"""
+Blob store — content-addressed storage for story audio and illustrations.
+Raw bytes are keyed by sha256 and live outside the stories row; the small
+`story_assets` table maps (story_id, key) → hash/size/mime.
+
+Backend is pluggable (`set_backend`); the default keeps files under BLOB_DIR
+so they can be served straight from disk.
+"""
+import os
+import asyncio
+import base64
+import hashlib
+import json
+import tempfile
+from typing import Optional
+import database as db
+
+BLOB_DIR = os.environ.get("BLOB_DIR", "blobs")
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class LocalBlobBackend:
+    """Files under root/ab/cd/<sha256>; writes are atomic (temp file + rename)."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put_sync(self, digest: str, data: bytes):
+        """Blocking put, for threads and scripts."""
+        path = self._path(digest)
+        if os.path.exists(path):
+            return  # Same content already stored
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    async def put(self, digest: str, data: bytes):
+        await asyncio.to_thread(self.put_sync, digest, data)
+
+    async def get(self, digest: str) -> Optional[bytes]:
+        path = self.local_path(digest)
+        if path is None:
+            return None
+        return await asyncio.to_thread(_read_file, path)
+
+    def local_path(self, digest: str) -> Optional[str]:
+        """Filesystem path for zero-copy serving, or None if absent."""
+        path = self._path(digest)
+        return path if os.path.exists(path) else None
+
+    async def delete(self, digest: str):
+        path = self._path(digest)
+        if os.path.exists(path):
+            await asyncio.to_thread(os.unlink, path)
+
+
+_backend = LocalBlobBackend(BLOB_DIR)
+
+
+def set_backend(backend):
+    """Swap the storage backend (must provide put/get/local_path/delete)."""
+    global _backend
+    _backend = backend
+
+
+def get_backend():
+    return _backend
+
+
+EXTENSIONS = {"audio/mpeg": "mp3", "image/png": "png"}
+
+
+def mime_for_key(key: str) -> str:
+    return "image/png" if key.startswith("img_") else "audio/mpeg"
+
+
+def url(asset: dict) -> str:
+    """Content-addressed URL for an asset reference; valid before the story row exists."""
+    return f"/api/blobs/{asset['hash']}.{EXTENSIONS.get(asset['mime'], 'bin')}"
+
+
+async def put(data: bytes) -> tuple[str, int]:
+    """Store bytes, return (sha256 hex digest, size)."""
+    digest = hashlib.sha256(data).hexdigest()
+    await _backend.put(digest, data)
+    return digest, len(data)
+
+
+async def put_asset(key: str, data: bytes, mime: Optional[str] = None) -> dict:
+    """Store one story asset and return its index reference."""
+    digest, size = await put(data)
+    return {"key": key, "hash": digest, "size": size, "mime": mime or mime_for_key(key)}
+
+
+def index_statement(assets: list[dict], story_id=None) -> Optional[tuple]:
+    """
+    story_assets INSERT for a batch. With story_id=None the rows use last_insert_rowid(),
+    so it must directly follow the stories INSERT (story_assets is WITHOUT ROWID,
+    so it does not disturb last_insert_rowid() for later statements either).
+    """
+    if not assets:
+        return None
+    sid = "?" if story_id is not None else "last_insert_rowid()"
+    values, params = [], []
+    for a in assets:
+        values.append(f"({sid}, ?, ?, ?, ?)")
+        params += ([story_id] if story_id is not None else []) + [a["key"], a["hash"], a["size"], a["mime"]]
+    return (
+        "INSERT OR REPLACE INTO story_assets (story_id, key, hash, size, mime) VALUES " + ", ".join(values),
+        params
+    )
+
+
+async def get_asset(story_id: int, key: str) -> Optional[dict]:
+    rs = await db.execute("SELECT hash, size, mime FROM story_assets WHERE story_id = ? AND key = ?", [story_id, key])
+    if not rs.rows:
+        return None
+    digest, size, mime = rs.rows[0]
+    return {"key": key, "hash": digest, "size": size, "mime": mime}
+
+
+async def latest_asset_bytes(key: str) -> Optional[bytes]:
+    """Bytes of the most recently stored asset under `key` (any story), e.g. a stand-in soundscape."""
+    rs = await db.execute("SELECT hash FROM story_assets WHERE key = ? ORDER BY story_id DESC LIMIT 1", [key])
+    if not rs.rows:
+        return None
+    return await _backend.get(rs.rows[0][0])
+
+
+async def get_legacy_asset(story_id: int, key: str) -> Optional[bytes]:
+    """Asset still packed in the pre-migration audio_cache/image_cache JSON columns."""
+    column = "image_cache" if key.startswith("img_") else "audio_cache"
+    rs = await db.execute(
+        f"SELECT json_extract({column}, ?) FROM stories WHERE id = ? AND json_valid({column})",
+        [f'$."{key}"', story_id]
+    )
+    if not rs.rows or not rs.rows[0][0]:
+        return None
+    return base64.b64decode(rs.rows[0][0])
+
+
+async def story_asset_keys(story_id: int) -> tuple[dict, dict]:
+    """({audio_key: True}, {image_key: True}) without loading any asset bytes."""
+    rs = await db.execute("""
+        SELECT key FROM story_assets WHERE story_id = ?
+        UNION
+        SELECT j.key FROM stories, json_each(stories.audio_cache) j
+            WHERE stories.id = ? AND json_valid(stories.audio_cache)
+        UNION
+        SELECT j.key FROM stories, json_each(stories.image_cache) j
+            WHERE stories.id = ? AND json_valid(stories.image_cache)
+    """, [story_id, story_id, story_id])
+    has_audio, has_images = {}, {}
+    for (key,) in rs.rows:
+        (has_images if key.startswith("img_") else has_audio)[key] = True
+    return has_audio, has_images
+
+
+async def migrate_legacy_assets(limit: Optional[int] = None) -> dict:
+    """
+    Unpack base64 JSON in stories.audio_cache / image_cache into the blob store,
+    index each asset in story_assets and clear the legacy columns.
+    One story at a time, so memory stays bounded by the largest single story.
+    """
+    rs = await db.execute(
+        "SELECT id FROM stories WHERE (audio_cache IS NOT NULL AND audio_cache NOT IN ('', '{}')) "
+        "OR (image_cache IS NOT NULL AND image_cache NOT IN ('', '{}')) ORDER BY id"
+    )
+    ids = [r[0] for r in rs.rows][:limit]
+    stats = {"stories": 0, "assets": 0, "bytes": 0}
+    for story_id in ids:
+        row = await db.execute("SELECT audio_cache, image_cache FROM stories WHERE id = ?", [story_id])
+        if not row.rows:
+            continue
+        assets = []
+        for raw in row.rows[0]:
+            try:
+                packed = json.loads(raw) if raw else {}
+            except json.JSONDecodeError:
+                continue
+            for key, b64 in (packed or {}).items():
+                if b64:
+                    assets.append(await put_asset(key, base64.b64decode(b64)))
+        statements = [s for s in [index_statement(assets, story_id)] if s]
+        statements.append(("UPDATE stories SET audio_cache = NULL, image_cache = NULL WHERE id = ?", [story_id]))
+        await db.batch(statements)
+        stats["stories"] += 1
+        stats["assets"] += len(assets)
+        stats["bytes"] += sum(a["size"] for a in assets)
+    return stats
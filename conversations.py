@@ -0,0 +1,101 @@
+"""
+Conversation registry — which Mistral conversation belongs to which agent.
+
+Rows live in `agent_conversations` (database.py), so the team.py CLI and the
+server share one store and every change is a single-row statement: parallel
+CLI calls and requests never rewrite each other's entries (SQLite serializes
+the writers; Turso does the same remotely). Lookups by conversation_id use
+the primary key, per-agent listings use (agent, last_used), and conversations
+idle for longer than CONVERSATION_TTL_DAYS are pruned.
+"""
+import os
+import asyncio
+import json
+import time
+from typing import Optional
+import database as db
+
+TTL_DAYS = float(os.environ.get("CONVERSATION_TTL_DAYS", 30))
+PRUNE_INTERVAL = float(os.environ.get("CONVERSATION_PRUNE_INTERVAL", 3600))
+
+_pruner: Optional[asyncio.Task] = None
+
+_COLUMNS = "conversation_id, agent, agent_id, turns, created_at, last_used"
+
+
+def _row(r) -> dict:
+    return dict(zip(("conversation_id", "agent", "agent_id", "turns", "created_at", "last_used"), r))
+
+
+async def record(conversation_id: str, agent: str, agent_id: Optional[str] = None):
+    """Register a new conversation or count another turn on an existing one."""
+    now = time.time()
+    await db.execute(
+        "INSERT INTO agent_conversations (conversation_id, agent, agent_id, turns, created_at, last_used) "
+        "VALUES (?, ?, ?, 1, ?, ?) "
+        "ON CONFLICT (conversation_id) DO UPDATE SET turns = turns + 1, last_used = excluded.last_used",
+        [conversation_id, agent, agent_id, now, now]
+    )
+
+
+async def get(conversation_id: str) -> Optional[dict]:
+    rs = await db.execute(f"SELECT {_COLUMNS} FROM agent_conversations WHERE conversation_id = ?", [conversation_id])
+    return _row(rs.rows[0]) if rs.rows else None
+
+
+async def for_agent(agent: str, limit: int = 20) -> list[dict]:
+    """Most recently used conversations with `agent`."""
+    rs = await db.execute(
+        f"SELECT {_COLUMNS} FROM agent_conversations WHERE agent = ? ORDER BY last_used DESC LIMIT ?",
+        [agent, limit]
+    )
+    return [_row(r) for r in rs.rows]
+
+
+async def latest(agent: str) -> Optional[str]:
+    rows = await for_agent(agent, 1)
+    return rows[0]["conversation_id"] if rows else None
+
+
+async def prune(ttl_days: float = TTL_DAYS) -> int:
+    """Forget conversations idle for longer than `ttl_days`; returns how many went."""
+    rs = await db.execute("DELETE FROM agent_conversations WHERE last_used < ?", [time.time() - ttl_days * 86400])
+    return rs.rows_affected or 0
+
+
+async def import_json(path: str) -> int:
+    """One-off import of the old team.py .conversations.json ({conversation_id: {"agent": ...}})."""
+    with open(path) as f:
+        entries = json.load(f)
+    now = time.time()
+    await db.batch([
+        ("INSERT OR IGNORE INTO agent_conversations (conversation_id, agent, agent_id, turns, created_at, last_used) "
+         "VALUES (?, ?, NULL, 1, ?, ?)", [conversation_id, (meta or {}).get("agent", ""), now, now])
+        for conversation_id, meta in entries.items()
+    ])
+    return len(entries)
+
+
+async def _prune_forever():
+    while True:
+        try:
+            pruned = await prune()
+            if pruned:
+                print(f"🧹 pruned {pruned} idle agent conversations")
+        except Exception as e:
+            print(f"⚠️ conversation prune: {e}")
+        await asyncio.sleep(PRUNE_INTERVAL)
+
+
+async def start():
+    """Start the periodic TTL prune (after db.init_db)."""
+    global _pruner
+    _pruner = asyncio.create_task(_prune_forever())
+
+
+async def stop():
+    global _pruner
+    if _pruner:
+        _pruner.cancel()
+        await asyncio.gather(_pruner, return_exceptions=True)
+        _pruner = None
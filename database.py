@@ -22,6 +22,140 @@ async def get_turso_client():
         )
     return _turso_client
 
+# Next to this module by default, so the server and scripts share one file whatever their working directory
+SQLITE_PATH = os.environ.get("SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "stories.db"))
+SQLITE_READERS = int(os.environ.get("SQLITE_READERS", 4))
+
+# Applied to every local connection: WAL lets readers run alongside the single writer
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+)
+
+
+class Result:
+    """Compact result mimicking the libsql ResultSet fields we use."""
+    __slots__ = ("rows", "last_insert_rowid", "rows_affected")
+
+    def __init__(self, rows, last_insert_rowid=None, rows_affected=0):
+        self.rows = rows
+        self.last_insert_rowid = last_insert_rowid
+        self.rows_affected = rows_affected
+
+
+def _is_read(sql: str) -> bool:
+    return sql.lstrip()[:6].upper() == "SELECT"
+
+
+def _statement(stmt) -> tuple:
+    """Accept "sql", ("sql",) or ("sql", params) and return (sql, params)."""
+    if isinstance(stmt, str):
+        return stmt, None
+    if len(stmt) == 1:
+        return stmt[0], None
+    return stmt[0], stmt[1]
+
+
+class SQLitePool:
+    """One long-lived writer connection plus N read-only readers (WAL mode)."""
+
+    def __init__(self, path: str, readers: int):
+        self.path = path
+        self.n_readers = max(1, readers)
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers: asyncio.Queue | None = None
+        self._reader_conns = []
+        self._open_lock = asyncio.Lock()
+
+    async def _connect(self, read_only: bool):
+        import aiosqlite
+        conn = await aiosqlite.connect(self.path)
+        for pragma in SQLITE_PRAGMAS:
+            await conn.execute(pragma)
+        if read_only:
+            await conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    async def open(self):
+        async with self._open_lock:
+            if self._writer is not None:
+                return
+            # Writer first so the WAL journal mode is set before readers attach
+            writer = await self._connect(read_only=False)
+            readers = asyncio.Queue()
+            for _ in range(self.n_readers):
+                conn = await self._connect(read_only=True)
+                self._reader_conns.append(conn)
+                readers.put_nowait(conn)
+            self._readers = readers
+            self._writer = writer
+
+    async def execute(self, sql: str, params=None) -> Result:
+        if self._writer is None:
+            await self.open()
+        if _is_read(sql):
+            conn = await self._readers.get()
+            try:
+                cursor = await conn.execute(sql, params or ())
+                rows = await cursor.fetchall()
+                await cursor.close()
+                return Result(rows)
+            finally:
+                self._readers.put_nowait(conn)
+        async with self._write_lock:
+            try:
+                cursor = await self._writer.execute(sql, params or ())
+                rows = await cursor.fetchall()
+                await self._writer.commit()
+            except Exception:
+                # Don't leave the shared writer inside the failed statement's implicit transaction
+                await self._writer.rollback()
+                raise
+            result = Result(rows, cursor.lastrowid, cursor.rowcount)
+            await cursor.close()
+            return result
+
+    async def batch(self, statements: list) -> list[Result]:
+        """Run statements on the writer inside one transaction; all or nothing."""
+        if self._writer is None:
+            await self.open()
+        async with self._write_lock:
+            results = []
+            try:
+                await self._writer.execute("BEGIN")
+                for sql, params in statements:
+                    cursor = await self._writer.execute(sql, params or ())
+                    rows = await cursor.fetchall()
+                    results.append(Result(rows, cursor.lastrowid, cursor.rowcount))
+                    await cursor.close()
+                await self._writer.commit()
+            except Exception:
+                await self._writer.rollback()
+                raise
+            return results
+
+    async def close(self):
+        conns = [self._writer, *self._reader_conns] if self._writer else []
+        self._writer, self._readers, self._reader_conns = None, None, []
+        for conn in conns:
+            await conn.close()
+
+
+_sqlite_pool: SQLitePool | None = None
+
+
+def get_sqlite_pool() -> SQLitePool:
+    global _sqlite_pool
+    if _sqlite_pool is None:
+        _sqlite_pool = SQLitePool(SQLITE_PATH, SQLITE_READERS)
+    return _sqlite_pool
+
+
 async def execute(sql: str, params=None):
     """Execute a SQL statement and return result."""
     if USE_TURSO:
@@ -32,20 +166,55 @@ async def execute(sql: str, params=None):
             rs = await client.execute(sql)
         return rs
     else:
-        import aiosqlite
-        async with aiosqlite.connect("stories.db") as db:
-            if params:
-                cursor = await db.execute(sql, params)
-            else:
-                cursor = await db.execute(sql)
-            await db.commit()
-            rows = await cursor.fetchall()
-            # Return a simple object mimicking libsql result
-            class Result:
-                def __init__(self, rows, lastrowid):
-                    self.rows = rows
-                    self.last_insert_rowid = lastrowid
-            return Result(rows, cursor.lastrowid)
+        return await get_sqlite_pool().execute(sql, params)
+
+async def batch(statements: list) -> list:
+    """
+    Execute several statements atomically in a single round trip.
+    Statements are "sql" or ("sql", params); returns one result per statement,
+    each with its own last_insert_rowid. Turso: one libsql batch request.
+    SQLite: one transaction on the writer connection.
+    """
+    statements = [_statement(s) for s in statements]
+    if not statements:
+        return []
+    if USE_TURSO:
+        client = await get_turso_client()
+        return await client.batch([(sql, params) if params else sql for sql, params in statements])
+    return await get_sqlite_pool().batch(statements)
+
+
+class Transaction:
+    """Statements queued inside `async with transaction()`; results are filled in on exit."""
+    __slots__ = ("statements", "results")
+
+    def __init__(self):
+        self.statements = []
+        self.results = []
+
+    def execute(self, sql: str, params=None) -> int:
+        """Queue a statement; returns its index into `results`."""
+        self.statements.append((sql, params))
+        return len(self.statements) - 1
+
+
+@asynccontextmanager
+async def transaction():
+    """
+    Group writes into one atomic batch:
+
+        async with db.transaction() as tx:
+            i = tx.execute("INSERT ...", [...])
+            tx.execute("INSERT ...", [...])
+        story_id = tx.results[i].last_insert_rowid
+
+    Nothing is sent if the block raises. Later statements can refer to
+    earlier inserts with SQL's last_insert_rowid().
+    """
+    tx = Transaction()
+    yield tx
+    tx.results = await batch(tx.statements)
+
 
 async def init_db():
     """Create tables if they don't exist."""
@@ -58,9 +227,26 @@ async def init_db():
             child_name TEXT,
             language TEXT DEFAULT 'en',
             user_id INTEGER,
+            audio_cache TEXT,
+            image_cache TEXT,
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    # Older local databases predate the cache columns
+    for column in ("audio_cache", "image_cache"):
+        try:
+            await execute(f"ALTER TABLE stories ADD COLUMN {column} TEXT")
+        except Exception:
+            pass  # Column already exists
+    # Covering indexes for the library listing: newest-first keyset pages, optionally filtered,
+    # answered from the index alone (no content JSON read)
+    for name, columns in (
+        ("idx_stories_created", "created_at, id, title, child_name, language"),
+        ("idx_stories_language", "language, created_at, id, title, child_name"),
+        ("idx_stories_child", "child_name, created_at, id, title, language"),
+        ("idx_stories_user", "user_id, created_at, id, title, child_name, language"),
+    ):
+        await execute(f"CREATE INDEX IF NOT EXISTS {name} ON stories ({columns})")
     await execute("""
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -68,10 +254,16 @@ async def init_db():
             name TEXT NOT NULL,
             password_hash TEXT NOT NULL,
             salt TEXT NOT NULL,
+            password_iterations INTEGER NOT NULL DEFAULT 100000,
             role TEXT DEFAULT 'user',
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    # Per-user PBKDF2 work factor; rows from before the column were hashed with 100,000 (see passwords.py)
+    try:
+        await execute("ALTER TABLE users ADD COLUMN password_iterations INTEGER NOT NULL DEFAULT 100000")
+    except Exception:
+        pass  # Column already exists
     await execute("""
         CREATE TABLE IF NOT EXISTS sessions (
             token TEXT PRIMARY KEY,
@@ -80,9 +272,118 @@ async def init_db():
             expires_at DATETIME
         )
     """)
+    # Expired-session sweeps are a range delete on expiry (see sessions.py)
+    await execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)")
+    # Asset index for the blob store; WITHOUT ROWID keeps last_insert_rowid() intact in batches
+    await execute("""
+        CREATE TABLE IF NOT EXISTS story_assets (
+            story_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mime TEXT NOT NULL,
+            PRIMARY KEY (story_id, key)
+        ) WITHOUT ROWID
+    """)
+    await execute("""
+        CREATE TABLE IF NOT EXISTS prompt_cache (
+            prompt_hash TEXT PRIMARY KEY,
+            prompt_text TEXT,
+            child_name TEXT,
+            language TEXT,
+            story_json TEXT,
+            signature TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    try:
+        await execute("ALTER TABLE prompt_cache ADD COLUMN signature TEXT")
+    except Exception:
+        pass  # Column already exists
+    # Durable background story jobs (see jobs.py)
+    await execute("""
+        CREATE TABLE IF NOT EXISTS story_jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            phase TEXT,
+            request_json TEXT NOT NULL,
+            checkpoint_json TEXT,
+            result_json TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL DEFAULT 0,
+            lease_owner TEXT,
+            lease_expires REAL,
+            story_id INTEGER,
+            user_id INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # story_id is set in the same batch as the story INSERT, so a retried job never saves its story
+    # twice; user_id is the signed-in submitter, who will own the story (see jobs.py)
+    for column in ("story_id", "user_id"):
+        try:
+            await execute(f"ALTER TABLE story_jobs ADD COLUMN {column} INTEGER")
+        except Exception:
+            pass  # Column already exists
+    await execute("CREATE INDEX IF NOT EXISTS idx_story_jobs_status ON story_jobs (status, created_at)")
+    # Advisory locks so only one worker generates a given prompt at a time (see singleflight.py)
+    await execute("""
+        CREATE TABLE IF NOT EXISTS generation_locks (
+            key TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+    # Reusable ambient SFX / lullabies, matched by prompt and mood tags (see sound_library.py)
+    await execute("""
+        CREATE TABLE IF NOT EXISTS sound_library (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            normalized TEXT NOT NULL,
+            tags TEXT NOT NULL,
+            signature TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            duration_seconds REAL,
+            uses INTEGER NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (kind, normalized)
+        )
+    """)
+    await init_conversations()
+    # Mistral agents created by this app, keyed by definition fingerprint (see agent_registry.py)
+    await execute("""
+        CREATE TABLE IF NOT EXISTS agent_registry (
+            name TEXT PRIMARY KEY,
+            agent_id TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+
+async def init_conversations():
+    """Create the Mistral conversation registry shared by team.py and the server (see conversations.py)."""
+    await execute("""
+        CREATE TABLE IF NOT EXISTS agent_conversations (
+            conversation_id TEXT PRIMARY KEY,
+            agent TEXT NOT NULL,
+            agent_id TEXT,
+            turns INTEGER NOT NULL DEFAULT 1,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        )
+    """)
+    await execute("CREATE INDEX IF NOT EXISTS idx_agent_conversations_agent ON agent_conversations (agent, last_used)")
+    await execute("CREATE INDEX IF NOT EXISTS idx_agent_conversations_last_used ON agent_conversations (last_used)")
 
 async def close():
-    global _turso_client
+    global _turso_client, _sqlite_pool
     if _turso_client:
         await _turso_client.close()
         _turso_client = None
+    if _sqlite_pool:
+        await _sqlite_pool.close()
+        _sqlite_pool = None
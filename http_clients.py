@@ -0,0 +1,77 @@
+"""
+Upstream HTTP client registry — one pooled, keep-alive AsyncClient per upstream host.
+Created at app startup, closed at shutdown, so calls reuse DNS/TCP/TLS instead of
+paying for a fresh connection every time. Every request is scheduled by
+rate_limit (per-upstream quotas, priorities, Retry-After).
+
+Tuning (env):
+  HTTP_MAX_CONNECTIONS      max open connections per upstream (default 20)
+  HTTP_MAX_KEEPALIVE        idle keep-alive connections kept per upstream (default 10)
+  HTTP_KEEPALIVE_EXPIRY     seconds an idle connection is kept (default 60)
+  HTTP_CONNECT_RETRIES      connection-level retries on connect errors (default 2)
+  HTTP_TIMEOUT_<UPSTREAM>   default request timeout, e.g. HTTP_TIMEOUT_GEMINI=90
+  HTTP2                     set to 0 to disable HTTP/2 (enabled when `h2` is installed)
+"""
+import os
+import httpx
+import rate_limit
+
+UPSTREAMS = {
+    "elevenlabs": {"host": "api.elevenlabs.io", "timeout": 30},
+    "mistral": {"host": "api.mistral.ai", "timeout": 60},
+    "tavily": {"host": "api.tavily.com", "timeout": 15},
+    "gemini": {"host": "generativelanguage.googleapis.com", "timeout": 60},
+}
+
+MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 20))
+MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", 10))
+KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 60))
+CONNECT_RETRIES = int(os.environ.get("HTTP_CONNECT_RETRIES", 2))
+
+try:
+    import h2  # noqa: F401 — presence enables HTTP/2
+    HTTP2 = os.environ.get("HTTP2", "1") != "0"
+except ImportError:
+    HTTP2 = False
+
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def _timeout(name: str) -> float:
+    return float(os.environ.get(f"HTTP_TIMEOUT_{name.upper()}", UPSTREAMS[name]["timeout"]))
+
+
+def _create(name: str) -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE,
+                          keepalive_expiry=KEEPALIVE_EXPIRY)
+    transport = rate_limit.RateLimitedTransport(
+        httpx.AsyncHTTPTransport(http2=HTTP2, limits=limits, retries=CONNECT_RETRIES))
+    return httpx.AsyncClient(transport=transport, timeout=_timeout(name), follow_redirects=True)
+
+
+def get(name: str) -> httpx.AsyncClient:
+    """Return the pooled client for an upstream ("elevenlabs", "mistral", "tavily", "gemini")."""
+    if name not in UPSTREAMS:
+        raise KeyError(f"Unknown upstream: {name}")
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _clients[name] = _create(name)
+    return client
+
+
+def mistral(api_key: str, server_url: str = None):
+    """Mistral SDK client whose async calls go through the pooled Mistral connection."""
+    from mistralai import Mistral
+    return Mistral(api_key=api_key, async_client=get("mistral"), server_url=server_url or None)
+
+
+async def startup():
+    for name in UPSTREAMS:
+        get(name)
+
+
+async def close():
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
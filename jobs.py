@@ -0,0 +1,304 @@
+"""
+Durable story jobs — /api/orchestrate without holding the HTTP request open.
+
+POST /api/jobs/story queues a row in `story_jobs` and returns at once; a pool
+of JOB_CONCURRENCY workers per process claims queued jobs and runs the
+orchestrator graph, checkpointing each finished phase (plan, story, prompts,
+asset blob refs) back to the row. Workers hold a lease renewed by heartbeat:
+a job whose worker died or restarted is picked up again once the lease
+expires and resumes from its checkpoint instead of starting over.
+
+The story INSERT records the new id on the job row in the same batch, so
+an attempt that dies after saving is finished from that story rather than
+saving a duplicate. Failures a retry cannot fix (missing API keys, 4xx from
+an upstream) fail the job at once instead of using up its attempts.
+"""
+import os
+import asyncio
+import json
+import socket
+import time
+import uuid
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from starlette.responses import StreamingResponse
+import database as db
+import prompt_cache
+import orchestrator
+import pipeline
+import rate_limit
+import sessions
+
+router = APIRouter()
+
+CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", 2))
+MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", 60))
+POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 2.0))
+RETRY_BACKOFF = float(os.environ.get("JOB_RETRY_BACKOFF", 5.0))
+
+_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+_workers: list[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+_subscribers: dict[str, set[asyncio.Queue]] = {}  # job id -> progress queues of local SSE clients
+_running: set[str] = set()
+
+_COLUMNS = "id, status, phase, request_json, checkpoint_json, result_json, error, attempts, created_at, updated_at"
+
+
+def _row_to_job(row) -> dict:
+    job_id, status, phase, request_json, checkpoint_json, result_json, error, attempts, created_at, updated_at = row
+    checkpoint = json.loads(checkpoint_json) if checkpoint_json else {}
+    return {
+        "id": job_id, "status": status, "phase": phase, "attempts": attempts, "error": error,
+        "request": json.loads(request_json),
+        "completed": sorted([*checkpoint.get("nodes", {}), *checkpoint.get("assets", {})]),
+        "result": json.loads(result_json) if result_json else None,
+        "created_at": created_at, "updated_at": updated_at,
+    }
+
+
+async def get_job(job_id: str) -> Optional[dict]:
+    rs = await db.execute(f"SELECT {_COLUMNS} FROM story_jobs WHERE id = ?", [job_id])
+    return _row_to_job(rs.rows[0]) if rs.rows else None
+
+
+def _publish(job_id: str, event: str, data: dict):
+    for queue in _subscribers.get(job_id, ()):
+        queue.put_nowait((event, data))
+
+
+async def submit(req: orchestrator.OrchestrateRequest, user_id: Optional[int] = None) -> str:
+    job_id = uuid.uuid4().hex
+    await db.execute(
+        "INSERT INTO story_jobs (id, status, request_json, run_after, user_id) VALUES (?, 'queued', ?, ?, ?)",
+        [job_id, req.model_dump_json(), time.time(), user_id]
+    )
+    if _wakeup is not None:
+        _wakeup.set()
+    return job_id
+
+
+async def _claim() -> Optional[tuple]:
+    """Take the oldest runnable job: queued and due, or running under an expired lease."""
+    now = time.time()
+    rs = await db.execute(
+        "SELECT id, request_json, checkpoint_json, attempts, story_id, user_id FROM story_jobs "
+        "WHERE (status = 'queued' AND run_after <= ?) OR (status = 'running' AND lease_expires < ?) "
+        "ORDER BY created_at, rowid LIMIT 1",
+        [now, now]
+    )
+    if not rs.rows:
+        return None
+    job_id, request_json, checkpoint_json, attempts, story_id, user_id = rs.rows[0]
+    claimed = await db.execute(
+        "UPDATE story_jobs SET status = 'running', lease_owner = ?, lease_expires = ?, attempts = attempts + 1, "
+        "updated_at = CURRENT_TIMESTAMP "
+        "WHERE id = ? AND ((status = 'queued' AND run_after <= ?) OR (status = 'running' AND lease_expires < ?))",
+        [_OWNER, now + LEASE_SECONDS, job_id, now, now]
+    )
+    if claimed.rows_affected != 1:
+        return None  # Another worker got there first
+    return job_id, request_json, checkpoint_json, attempts + 1, story_id, user_id
+
+
+async def _heartbeat(job_id: str):
+    while True:
+        await asyncio.sleep(LEASE_SECONDS / 3)
+        try:
+            await db.execute(
+                "UPDATE story_jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ?",
+                [time.time() + LEASE_SECONDS, job_id, _OWNER]
+            )
+        except Exception as e:
+            print(f"⚠️ job {job_id[:8]} heartbeat: {e}")
+
+
+def _permanent(error: Exception) -> bool:
+    """Failures a retry cannot fix: missing configuration, or a 4xx (other than 408/429) from us or an upstream."""
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if isinstance(status, int) and 400 <= status < 500 and status not in (408, 429):
+        return True
+    detail = getattr(error, "detail", None) or str(error)
+    return isinstance(detail, str) and detail.endswith("not set")  # e.g. "MISTRAL_API_KEY not set"
+
+
+async def _saved_result(story_id: int, req: orchestrator.OrchestrateRequest) -> Optional[dict]:
+    """Result for a job whose story an earlier attempt saved before dying."""
+    rs = await db.execute("SELECT title, content FROM stories WHERE id = ?", [story_id])
+    if not rs.rows:
+        return None
+    title, content = rs.rows[0]
+    scenes, mood = pipeline._parse_content(content)
+    result = await orchestrator._cached_response({"id": story_id, "title": title, "scenes": scenes, "mood": mood}, req)
+    return {**result, "cached": False, "orchestration": {"source": "saved_by_earlier_attempt"}}
+
+
+async def _run(job_id: str, request_json: str, checkpoint_json: Optional[str], attempt: int,
+               story_id: Optional[int] = None, user_id: Optional[int] = None):
+    req = orchestrator.OrchestrateRequest.model_validate_json(request_json)
+    checkpoint = json.loads(checkpoint_json) if checkpoint_json else None
+    _running.add(job_id)
+    heartbeat = asyncio.create_task(_heartbeat(job_id))
+    _publish(job_id, "status", {"status": "running", "attempt": attempt, "resumed": bool(checkpoint)})
+
+    async def save(node: str, state: dict):
+        await db.execute(
+            "UPDATE story_jobs SET phase = ?, checkpoint_json = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            [node, json.dumps(state, ensure_ascii=False), job_id]
+        )
+
+    async def produce() -> dict:
+        if story_id:
+            saved = await _saved_result(story_id, req)
+            if saved is not None:
+                return saved
+        cached = None
+        if req.regenerate and not checkpoint:
+            prompt_cache.invalidate(req.prompt, req.child_name, req.language)
+        elif not req.regenerate:
+            cached = await prompt_cache.get_cached(req.prompt, req.child_name, req.language)
+        if cached:
+            return await orchestrator._cached_response(cached, req)
+        return await orchestrator._generate_story(
+            req, lambda e, d: _publish(job_id, e, d), checkpoint, save, user_id=user_id,
+            on_insert=("UPDATE story_jobs SET story_id = last_insert_rowid(), phase = 'saved', "
+                       "updated_at = CURRENT_TIMESTAMP WHERE id = ?", [job_id]))
+
+    try:
+        result = await produce()
+        await db.execute(
+            "UPDATE story_jobs SET status = 'done', phase = 'saved', result_json = ?, error = NULL, lease_owner = NULL, "
+            "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            [json.dumps(result, ensure_ascii=False), job_id]
+        )
+        _publish(job_id, "done", result)
+    except asyncio.CancelledError:
+        # Shutting down: hand the job back so the next worker resumes it right away
+        await db.execute(
+            "UPDATE story_jobs SET status = 'queued', attempts = attempts - 1, lease_owner = NULL, "
+            "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            [job_id]
+        )
+        raise
+    except Exception as e:
+        detail = getattr(e, "detail", None) or str(e)
+        final = attempt >= MAX_ATTEMPTS or _permanent(e)
+        print(f"⚠️ job {job_id[:8]} attempt {attempt}/{MAX_ATTEMPTS} failed: {detail}")
+        await db.execute(
+            "UPDATE story_jobs SET status = ?, error = ?, run_after = ?, lease_owner = NULL, "
+            "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            ["failed" if final else "queued", str(detail)[:500], time.time() + RETRY_BACKOFF * 2 ** (attempt - 1), job_id]
+        )
+        _publish(job_id, "error" if final else "retry", {"detail": str(detail)[:500], "attempt": attempt})
+    finally:
+        heartbeat.cancel()
+        _running.discard(job_id)
+
+
+async def _worker():
+    while True:
+        _wakeup.clear()
+        try:
+            claimed = await _claim()
+            if claimed:
+                with rate_limit.priority(rate_limit.BACKGROUND):  # Interactive requests go first
+                    await _run(*claimed)
+                continue
+        except Exception as e:
+            print(f"⚠️ job worker: {e}")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def start():
+    """Start the worker pool (after db.init_db). Unfinished jobs are resumed as leases expire."""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    _workers.extend(asyncio.create_task(_worker()) for _ in range(CONCURRENCY))
+
+
+async def stop():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+
+def stats() -> dict:
+    return {"workers": len(_workers), "concurrency": CONCURRENCY, "running": len(_running)}
+
+
+# --- API ---
+@router.post("/api/jobs/story", status_code=202)
+async def create_story_job(req: orchestrator.OrchestrateRequest, user: Optional[dict] = Depends(sessions.optional_user)):
+    """Queue a full orchestration; poll GET /api/jobs/{id} or stream /api/jobs/{id}/events."""
+    job_id = await submit(req, user["id"] if user else None)
+    return {"job_id": job_id, "status": "queued",
+            "status_url": f"/api/jobs/{job_id}", "events_url": f"/api/jobs/{job_id}/events"}
+
+
+@router.get("/api/jobs/{job_id}")
+async def read_job(job_id: str):
+    job = await get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Server-Sent Events: `status` snapshots, the orchestrator's progress events
+    (plan, title, scene, audio, illustration, ...) while this process runs the
+    job, `retry`, and finally `done` (result) or `error`.
+    """
+    job = await get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    queue: asyncio.Queue = asyncio.Queue()
+    _subscribers.setdefault(job_id, set()).add(queue)
+
+    def sse(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def events():
+        snapshot = job
+        last = None
+        try:
+            while True:
+                state = (snapshot["status"], snapshot["phase"], snapshot["attempts"])
+                if state != last:
+                    last = state
+                    yield sse("status", {k: snapshot[k] for k in ("status", "phase", "attempts", "completed", "error")})
+                if snapshot["status"] == "done":
+                    yield sse("done", snapshot["result"])
+                    return
+                if snapshot["status"] == "failed":
+                    yield sse("error", {"detail": snapshot["error"], "attempt": snapshot["attempts"]})
+                    return
+                try:
+                    # Live events when the job runs here; otherwise (other worker) fall back to polling
+                    while True:
+                        event, data = await asyncio.wait_for(queue.get(), timeout=POLL_INTERVAL)
+                        if event in ("done", "error"):
+                            yield sse(event, data)
+                            return
+                        if event != "status":
+                            yield sse(event, data)
+                        if event in ("status", "retry"):
+                            break
+                except asyncio.TimeoutError:
+                    pass
+                snapshot = await get_job(job_id) or snapshot
+        finally:
+            subscribers = _subscribers.get(job_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del _subscribers[job_id]
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
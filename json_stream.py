@@ -0,0 +1,128 @@
+"""
+Incremental JSON parsing for streamed story output.
+Anansi's reply looks like {"title": "...", "scenes": ["...", ...], "mood": "..."};
+ScenesParser surfaces each scene's text while the model is still writing it,
+and SentenceBuffer cuts that text into sentences ready for TTS.
+"""
+import re
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'”’»)]*(?:\s+|$)|[。！？]+[」』”)]*")
+
+
+def _is_high(c: str) -> bool:
+    return len(c) == 1 and 0xD800 <= ord(c) <= 0xDBFF
+
+
+class ScenesParser:
+    """
+    Feed raw token text with `feed(chunk)`; each call returns a list of events:
+      ("scene_delta", index, text)  — more text of scene `index`
+      ("scene", index, text)        — scene `index` is complete
+      ("field", key, value)         — a top-level string field (title, mood) is complete
+    Anything outside the top-level object (e.g. markdown fences) is ignored.
+    """
+
+    def __init__(self):
+        self._stack: list[str] = []
+        self._key = None
+        self._expect_key = False
+        self._in_string = False
+        self._is_key = False
+        self._escape = None
+        self._buf: list[str] = []
+        self._emitted = 0
+        self.scene_count = 0
+
+    def _in_scenes(self) -> bool:
+        return self._stack == ["{", "["] and self._key == "scenes"
+
+    def _close_string(self, events: list):
+        value = "".join(self._buf).encode("utf-16", "surrogatepass").decode("utf-16", "replace")
+        depth1 = self._stack == ["{"]
+        if self._is_key:
+            if depth1:
+                self._key = value
+        elif depth1:
+            events.append(("field", self._key, value))
+        elif self._in_scenes():
+            index = self.scene_count - 1
+            if len(self._buf) > self._emitted:
+                events.append(("scene_delta", index, "".join(self._buf[self._emitted:])))
+            events.append(("scene", index, value))
+
+    def feed(self, chunk: str) -> list[tuple]:
+        events: list[tuple] = []
+        for c in chunk:
+            if self._in_string:
+                if self._escape is not None:
+                    if self._escape == "" and c != "u":
+                        self._buf.append(_ESCAPES.get(c, c))
+                        self._escape = None
+                    else:
+                        self._escape += c
+                        if len(self._escape) == 5:  # uXXXX
+                            try:
+                                code = int(self._escape[1:], 16)
+                            except ValueError:
+                                code = None
+                            if code is not None and 0xDC00 <= code <= 0xDFFF and self._buf and _is_high(self._buf[-1]):
+                                # Second half of an escaped surrogate pair (emoji etc.): join them
+                                high = ord(self._buf[-1])
+                                self._buf[-1] = chr(0x10000 + ((high - 0xD800) << 10) + (code - 0xDC00))
+                            elif code is not None:
+                                self._buf.append(chr(code))
+                            self._escape = None
+                elif c == "\\":
+                    self._escape = ""
+                elif c == '"':
+                    self._in_string = False
+                    self._close_string(events)
+                else:
+                    self._buf.append(c)
+                continue
+            if c == '"':
+                self._in_string = True
+                self._buf, self._emitted = [], 0
+                self._is_key = bool(self._stack) and self._stack[-1] == "{" and self._expect_key
+                if not self._is_key and self._in_scenes():
+                    self.scene_count += 1
+            elif c in "{[":
+                self._stack.append(c)
+                self._expect_key = c == "{"
+            elif c in "}]":
+                if self._stack:
+                    self._stack.pop()
+                self._expect_key = False
+            elif c == ":":
+                self._expect_key = False
+            elif c == "," and self._stack and self._stack[-1] == "{":
+                self._expect_key = True
+        # Hold back a trailing high surrogate until its pair arrives
+        end = len(self._buf) - 1 if self._buf and _is_high(self._buf[-1]) else len(self._buf)
+        if self._in_string and not self._is_key and self._in_scenes() and end > self._emitted:
+            events.append(("scene_delta", self.scene_count - 1, "".join(self._buf[self._emitted:end])))
+            self._emitted = end
+        return events
+
+
+class SentenceBuffer:
+    """Accumulates streamed text and releases complete sentences."""
+
+    def __init__(self):
+        self._text = ""
+
+    def push(self, text: str) -> list[str]:
+        self._text += text
+        sentences, start = [], 0
+        for m in _SENTENCE_END.finditer(self._text):
+            if m.end() == len(self._text) and not m.group().endswith((" ", "\n")):
+                break  # "Dr." or "..." may continue in the next chunk
+            sentences.append(self._text[start:m.end()].strip())
+            start = m.end()
+        self._text = self._text[start:]
+        return [s for s in sentences if s]
+
+    def flush(self) -> str:
+        rest, self._text = self._text.strip(), ""
+        return rest
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Sandman Tales — Load Test
+
+Usage:
+  python3 load_test.py health [BASE_URL] [N_ORCHESTRATIONS]
+      Samples /api/health latency on its own, then again while N /api/orchestrate
+      generations run on the same worker — checks the event loop stays responsive.
+      Each orchestration is a fresh (uncached) generation and spends API credits.
+
+  python3 load_test.py story [BASE_URL] [STORY_ID] [CONCURRENCY] [SECONDS]
+      Hammers GET /api/stories/{id} and reports requests/sec and latency.
+      Run against two builds to compare before/after.
+
+  python3 load_test.py library [BASE_URL] [PAGE_SIZE] [MAX_PAGES]
+      Walks GET /api/stories page by page via X-Next-Cursor and reports per-page
+      latency; with keyset pagination the last page costs the same as the first.
+
+  python3 load_test.py memory [BASE_URL] [N_ORCHESTRATIONS]
+      Runs N concurrent /api/orchestrate generations while sampling the worker's
+      RSS from /api/health, and compares the memory they added with the size of
+      the assets they produced (assets should go to storage, not stay in memory).
+      Use a freshly started single-worker server; spends API credits like `health`.
+
+  python3 load_test.py login [BASE_URL] [CONCURRENCY] [SECONDS]
+      Samples /api/health and GET /api/stories while CONCURRENCY clients log in
+      back to back (demo account), and reports login throughput and latency.
+      Password hashing runs off the event loop, so the other routes should stay flat.
+
+  python3 load_test.py agents [N_CALLS]
+      Per-call overhead of asking an agent, against a local stand-in for the
+      Mistral Conversations API (no server, no credits): one interpreter per call
+      (`team.py`, as the old /api/story did), the warm in-process agent_client,
+      and agent_client's worker mode.
+
+  python3 load_test.py routes [BASE_URL] [STORY_ID] [CONCURRENCY] [SECONDS]
+      Per-route p50/p95 and req/s for the hot read endpoints (health, library page,
+      story detail, one story audio asset), each hammered in turn.
+"""
+import asyncio, statistics, sys, time, uuid
+import httpx
+
+SAMPLE_INTERVAL = 0.1
+
+
+def summarize(label, samples):
+    if not samples:
+        print(f"  {label}: no samples")
+        return None
+    ms = sorted(s * 1000 for s in samples)
+    p50 = statistics.median(ms)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    print(f"  {label}: n={len(ms)} p50={p50:.1f}ms p95={p95:.1f}ms max={ms[-1]:.1f}ms")
+    return p95
+
+
+# ── health: event-loop responsiveness under orchestration load ──
+
+async def sample_health(c, base, stop: asyncio.Event):
+    samples = []
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        r = await c.get(f"{base}/api/health")
+        if r.status_code == 200:
+            samples.append(time.perf_counter() - t0)
+        await asyncio.sleep(SAMPLE_INTERVAL)
+    return samples
+
+
+async def orchestrate(c, base, i):
+    t0 = time.perf_counter()
+    r = await c.post(f"{base}/api/orchestrate", json={
+        "child_name": "LoadTest", "language": "en",
+        "prompt": f"LoadTest loves lanterns and owls ({uuid.uuid4().hex[:8]})"
+    })
+    print(f"  orchestration {i}: HTTP {r.status_code} in {time.perf_counter() - t0:.1f}s")
+
+
+async def health_test(base, n_orch=4):
+    print(f"\n🧪 Load Test: {base} ({n_orch} concurrent orchestrations)\n")
+    async with httpx.AsyncClient(timeout=300) as c:
+        print("── Baseline /api/health ──")
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_health(c, base, stop))
+        await asyncio.sleep(3)
+        stop.set()
+        baseline = summarize("idle", await sampler)
+
+        print("\n── /api/health under orchestration load ──")
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_health(c, base, stop))
+        await asyncio.gather(*(orchestrate(c, base, i) for i in range(n_orch)))
+        stop.set()
+        loaded = summarize("loaded", await sampler)
+
+    if baseline and loaded:
+        ratio = loaded / baseline
+        print(f"\n{'='*50}")
+        print(f"p95 ratio loaded/idle: {ratio:.1f}x {'✅ flat' if loaded < max(50.0, baseline * 3) else '❌ event loop stalls'}")
+    print()
+
+
+# ── story: /api/stories/{id} throughput ──
+
+async def hammer(c, url, deadline, samples, errors):
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        r = await c.get(url)
+        if r.status_code == 200:
+            samples.append(time.perf_counter() - t0)
+        else:
+            errors.append(r.status_code)
+
+
+async def story_test(base, story_id=1, concurrency=16, seconds=10.0):
+    url = f"{base}/api/stories/{story_id}"
+    print(f"\n🧪 Throughput: GET {url} ({concurrency} concurrent, {seconds:.0f}s)\n")
+    samples, errors = [], []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=30, limits=limits) as c:
+        await c.get(url)  # warm up
+        t0 = time.perf_counter()
+        deadline = t0 + seconds
+        await asyncio.gather(*(hammer(c, url, deadline, samples, errors) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+    summarize("latency", samples)
+    print(f"  throughput: {len(samples) / elapsed:.0f} req/s ({len(errors)} errors)\n")
+
+
+# ── library: keyset pagination over /api/stories ──
+
+async def library_test(base, page_size=50, max_pages=200):
+    print(f"\n🧪 Library: {base}/api/stories (limit={page_size}, up to {max_pages} pages)\n")
+    samples, stories, cursor = [], 0, None
+    async with httpx.AsyncClient(timeout=30) as c:
+        for _ in range(max_pages):
+            params = {"limit": page_size, **({"cursor": cursor} if cursor else {})}
+            t0 = time.perf_counter()
+            r = await c.get(f"{base}/api/stories", params=params)
+            samples.append(time.perf_counter() - t0)
+            r.raise_for_status()
+            stories += len(r.json())
+            cursor = r.headers.get("x-next-cursor")
+            if not cursor:
+                break
+    summarize(f"{len(samples)} pages, {stories} stories", samples)
+    if len(samples) >= 4:
+        first, last = samples[:len(samples) // 4], samples[-(len(samples) // 4):]
+        print(f"  first quarter avg {statistics.mean(first) * 1000:.1f}ms, last quarter avg {statistics.mean(last) * 1000:.1f}ms")
+    print()
+
+
+# ── login: PBKDF2 logins alongside normal traffic ──
+
+DEMO_LOGIN = {"email": "demo@sandmantales.demo", "password": "demo1234"}
+
+
+async def login_loop(c, base, deadline, samples, errors):
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        r = await c.post(f"{base}/api/auth/login", json=DEMO_LOGIN)
+        if r.status_code == 200:
+            samples.append(time.perf_counter() - t0)
+        else:
+            errors.append(r.status_code)
+
+
+async def login_test(base, concurrency=8, seconds=10.0):
+    print(f"\n🧪 Logins: {base} ({concurrency} concurrent logins, {seconds:.0f}s)\n")
+    async with httpx.AsyncClient(timeout=60) as c:
+        print("── Baseline ──")
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_health(c, base, stop))
+        deadline = time.perf_counter() + 3
+        library = []
+        await hammer(c, f"{base}/api/stories?limit=20", deadline, library, [])
+        stop.set()
+        baseline = summarize("/api/health idle", await sampler)
+        summarize("/api/stories idle", library)
+
+        print("\n── During logins ──")
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_health(c, base, stop))
+        logins, errors, library = [], [], []
+        t0 = time.perf_counter()
+        deadline = t0 + seconds
+        await asyncio.gather(
+            hammer(c, f"{base}/api/stories?limit=20", deadline, library, []),
+            *(login_loop(c, base, deadline, logins, errors) for _ in range(concurrency)),
+        )
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        loaded = summarize("/api/health", await sampler)
+        summarize("/api/stories", library)
+        summarize("/api/auth/login", logins)
+        print(f"  logins: {len(logins) / elapsed:.1f}/s ({len(errors)} errors)")
+
+    if baseline and loaded:
+        print(f"\n{'='*50}")
+        print(f"health p95 during/idle: {loaded / baseline:.1f}x "
+              f"{'✅ flat' if loaded < max(50.0, baseline * 3) else '❌ event loop stalls'}")
+    print()
+
+
+# ── routes: latency of each hot read endpoint ──
+
+async def routes_test(base, story_id=1, concurrency=8, seconds=5.0):
+    print(f"\n🧪 Routes: {base} ({concurrency} concurrent, {seconds:.0f}s per route)\n")
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=30, limits=limits) as c:
+        routes = ["/api/health", "/api/stories?limit=20", f"/api/stories/{story_id}"]
+        r = await c.get(f"{base}/api/stories/{story_id}")
+        if r.status_code == 200 and r.json().get("has_audio"):
+            routes.append(f"/api/stories/{story_id}/audio/{next(iter(r.json()['has_audio']))}")
+        for route in routes:
+            url = f"{base}{route}"
+            await c.get(url)  # warm up
+            samples, errors = [], []
+            t0 = time.perf_counter()
+            deadline = t0 + seconds
+            await asyncio.gather(*(hammer(c, url, deadline, samples, errors) for _ in range(concurrency)))
+            elapsed = time.perf_counter() - t0
+            summarize(f"GET {route}", samples)
+            print(f"    {len(samples) / elapsed:.0f} req/s ({len(errors)} errors)")
+    print()
+
+
+# ── agents: per-call overhead, subprocess vs. in-process vs. worker ──
+
+STUB_CONVERSATION = {
+    "object": "conversation.response", "conversation_id": "conv_loadtest",
+    "outputs": [{"object": "entry", "type": "message.output", "role": "assistant", "id": "msg_loadtest",
+                 "created_at": "2026-01-01T00:00:00Z", "completed_at": "2026-01-01T00:00:00Z",
+                 "agent_id": "ag_loadtest", "model": "mistral-large-latest",
+                 "content": '{"title": "Lanterns", "scenes": ["s1", "s2", "s3", "s4"], "mood": "calm"}'}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 20, "total_tokens": 30},
+}
+
+
+def stub_mistral():
+    """Answer every POST with STUB_CONVERSATION on a local port; returns the server (daemon thread)."""
+    import json, threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    body = json.dumps(STUB_CONVERSATION).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # Headers and body go out as separate writes
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("content-length", 0)))
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def agents_test(n=20):
+    import os
+    server = stub_mistral()
+    os.environ["MISTRAL_SERVER_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.setdefault("MISTRAL_API_KEY", "loadtest")
+    import agent_client, http_clients
+    agent_client.SERVER_URL, agent_client.MISTRAL_API_KEY = os.environ["MISTRAL_SERVER_URL"], os.environ["MISTRAL_API_KEY"]
+    team = os.path.join(os.path.dirname(os.path.abspath(__file__)), "team.py")
+    message = "Tell a bedtime story about lanterns"
+    print(f"\n🧪 Agent call overhead ({n} calls each, stub API at {os.environ['MISTRAL_SERVER_URL']})\n")
+
+    spawn = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(sys.executable, team, "anansi", message,
+                                                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        out, _ = await proc.communicate()
+        spawn.append(time.perf_counter() - t0)
+        assert b"Conversation ID" in out, out[-300:]
+    before = summarize("subprocess per call (team.py)", spawn)
+
+    results = {}
+    for mode in ("inprocess", "worker"):
+        agent_client.MODE = mode
+        await agent_client.start()
+        await agent_client.ask("anansi", message)  # warm up
+        samples = []
+        for _ in range(n):
+            t0 = time.perf_counter()
+            reply = await agent_client.ask("anansi", message)
+            samples.append(time.perf_counter() - t0)
+            assert reply.kind == "text" and reply.conversation_id == "conv_loadtest"
+        results[mode] = summarize(f"agent_client {mode}", samples)
+        await agent_client.stop()
+    await http_clients.close()
+    server.shutdown()
+    if before:
+        print(f"\n  overhead removed per story: {before - results['inprocess']:.0f}ms at p95 "
+              f"({before / results['inprocess']:.0f}x)")
+    print()
+
+
+# ── memory: RSS per generation vs. asset bytes produced ──
+
+async def sample_rss(c, base, stop: asyncio.Event):
+    peak = 0.0
+    while not stop.is_set():
+        r = await c.get(f"{base}/api/health")
+        if r.status_code == 200:
+            peak = max(peak, r.json()["memory"]["rss_mb"] or 0.0)
+        await asyncio.sleep(SAMPLE_INTERVAL)
+    return peak
+
+
+async def orchestrate_assets(c, base, i):
+    t0 = time.perf_counter()
+    r = await c.post(f"{base}/api/orchestrate", json={
+        "child_name": "LoadTest", "language": "en",
+        "prompt": f"LoadTest loves lanterns and owls ({uuid.uuid4().hex[:8]})"
+    })
+    body = r.json() if r.status_code == 200 else {}
+    assets = body.get("assets", {})
+    size = sum(a.get("size", 0) for group in assets.values() for a in group.values())
+    print(f"  orchestration {i}: HTTP {r.status_code} in {time.perf_counter() - t0:.1f}s, "
+          f"response {len(r.content) / 1024:.1f}KB, assets {size / 1024 / 1024:.2f}MB")
+    return size
+
+
+async def memory_test(base, n_orch=4):
+    print(f"\n🧪 Memory: {base} ({n_orch} concurrent orchestrations)\n")
+    async with httpx.AsyncClient(timeout=300) as c:
+        before = (await c.get(f"{base}/api/health")).json()["memory"]
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_rss(c, base, stop))
+        sizes = await asyncio.gather(*(orchestrate_assets(c, base, i) for i in range(n_orch)))
+        stop.set()
+        sampled_peak = await sampler
+        after = (await c.get(f"{base}/api/health")).json()["memory"]
+
+    asset_mb = sum(sizes) / 1024 / 1024
+    grew_mb = max(after["peak_rss_mb"], sampled_peak) - before["rss_mb"]
+    print(f"\n  rss before: {before['rss_mb']}MB, peak during: {max(after['peak_rss_mb'], sampled_peak):.1f}MB "
+          f"(+{grew_mb:.1f}MB), after: {after['rss_mb']}MB")
+    print(f"  assets produced: {asset_mb:.2f}MB")
+    if asset_mb:
+        ratio = grew_mb / asset_mb
+        print(f"\n{'='*50}")
+        print(f"peak growth / asset bytes: {ratio:.2f}x {'✅ bounded' if ratio <= 1.5 else '❌ assets held in memory'}")
+    print()
+
+
+if __name__ == "__main__":
+    mode = sys.argv[1] if len(sys.argv) > 1 else "health"
+    base = sys.argv[2] if len(sys.argv) > 2 else "http://localhost:8001"
+    if mode == "health":
+        asyncio.run(health_test(base, *(int(a) for a in sys.argv[3:4])))
+    elif mode == "library":
+        asyncio.run(library_test(base, *(int(a) for a in sys.argv[3:5])))
+    elif mode == "memory":
+        asyncio.run(memory_test(base, *(int(a) for a in sys.argv[3:4])))
+    elif mode == "login":
+        args = sys.argv[3:]
+        asyncio.run(login_test(base, *(int(a) for a in args[:1]), *(float(a) for a in args[1:2])))
+    elif mode == "agents":
+        asyncio.run(agents_test(*(int(a) for a in sys.argv[2:3])))
+    elif mode == "routes":
+        args = sys.argv[3:]
+        asyncio.run(routes_test(base, *(int(a) for a in args[:2]), *(float(a) for a in args[2:3])))
+    elif mode == "story":
+        args = sys.argv[3:]
+        asyncio.run(story_test(base, *(int(a) for a in args[:2]), *(float(a) for a in args[2:3])))
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,55 @@
+"""
+LRU with per-entry TTL — the in-process tier shared by prompt_cache, sessions and tts_cache.
+"""
+import time
+from collections import OrderedDict
+
+MISSING = object()  # get() result for absent or expired keys (None is a valid cached value)
+
+
+class LRUCache:
+    """LRU with per-entry TTL, bounded by entry count and approximate byte size."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data: OrderedDict[str, tuple] = OrderedDict()  # key -> (value, size, expires_at)
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return MISSING
+        value, size, expires_at = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            return MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value, size: int, ttl: float):
+        if key in self._data:
+            self._remove(key)
+        if size > self.max_bytes:
+            return
+        self._data[key] = (value, size, time.monotonic() + ttl)
+        self.bytes += size
+        while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def pop(self, key: str) -> bool:
+        if key in self._data:
+            self._remove(key)
+            return True
+        return False
+
+    def _remove(self, key: str):
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+Move story audio/images out of the stories.audio_cache / image_cache JSON columns
+into the content-addressed blob store (see blob_store.py).
+
+Usage: python3 migrate_assets.py [LIMIT]
+Uses the same database settings as the server (TURSO_AUTH_TOKEN → Turso, else stories.db)
+and writes blobs under BLOB_DIR.
+"""
+import asyncio, sys
+import database as db
+import blob_store
+
+
+async def main():
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    await db.init_db()
+    print(f"📦 Migrating story assets → {blob_store.BLOB_DIR} ({'turso' if db.USE_TURSO else 'sqlite'})")
+    stats = await blob_store.migrate_legacy_assets(limit)
+    print(f"✅ {stats['stories']} stories, {stats['assets']} assets, {stats['bytes'] // 1024}KB unpacked")
+    await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""
+MinHash signatures + LSH banding for cheap, offline near-duplicate matching.
+Used by the prompt cache to treat "Sophie loves whales and clouds" and
+"sophie loves clouds and whales!" as the same request.
+"""
+import hashlib
+import random
+import re
+
+NUM_PERM = 64
+BANDS = 16  # 16 bands x 4 rows: near-certain recall at similarity >= 0.8
+ROWS = NUM_PERM // BANDS
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0x5A4D)  # Fixed seed: signatures must be stable across processes
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokens(text: str) -> set[str]:
+    """Lowercased word set; punctuation and word order are ignored."""
+    return set(_TOKEN.findall(text.lower()))
+
+
+def _h64(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "big")
+
+
+def signature(text: str) -> list[int]:
+    hashes = [_h64(t) for t in tokens(text)] or [0]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS]
+
+
+def similarity(sig_a: list[int], sig_b: list[int]) -> float:
+    """Estimated Jaccard similarity of the underlying token sets."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def encode(sig: list[int]) -> str:
+    return ",".join(format(v, "x") for v in sig)
+
+
+def decode(raw: str) -> list[int] | None:
+    try:
+        sig = [int(v, 16) for v in raw.split(",")]
+    except (AttributeError, ValueError):
+        return None
+    return sig if len(sig) == NUM_PERM else None
+
+
+class LSHIndex:
+    """In-memory nearest-neighbour index: key -> signature, bucketed by band."""
+
+    def __init__(self):
+        self._sigs: dict[str, list[int]] = {}
+        self._buckets: dict[tuple, set[str]] = {}
+
+    def __len__(self):
+        return len(self._sigs)
+
+    def _bands(self, sig):
+        for b in range(BANDS):
+            yield (b, *sig[b * ROWS:(b + 1) * ROWS])
+
+    def add(self, key: str, sig: list[int]):
+        self.remove(key)
+        self._sigs[key] = sig
+        for band in self._bands(sig):
+            self._buckets.setdefault(band, set()).add(key)
+
+    def remove(self, key: str):
+        sig = self._sigs.pop(key, None)
+        if sig is None:
+            return
+        for band in self._bands(sig):
+            bucket = self._buckets.get(band)
+            if bucket:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band]
+
+    def nearest(self, sig: list[int]) -> tuple[str | None, float]:
+        candidates = set()
+        for band in self._bands(sig):
+            candidates |= self._buckets.get(band, set())
+        best, best_score = None, 0.0
+        for key in candidates:
+            score = similarity(sig, self._sigs[key])
+            if score > best_score:
+                best, best_score = key, score
+        return best, best_score
@@ -5,11 +5,26 @@ Uses Agents, Conversations, Handoffs, and Function Calling.
 import os
 import json
 import base64
-import httpx
+import asyncio
+import time
+import http_clients
+import agent_client
+import agent_registry
+import conversations
+import elevenlabs_api
+import json_stream
 from mistralai import Mistral
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from starlette.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import prompt_cache
+import blob_store
+import singleflight
+import resilience
+import tts_cache
+import sound_library
+import sessions
+from task_graph import TaskGraph
 from typing import Optional
 
 router = APIRouter()
@@ -19,15 +34,8 @@ ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY", "")
 TAVILY_API_KEY = os.environ.get("TAVILY_API_KEY", "")
 
 # Pre-registered agents on Mistral platform
-AGENTS = {
-    "papa_bois": "ag_019ca24ec2c271458172692e54fc0c94",
-    "anansi": "ag_019ca24f110677d7a92ec83a5c85704a",
-    "firefly": "ag_019ca24f601773e1a953fac560ff4d71",
-    "devi": "ag_019ca24f147876f2ab26526f6cf8c4b4",
-}
+AGENTS = agent_client.AGENTS
 
-# Dynamic handoff agents (created at startup with handoffs configured)
-HANDOFF_AGENTS = {}
 
 # ---- ElevenLabs Function Tool Definitions ----
 ELEVENLABS_TOOLS = [
@@ -94,61 +102,105 @@ ELEVENLABS_TOOLS = [
 ]
 
 # ---- Tool Execution ----
-def exec_generate_tts(text: str, voice_id: str = "FGY2WhTYpPnrIDTdsKH5", language: str = "en") -> dict:
+async def _cached_audio(key: str, prompt: str, mood: Optional[str] = None) -> Optional[bytes]:
+    """Fallback while ElevenLabs is degraded: the closest library clip, else the last stored soundscape/lullaby."""
+    data = await sound_library.closest(key, prompt, mood) or await blob_store.latest_asset_bytes(key)
+    if data:
+        print(f"⚠️ {key} upstream degraded, reusing a cached {key}")
+    return data
+
+TTS_SETTINGS = {"stability": 0.6, "similarity_boost": 0.8}
+
+async def exec_generate_tts(text: str, voice_id: str = "FGY2WhTYpPnrIDTdsKH5", language: str = "en") -> dict:
     if not ELEVENLABS_API_KEY:
         return {"error": "ELEVENLABS_API_KEY not set"}
-    try:
-        r = httpx.post(f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
+    async def request():
+        r = await http_clients.get("elevenlabs").post(f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
             headers={"xi-api-key": ELEVENLABS_API_KEY, "Content-Type": "application/json"},
-            json={"text": text, "model_id": "eleven_multilingual_v2",
-                  "voice_settings": {"stability": 0.6, "similarity_boost": 0.8}},
+            json={"text": text, "model_id": tts_cache.DEFAULT_MODEL, "voice_settings": TTS_SETTINGS},
             timeout=30)
-        if r.status_code == 200:
-            return {"audio_b64": base64.b64encode(r.content).decode(), "size_kb": len(r.content) // 1024}
-        return {"error": f"TTS {r.status_code}: {r.text[:200]}"}
+        return resilience.check(r, "TTS").content
+    try:
+        audio = await tts_cache.synthesize(text, voice_id, tts_cache.DEFAULT_MODEL, TTS_SETTINGS,
+                                           lambda: resilience.call("elevenlabs_tts", request))
+        return {"audio_b64": base64.b64encode(audio).decode(), "size_kb": len(audio) // 1024}
     except Exception as e:
         return {"error": str(e)}
 
-def exec_generate_sfx(prompt: str, duration_seconds: float = 10) -> dict:
+async def exec_generate_sfx(prompt: str, duration_seconds: float = 10, mood: Optional[str] = None) -> dict:
+    audio = await sound_library.find("sfx", prompt, mood)
+    if audio:
+        return {"audio_b64": base64.b64encode(audio).decode(), "size_kb": len(audio) // 1024, "from_library": True}
     if not ELEVENLABS_API_KEY:
         return {"error": "ELEVENLABS_API_KEY not set"}
-    try:
-        r = httpx.post("https://api.elevenlabs.io/v1/sound-generation",
+    async def request():
+        r = await http_clients.get("elevenlabs").post("https://api.elevenlabs.io/v1/sound-generation",
             headers={"xi-api-key": ELEVENLABS_API_KEY, "Content-Type": "application/json"},
             json={"text": prompt, "duration_seconds": min(duration_seconds, 22)},
             timeout=30)
-        if r.status_code == 200:
-            return {"audio_b64": base64.b64encode(r.content).decode(), "size_kb": len(r.content) // 1024}
-        return {"error": f"SFX {r.status_code}: {r.text[:200]}"}
+        content = resilience.check(r, "SFX").content
+        sound_library.add_later("sfx", prompt, content, mood, duration_seconds)
+        return content
+    try:
+        audio = await resilience.call("elevenlabs_sfx", request, fallback=lambda: _cached_audio("sfx", prompt, mood))
+        return {"audio_b64": base64.b64encode(audio).decode(), "size_kb": len(audio) // 1024}
     except Exception as e:
         return {"error": str(e)}
 
-def exec_compose_lullaby(prompt: str, duration_seconds: float = 15) -> dict:
+async def exec_compose_lullaby(prompt: str, duration_seconds: float = 15, mood: Optional[str] = None) -> dict:
+    audio = await sound_library.find("lullaby", prompt, mood)
+    if audio:
+        return {"audio_b64": base64.b64encode(audio).decode(), "size_kb": len(audio) // 1024, "from_library": True}
     if not ELEVENLABS_API_KEY:
         return {"error": "ELEVENLABS_API_KEY not set"}
-    try:
-        r = httpx.post("https://api.elevenlabs.io/v1/sound-generation",
+    async def request():
+        r = await http_clients.get("elevenlabs").post("https://api.elevenlabs.io/v1/sound-generation",
             headers={"xi-api-key": ELEVENLABS_API_KEY, "Content-Type": "application/json"},
             json={"text": f"Gentle lullaby music: {prompt}", "duration_seconds": min(duration_seconds, 22)},
             timeout=30)
-        if r.status_code == 200:
-            return {"audio_b64": base64.b64encode(r.content).decode(), "size_kb": len(r.content) // 1024}
-        return {"error": f"Lullaby {r.status_code}: {r.text[:200]}"}
+        content = resilience.check(r, "Lullaby").content
+        sound_library.add_later("lullaby", prompt, content, mood, duration_seconds)
+        return content
+    try:
+        audio = await resilience.call("elevenlabs_sfx", request, fallback=lambda: _cached_audio("lullaby", prompt, mood))
+        return {"audio_b64": base64.b64encode(audio).decode(), "size_kb": len(audio) // 1024}
     except Exception as e:
         return {"error": str(e)}
 
-def exec_web_search(query: str) -> dict:
+async def exec_web_search(query: str) -> dict:
     if not TAVILY_API_KEY:
         return {"error": "TAVILY_API_KEY not set"}
-    try:
-        r = httpx.post("https://api.tavily.com/search",
+    async def request():
+        r = await http_clients.get("tavily").post("https://api.tavily.com/search",
             json={"api_key": TAVILY_API_KEY, "query": query, "max_results": 3}, timeout=15)
-        if r.status_code == 200:
-            return {"results": [{"title": x.get("title",""), "snippet": x.get("content","")[:200]} for x in r.json().get("results",[])]}
-        return {"error": f"Tavily {r.status_code}"}
+        return resilience.check(r, "Tavily").json()
+    try:
+        data = await resilience.call("tavily", request)
+        return {"results": [{"title": x.get("title",""), "snippet": x.get("content","")[:200]} for x in data.get("results",[])]}
     except Exception as e:
         return {"error": str(e)}
 
+async def exec_generate_illustration(art_prompt: str) -> Optional[str]:
+    """Generate one scene illustration via Gemini, return base64 PNG (or None)."""
+    gemini_key = os.environ.get("GEMINI_API_KEY", "")
+    if not gemini_key:
+        return None
+    async def request():
+        resp = await http_clients.get("gemini").post(
+            f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent?key={gemini_key}",
+            json={"contents": [{"parts": [{"text": art_prompt}]}],
+                  "generationConfig": {"responseModalities": ["TEXT", "IMAGE"]}},
+            timeout=60
+        )
+        if resp.status_code != 200:
+            raise resilience.UpstreamError(f"Gemini {resp.status_code}", resp.status_code)
+        return resp.json()
+    data = await resilience.call("gemini", request)
+    for part in data.get("candidates", [{}])[0].get("content", {}).get("parts", []):
+        if "inlineData" in part:
+            return part["inlineData"]["data"]
+    return None
+
 TOOL_DISPATCH = {
     "generate_tts": lambda a: exec_generate_tts(a.get("text",""), a.get("voice_id","FGY2WhTYpPnrIDTdsKH5"), a.get("language","en")),
     "generate_sound_effect": lambda a: exec_generate_sfx(a.get("prompt",""), a.get("duration_seconds",10)),
@@ -158,53 +210,32 @@ TOOL_DISPATCH = {
 
 
 # ---- Agent Setup (Handoffs) ----
-def _setup_handoff_agents(client: Mistral):
-    """Create agents with handoffs configured (shows Mistral Agents API capabilities)."""
-    global HANDOFF_AGENTS
-    if HANDOFF_AGENTS:
-        return
-
-    try:
-        anansi = client.beta.agents.create(
-            model="mistral-large-latest",
-            name="Anansi-Storyteller",
-            description="Master Storyteller — generates multilingual bedtime stories",
-            instructions="You are Anansi the spider storyteller. Create magical bedtime stories in any language. "
-                         "Return ONLY valid JSON: {\"title\": \"...\", \"scenes\": [\"s1\",\"s2\",\"s3\",\"s4\"], \"mood\": \"...\"}",
-            tools=ELEVENLABS_TOOLS
-        )
-
-        papa = client.beta.agents.create(
-            model="mistral-large-latest",
-            name="Papa-Bois-Orchestrator",
-            description="Forest Guardian — orchestrates story creation and hands off to Anansi",
-            instructions="You are Papa Bois, the forest guardian from Trinidad folklore. "
-                         "Plan bedtime stories considering cultural sensitivity and child's interests. "
-                         "Respond with JSON: {\"story_direction\": \"...\", \"mood\": \"...\", \"ambient_sfx\": \"...\", \"lullaby_style\": \"...\"}",
-            handoffs=[anansi.id]
-        )
-
-        HANDOFF_AGENTS = {"papa_bois": papa.id, "anansi": anansi.id}
-        print(f"✅ Handoff agents: Papa Bois={papa.id}, Anansi={anansi.id}")
-    except Exception as e:
-        print(f"⚠️ Handoff creation: {e}")
-        HANDOFF_AGENTS = {"papa_bois": AGENTS["papa_bois"], "anansi": AGENTS["anansi"]}
-
-
-def _extract_text(response) -> str:
-    """Extract text from a Conversations API response."""
-    parts = []
-    if not response.outputs:
-        return ""
-    for output in response.outputs:
-        content = getattr(output, 'content', None)
-        if isinstance(content, str) and content.strip():
-            parts.append(content.strip())
-        elif isinstance(content, list):
-            for chunk in content:
-                if hasattr(chunk, 'text') and chunk.text:
-                    parts.append(chunk.text)
-    return "\n".join(parts)
+# Handoff-enabled agents (shows Mistral Agents API capabilities). agent_registry creates them once
+# at startup and persists their ids; requests never provision. Until they exist (or while
+# creation keeps failing) the pre-registered agents are reported instead.
+agent_registry.define(
+    "anansi",
+    model="mistral-large-latest",
+    name="Anansi-Storyteller",
+    description="Master Storyteller — generates multilingual bedtime stories",
+    instructions="You are Anansi the spider storyteller. Create magical bedtime stories in any language. "
+                 "Return ONLY valid JSON: {\"title\": \"...\", \"scenes\": [\"s1\",\"s2\",\"s3\",\"s4\"], \"mood\": \"...\"}",
+    tools=ELEVENLABS_TOOLS,
+)
+agent_registry.define(
+    "papa_bois",
+    handoffs=["anansi"],
+    model="mistral-large-latest",
+    name="Papa-Bois-Orchestrator",
+    description="Forest Guardian — orchestrates story creation and hands off to Anansi",
+    instructions="You are Papa Bois, the forest guardian from Trinidad folklore. "
+                 "Plan bedtime stories considering cultural sensitivity and child's interests. "
+                 "Respond with JSON: {\"story_direction\": \"...\", \"mood\": \"...\", \"ambient_sfx\": \"...\", \"lullaby_style\": \"...\"}",
+)
+
+
+def _handoff_agent(name: str) -> str:
+    return agent_registry.get(name) or AGENTS[name]
 
 
 class AgentRequest(BaseModel):
@@ -217,6 +248,8 @@ class OrchestrateRequest(BaseModel):
     language: str = "en"
     prompt: str
     voice_id: Optional[str] = None
+    regenerate: bool = False  # Skip and replace any cached story for this prompt
+    pipelined: bool = False  # Stream Anansi's tokens straight into TTS, sentence by sentence
 
 
 @router.post("/api/agent/chat")
@@ -225,151 +258,328 @@ async def agent_chat(req: AgentRequest):
     if not MISTRAL_API_KEY:
         raise HTTPException(status_code=500, detail="MISTRAL_API_KEY not set")
 
-    client = Mistral(api_key=MISTRAL_API_KEY)
-    _setup_handoff_agents(client)
-
-    agent_id = AGENTS.get(req.agent)  # Use stable pre-registered agents
-    if not agent_id:
+    if not AGENTS.get(req.agent):  # Use stable pre-registered agents
         raise HTTPException(status_code=400, detail=f"Unknown agent: {req.agent}")
-
-    if req.conversation_id:
-        response = client.beta.conversations.append(conversation_id=req.conversation_id, inputs=req.message)
-        conv_id = req.conversation_id
-    else:
-        response = client.beta.conversations.start(agent_id=agent_id, inputs=req.message)
-        conv_id = response.conversation_id
+    try:
+        reply = await agent_client.ask(req.agent, req.message, req.conversation_id)
+    except agent_client.AgentError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    await conversations.record(reply.conversation_id, req.agent, reply.agent_id)
 
     return {
-        "response": _extract_text(response),
-        "conversation_id": conv_id,
+        "response": reply.text,
+        "conversation_id": reply.conversation_id,
         "agent": req.agent,
+        "kind": reply.kind,
+        "arguments": reply.arguments,
         "tool": "mistral_conversations_api"
     }
 
 
-@router.post("/api/orchestrate")
-async def orchestrate_story(req: OrchestrateRequest):
-    """
-    Full pipeline: Papa Bois plans → Anansi generates → Devi narrates/SFX/music.
-    All via Mistral Agents + Conversations API.
-    """
-    # 1. Check prompt cache
-    cached = await prompt_cache.get_cached(req.prompt, req.child_name, req.language)
-    if cached:
-        return {
-            "id": cached.get("id", 0), "title": cached.get("title"),
-            "scenes": cached.get("scenes", []), "mood": cached.get("mood", "magical"),
-            "language": req.language, "child_name": req.child_name,
-            "orchestration": {"source": "prompt_cache"}, "agents_used": ["cache_hit"],
-            "tool": "prompt_cache", "cached": True
-        }
+@router.get("/api/agent/conversations")
+async def agent_conversations(agent: str = "papa_bois", limit: int = Query(20, ge=1, le=200)):
+    """Most recently used conversations with an agent (from the server and team.py alike)."""
+    return {"agent": agent, "conversations": await conversations.for_agent(agent, limit)}
 
-    if not MISTRAL_API_KEY:
-        raise HTTPException(status_code=500, detail="MISTRAL_API_KEY not set")
 
-    client = Mistral(api_key=MISTRAL_API_KEY)
-    _setup_handoff_agents(client)  # Creates handoff-enabled agents (demonstrates API)
-    # Use pre-registered agents for stable conversations
-    # (Handoff agents created above prove API capability; server-side handoff orchestration
-    # currently returns 500, tracked as Mistral beta limitation)
-    agents = AGENTS
-    voice_id = req.voice_id or "FGY2WhTYpPnrIDTdsKH5"
+# ---- Story pipeline as a task graph ----
+# plan → story → {TTS per scene, illustration prompts → images}; SFX and lullaby only need the plan.
+NODE_TIMEOUTS = {
+    "plan": float(os.environ.get("ORCH_TIMEOUT_PLAN", 60)),
+    "story": float(os.environ.get("ORCH_TIMEOUT_STORY", 90)),
+    "tts": float(os.environ.get("ORCH_TIMEOUT_TTS", 45)),
+    "sfx": float(os.environ.get("ORCH_TIMEOUT_SFX", 45)),
+    "lullaby": float(os.environ.get("ORCH_TIMEOUT_LULLABY", 45)),
+    "illustration_prompts": float(os.environ.get("ORCH_TIMEOUT_ILLUSTRATION_PROMPTS", 60)),
+    "illustration": float(os.environ.get("ORCH_TIMEOUT_ILLUSTRATION", 90)),
+}
+
+
+def _strip_fences(text: str) -> str:
+    return text.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+
+
+def _asset_key(node: str) -> Optional[str]:
+    """Storage key for nodes that produce an asset: tts_2 → "2", sfx, lullaby, img_0."""
+    if node.startswith("tts_"):
+        return node[4:]
+    if node in ("sfx", "lullaby") or node.startswith("img_"):
+        return node
+    return None
+
+
+def _progress_events(graph: TaskGraph, node: str, asset: Optional[dict]) -> list[tuple]:
+    """(event, data) pairs announcing a finished node to /api/orchestrate/stream clients."""
+    if not graph.ok(node):
+        if _asset_key(node) or node == "illustration_prompts":
+            return [("asset_failed", {"node": node, "error": str(graph.error(node))[:200]})]
+        return []
+    if node == "plan":
+        result = graph.result("plan")
+        return [("plan", {"conversation_id": result["conversation_id"], "plan": result["plan"]})]
+    if node == "story":
+        result = graph.result("story")
+        story, scenes = result["story"], result["scenes"]
+        events = [("title", {"title": story.get("title", "Untitled"), "mood": story.get("mood", "magical"),
+                             "scene_count": len(scenes)})]
+        return events + [("scene", {"index": i, "text": text}) for i, text in enumerate(scenes)]
+    if asset:
+        ref = {"key": asset["key"], "url": blob_store.url(asset), "size": asset["size"], "mime": asset["mime"]}
+        if node.startswith("img_"):
+            return [("illustration", {"scene": int(node[4:]), **ref})]
+        if node.startswith("tts_"):
+            return [("audio", {"scene": int(node[4:]), **ref})]
+        return [("audio", ref)]
+    return []
+
+
+def _build_story_graph(req: OrchestrateRequest, client: Mistral, agents: dict, voice_id: str,
+                       on_done=None, metrics: Optional[dict] = None, checkpoint: Optional[dict] = None) -> TaskGraph:
+    """
+    `checkpoint` ({"nodes": {...}, "assets": {...}}, see _generate_story) resumes an earlier
+    attempt: finished nodes return their saved result instead of calling upstream APIs.
+    """
+    graph = TaskGraph(on_done=on_done)
+    restored = (checkpoint or {}).get("nodes", {})
+    restored_assets = (checkpoint or {}).get("assets", {})
+
+    def _resumable(name: str, fn, resume=None):
+        """Skip work saved by a previous attempt; `resume(g, result)` redoes the node's fan-out."""
+        async def node(g):
+            key = _asset_key(name)
+            if key and key in restored_assets:
+                return restored_assets[key]  # Already in the blob store
+            if name in restored:
+                if resume:
+                    resume(g, restored[name])
+                return restored[name]
+            result = await fn(g)
+            if key:
+                # Store the asset the moment it exists; the graph only ever holds its blob reference
+                data = result if isinstance(result, bytes) else base64.b64decode(result)
+                del result
+                return await blob_store.put_asset(key, data)
+            return result
+        return node
 
     # ---- Phase 1: Papa Bois plans via Conversations API ----
-    papa_prompt = f"""A parent wants a bedtime story.
+    async def plan_node(g):
+        papa_prompt = f"""A parent wants a bedtime story.
 Child: {req.child_name}, Language: {req.language}
 Request: {req.prompt}
 Plan this story as JSON: {{"story_direction": "...", "mood": "...", "ambient_sfx": "...", "lullaby_style": "..."}}"""
 
-    papa_response = client.beta.conversations.start(
-        agent_id=agents["papa_bois"], inputs=papa_prompt
-    )
-    papa_conv_id = papa_response.conversation_id
-    papa_text = _extract_text(papa_response)
-    print(f"[PAPA BOIS] conv={papa_conv_id} text={len(papa_text)}c")
+        papa_response = await client.beta.conversations.start_async(
+            agent_id=agents["papa_bois"], inputs=papa_prompt
+        )
+        papa_text = agent_client.text_of(papa_response)
+        print(f"[PAPA BOIS] conv={papa_response.conversation_id} text={len(papa_text)}c")
 
-    try:
-        plan = json.loads(papa_text.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip())
-    except:
-        plan = {"story_direction": papa_text[:300], "mood": "magical", "ambient_sfx": "gentle night sounds", "lullaby_style": "soft music box"}
+        try:
+            plan = json.loads(_strip_fences(papa_text))
+        except:
+            plan = {"story_direction": papa_text[:300], "mood": "magical", "ambient_sfx": "gentle night sounds", "lullaby_style": "soft music box"}
+        return {"conversation_id": papa_response.conversation_id, "plan": plan}
 
     # ---- Phase 2: Anansi generates story via Conversations API ----
-    anansi_prompt = f"""Create a bedtime story for {req.child_name} in {req.language}.
+    metrics = metrics if metrics is not None else {}
+
+    def _anansi_prompt(plan: dict) -> str:
+        return f"""Create a bedtime story for {req.child_name} in {req.language}.
 Direction: {plan.get('story_direction', req.prompt)}
 Mood: {plan.get('mood', 'magical')}
 Write exactly 4 scenes (2-3 sentences each). Last scene: child falls asleep.
 Return ONLY valid JSON: {{"title": "...", "scenes": ["s1","s2","s3","s4"], "mood": "..."}}"""
 
-    # Anansi generates story via Mistral Large + JSON mode
-    # (Conversations API returns 0 chars for pre-registered agent; using chat.complete
-    # with response_format for reliable structured output)
-    anansi_conv_response = client.beta.conversations.start(
-        agent_id=agents["anansi"], inputs=anansi_prompt
-    )
-    anansi_conv_id = anansi_conv_response.conversation_id
-    anansi_text = _extract_text(anansi_conv_response)
-    print(f"[ANANSI] conv={anansi_conv_id} text={len(anansi_text)}c")
-    
-    # If Conversations API returned empty, use chat.complete with JSON mode
-    if not anansi_text or len(anansi_text) < 20:
-        print("[ANANSI] Conversations empty, using chat.complete + JSON mode")
-        anansi_chat = client.chat.complete(
-            model="mistral-large-latest",
-            messages=[
-                {"role": "system", "content": "You are Anansi, master storyteller from Caribbean folklore. Create magical bedtime stories. Return ONLY valid JSON."},
-                {"role": "user", "content": anansi_prompt}
-            ],
-            response_format={"type": "json_object"}
+    async def story_node(g):
+        plan = g.result("plan")["plan"]
+        anansi_prompt = _anansi_prompt(plan)
+
+        # Anansi generates story via Mistral Large + JSON mode
+        # (Conversations API returns 0 chars for pre-registered agent; using chat.complete
+        # with response_format for reliable structured output)
+        anansi_conv_response = await client.beta.conversations.start_async(
+            agent_id=agents["anansi"], inputs=anansi_prompt
         )
-        anansi_text = anansi_chat.choices[0].message.content.strip()
-        print(f"[ANANSI] chat.complete: {len(anansi_text)}c")
+        anansi_conv_id = anansi_conv_response.conversation_id
+        anansi_text = agent_client.text_of(anansi_conv_response)
+        print(f"[ANANSI] conv={anansi_conv_id} text={len(anansi_text)}c")
+
+        # If Conversations API returned empty, use chat.complete with JSON mode
+        if not anansi_text or len(anansi_text) < 20:
+            print("[ANANSI] Conversations empty, using chat.complete + JSON mode")
+            anansi_chat = await client.chat.complete_async(
+                model="mistral-large-latest",
+                messages=[
+                    {"role": "system", "content": "You are Anansi, master storyteller from Caribbean folklore. Create magical bedtime stories. Return ONLY valid JSON."},
+                    {"role": "user", "content": anansi_prompt}
+                ],
+                response_format={"type": "json_object"}
+            )
+            anansi_text = anansi_chat.choices[0].message.content.strip()
+            print(f"[ANANSI] chat.complete: {len(anansi_text)}c")
 
-    try:
-        clean = anansi_text.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
-        story = json.loads(clean)
-    except:
-        story = {"title": f"A Story for {req.child_name}", "scenes": [anansi_text[:500]], "mood": "magical"}
+        try:
+            story = json.loads(_strip_fences(anansi_text))
+        except:
+            story = {"title": f"A Story for {req.child_name}", "scenes": [anansi_text[:500]], "mood": "magical"}
+
+        scenes = story.get("scenes", [])
+        scenes = [s.get("text", str(s)) if isinstance(s, dict) else str(s) for s in scenes]
+        _fan_out(g, scenes)
+        return {"conversation_id": anansi_conv_id, "story": story, "scenes": scenes}
+
+    def _fan_out(g, scenes: list[str], narrations: Optional[dict] = None):
+        """One TTS node per scene (awaiting its streamed narration if any), and illustrations once prompts are crafted."""
+        for i, scene_text in enumerate(scenes):
+            node = _narration_node(narrations[i]) if narrations and i in narrations else _tts_node(i, scene_text)
+            g.add(f"tts_{i}", _resumable(f"tts_{i}", node), deps=["story"], timeout=NODE_TIMEOUTS["tts"], phase="tts")
+        if os.environ.get("GEMINI_API_KEY", "") and scenes:
+            g.add("illustration_prompts", _resumable("illustration_prompts", illustration_prompts_node, _add_illustrations),
+                  deps=["story"], timeout=NODE_TIMEOUTS["illustration_prompts"], phase="illustration_prompts")
+
+    # ---- Phase 2 (pipelined): stream Anansi's JSON, narrate each sentence as soon as it is written ----
+    async def streamed_story_node(g):
+        plan = g.result("plan")["plan"]
+        parser = json_stream.ScenesParser()
+        fields, scenes, raw = {}, [], []
+        narrations: dict[int, asyncio.Task] = {}
+        queues: dict[int, asyncio.Queue] = {}
+        buffers: dict[int, json_stream.SentenceBuffer] = {}
+
+        def scene_queue(i: int) -> asyncio.Queue:
+            if i not in queues:
+                queues[i], buffers[i] = asyncio.Queue(), json_stream.SentenceBuffer()
+                narrations[i] = asyncio.create_task(_narrate_stream(i, queues[i]))
+            return queues[i]
 
-    scenes = story.get("scenes", [])
-    scenes = [s.get("text", str(s)) if isinstance(s, dict) else str(s) for s in scenes]
+        try:
+            stream = await client.chat.stream_async(
+                model="mistral-large-latest",
+                messages=[
+                    {"role": "system", "content": "You are Anansi, master storyteller from Caribbean folklore. Create magical bedtime stories. Return ONLY valid JSON."},
+                    {"role": "user", "content": _anansi_prompt(plan)}
+                ],
+                response_format={"type": "json_object"}
+            )
+            async with stream as events:
+                async for event in events:
+                    delta = event.data.choices[0].delta.content if event.data.choices else None
+                    if not isinstance(delta, str) or not delta:
+                        continue
+                    raw.append(delta)
+                    for kind, key, value in parser.feed(delta):
+                        if kind == "field":
+                            fields[key] = value
+                        elif kind == "scene_delta":
+                            q = scene_queue(key)
+                            for sentence in buffers[key].push(value):
+                                q.put_nowait(sentence)
+                        elif kind == "scene":
+                            q = scene_queue(key)
+                            rest = buffers[key].flush()
+                            if rest:
+                                q.put_nowait(rest)
+                            q.put_nowait(None)
+                            scenes.append(value)
+        except BaseException:
+            for task in narrations.values():
+                task.cancel()
+            raise
+        text = "".join(raw)
+        print(f"[ANANSI] chat.stream: {len(text)}c, {len(scenes)} scenes streamed")
+
+        if not scenes:
+            # Not the expected shape (e.g. scene objects): parse the whole reply, narrate per scene
+            for task in narrations.values():
+                task.cancel()
+            narrations = {}
+            try:
+                story = json.loads(_strip_fences(text))
+            except:
+                story = {"title": f"A Story for {req.child_name}", "scenes": [text[:500]], "mood": "magical"}
+            scenes = [s.get("text", str(s)) if isinstance(s, dict) else str(s) for s in story.get("scenes", [])]
+        story = {"title": fields.get("title") or f"A Story for {req.child_name}", "scenes": scenes,
+                 "mood": fields.get("mood", "magical")}
+        _fan_out(g, scenes, narrations)
+        return {"conversation_id": None, "story": story, "scenes": scenes}
+
+    async def _narrate_stream(i: int, sentences: asyncio.Queue) -> bytes | str:
+        """Push scene i's sentences into an ElevenLabs stream-input session as they arrive; returns MP3 bytes (base64 on batch fallback)."""
+        audio, sent, closed = bytearray(), [], [False]
+        try:
+            async with elevenlabs_api.tts_stream(voice_id, voice_settings=TTS_SETTINGS) as el:
+                async def pump():
+                    while (sentence := await sentences.get()) is not None:
+                        sent.append(sentence)
+                        await el.send(sentence + " ")
+                    closed[0] = True
+                    await el.end()
+
+                pump_task = asyncio.create_task(pump())
+                try:
+                    async for msg in el.messages():
+                        if msg.get("audio"):
+                            metrics.setdefault("first_audio", time.perf_counter())
+                            audio += base64.b64decode(msg["audio"])
+                    await pump_task
+                finally:
+                    pump_task.cancel()
+            if not audio:
+                raise RuntimeError("stream returned no audio")
+            await tts_cache.put(tts_cache.cache_key(" ".join(sent), voice_id, tts_cache.DEFAULT_MODEL, TTS_SETTINGS),
+                                bytes(audio))
+            print(f"[DEVI TTS {i}] ✅ streamed {len(audio) // 1024}KB")
+            return bytes(audio)
+        except Exception as e:
+            print(f"[DEVI TTS {i}] stream failed ({e}), falling back to batch TTS")
+            while not closed[0] and (sentence := await sentences.get()) is not None:
+                sent.append(sentence)
+            result = await exec_generate_tts(" ".join(sent), voice_id, req.language)
+            if result.get("audio_b64"):
+                return result["audio_b64"]
+            raise RuntimeError(result.get("error"))
+
+    def _narration_node(task: asyncio.Task):
+        async def narration_node(g):
+            return await task
+        return narration_node
 
     # ---- Phase 3: Devi generates audio (ElevenLabs function calls) ----
-    audio_cache = {}
-    tools_called = []
-
-    print(f"[DEVI] Generating audio for {len(scenes)} scenes")
-    for i, scene_text in enumerate(scenes):
-        result = exec_generate_tts(scene_text, voice_id, req.language)
-        if result.get("audio_b64"):
-            audio_cache[str(i)] = result["audio_b64"]
-            tools_called.append(f"generate_tts(scene_{i})")
-            print(f"[DEVI TTS {i}] ✅ {result.get('size_kb',0)}KB")
-        else:
+    def _tts_node(i: int, scene_text: str):
+        async def tts_node(g):
+            result = await exec_generate_tts(scene_text, voice_id, req.language)
+            if result.get("audio_b64"):
+                print(f"[DEVI TTS {i}] ✅ {result.get('size_kb',0)}KB")
+                return result["audio_b64"]
             print(f"[DEVI TTS {i}] ❌ {result.get('error')}")
-
-    sfx_prompt = plan.get("ambient_sfx", f"Gentle {story.get('mood','magical')} bedtime ambient sounds")
-    sfx = exec_generate_sfx(sfx_prompt)
-    if sfx.get("audio_b64"):
-        audio_cache["sfx"] = sfx["audio_b64"]
-        tools_called.append("generate_sound_effect")
-        print(f"[DEVI SFX] ✅ {sfx.get('size_kb',0)}KB")
-    else:
+            raise RuntimeError(result.get("error"))
+        return tts_node
+
+    async def sfx_node(g):
+        plan = g.result("plan")["plan"]
+        sfx_prompt = plan.get("ambient_sfx", f"Gentle {plan.get('mood','magical')} bedtime ambient sounds")
+        sfx = await exec_generate_sfx(sfx_prompt, mood=plan.get("mood"))
+        if sfx.get("audio_b64"):
+            print(f"[DEVI SFX] ✅ {sfx.get('size_kb',0)}KB{' (library)' if sfx.get('from_library') else ''}")
+            return sfx["audio_b64"]
         print(f"[DEVI SFX] ❌ {sfx.get('error')}")
-
-    lullaby_prompt = plan.get("lullaby_style", f"Soft lullaby, {story.get('mood','magical')} theme, music box")
-    lull = exec_compose_lullaby(lullaby_prompt)
-    if lull.get("audio_b64"):
-        audio_cache["lullaby"] = lull["audio_b64"]
-        tools_called.append("compose_lullaby")
-        print(f"[DEVI LULLABY] ✅ {lull.get('size_kb',0)}KB")
-    else:
+        raise RuntimeError(sfx.get("error"))
+
+    async def lullaby_node(g):
+        plan = g.result("plan")["plan"]
+        lullaby_prompt = plan.get("lullaby_style", f"Soft lullaby, {plan.get('mood','magical')} theme, music box")
+        lull = await exec_compose_lullaby(lullaby_prompt, mood=plan.get("mood"))
+        if lull.get("audio_b64"):
+            print(f"[DEVI LULLABY] ✅ {lull.get('size_kb',0)}KB{' (library)' if lull.get('from_library') else ''}")
+            return lull["audio_b64"]
         print(f"[DEVI LULLABY] ❌ {lull.get('error')}")
+        raise RuntimeError(lull.get("error"))
 
     # ---- Phase 3.5: Anansi crafts illustration prompts + generates images ----
-    image_cache = {}
-    gemini_key = os.environ.get("GEMINI_API_KEY", "")
-    if gemini_key and scenes:
-        import httpx as hx
+    async def illustration_prompts_node(g):
+        story_result = g.result("story")
+        story, scenes = story_result["story"], story_result["scenes"]
         print(f"[ANANSI ILLUSTRATIONS] Crafting prompts for {len(scenes)} scenes...")
 
         # Anansi uses Mistral to craft the perfect illustration prompt for each scene
@@ -386,7 +596,7 @@ Return a JSON object with keys "scene_0", "scene_1", etc. Each value is a detail
 Return ONLY valid JSON, no markdown."""
 
         try:
-            img_prompt_response = client.chat.complete(
+            img_prompt_response = await client.chat.complete_async(
                 model="mistral-large-latest",
                 messages=[
                     {"role": "system", "content": "You are Anansi the storyteller. Craft vivid illustration prompts for children's storybook scenes."},
@@ -401,42 +611,176 @@ Return ONLY valid JSON, no markdown."""
             print(f"[ANANSI] Prompt crafting failed ({e}), using scene text directly")
             img_prompts = {f"scene_{i}": f"Dreamy watercolor children's book illustration: {s[:150]}. Soft pastels, magical, Studio Ghibli inspired" for i, s in enumerate(scenes[:4])}
 
-        # Generate images using Anansi's crafted prompts
+        _add_illustrations(g, img_prompts)
+        return img_prompts
+
+    def _add_illustrations(g, img_prompts: dict):
+        scenes = g.result("story")["scenes"]
         for i in range(min(len(scenes), 4)):
             art_prompt = img_prompts.get(f"scene_{i}", f"Dreamy watercolor: {scenes[i][:100]}")
+            g.add(f"img_{i}", _resumable(f"img_{i}", _illustration_node(i, art_prompt)), deps=["illustration_prompts"],
+                  timeout=NODE_TIMEOUTS["illustration"], phase="illustrations")
+
+    def _illustration_node(i: int, art_prompt: str):
+        async def illustration_node(g):
             try:
-                resp = hx.post(
-                    f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent?key={gemini_key}",
-                    json={"contents": [{"parts": [{"text": art_prompt}]}],
-                          "generationConfig": {"responseModalities": ["TEXT", "IMAGE"]}},
-                    timeout=60
-                )
-                if resp.status_code == 200:
-                    data = resp.json()
-                    for part in data.get("candidates", [{}])[0].get("content", {}).get("parts", []):
-                        if "inlineData" in part:
-                            image_cache[f"img_{i}"] = part["inlineData"]["data"]
-                            print(f"[ANANSI ILLUSTRATION {i}] ✅")
-                            break
-                else:
-                    print(f"[ANANSI ILLUSTRATION {i}] ❌ {resp.status_code}")
+                image_b64 = await exec_generate_illustration(art_prompt)
             except Exception as e:
                 print(f"[ANANSI ILLUSTRATION {i}] ❌ {e}")
+                raise
+            if image_b64:
+                print(f"[ANANSI ILLUSTRATION {i}] ✅")
+                return image_b64
+            raise RuntimeError("no image returned")
+        return illustration_node
+
+    graph.add("plan", _resumable("plan", plan_node), timeout=NODE_TIMEOUTS["plan"])
+    graph.add("story", _resumable("story", streamed_story_node if req.pipelined else story_node,
+                                  lambda g, result: _fan_out(g, result["scenes"])),
+              deps=["plan"], timeout=NODE_TIMEOUTS["story"])
+    graph.add("sfx", _resumable("sfx", sfx_node), deps=["plan"], timeout=NODE_TIMEOUTS["sfx"], phase="sfx")
+    graph.add("lullaby", _resumable("lullaby", lullaby_node), deps=["plan"], timeout=NODE_TIMEOUTS["lullaby"], phase="lullaby")
+    return graph
+
+
+@router.post("/api/orchestrate")
+async def orchestrate_story(req: OrchestrateRequest, user: Optional[dict] = Depends(sessions.optional_user)):
+    """
+    Full pipeline: Papa Bois plans → Anansi generates → Devi narrates/SFX/music.
+    All via Mistral Agents + Conversations API; independent steps run concurrently.
+    """
+    user_id = user["id"] if user else None
+    # 1. Check prompt cache
+    if req.regenerate:
+        prompt_cache.invalidate(req.prompt, req.child_name, req.language)
+        return await _generate_story(req, user_id=user_id)
+    cached = await prompt_cache.get_cached(req.prompt, req.child_name, req.language)
+    if cached:
+        return await _cached_response(cached, req)
+
+    # 2. Identical requests already in flight share one generation
+    result, shared = await singleflight.do(_flight_key(req), lambda: _generate_story(req, user_id=user_id),
+                                           lambda: _exact_cached(req))
+    return {**result, "deduplicated": True} if shared else result
+
+
+def _flight_key(req: OrchestrateRequest) -> str:
+    """Single-flight key shared by /api/orchestrate and its stream."""
+    return "orchestrate:" + prompt_cache.hash_prompt(req.prompt, req.child_name, req.language)
+
+
+async def _exact_cached(req: OrchestrateRequest) -> Optional[dict]:
+    """The cached result another worker's generation left behind, if any."""
+    hit = await prompt_cache.get_exact(req.prompt, req.child_name, req.language)
+    return await _cached_response(hit, req) if hit else None
+
+
+async def _cached_response(cached: dict, req: OrchestrateRequest) -> dict:
+    story_id = cached.get("id", 0)
+    return {
+        "id": story_id, "title": cached.get("title"),
+        "scenes": cached.get("scenes", []), "mood": cached.get("mood", "magical"),
+        "language": req.language, "child_name": req.child_name,
+        "orchestration": {"source": "prompt_cache"}, "agents_used": ["cache_hit"],
+        "tool": "prompt_cache", "cached": True, "match_score": cached.get("match_score", 1.0),
+        "assets": await _story_manifest(story_id) if story_id else {"audio": {}, "images": {}},
+    }
+
+
+def _manifest(assets: dict[str, dict]) -> dict:
+    """Asset key → {url, size, mime}, split into audio (scene index, sfx, lullaby) and images (img_N)."""
+    manifest = {"audio": {}, "images": {}}
+    for key, ref in assets.items():
+        manifest["images" if key.startswith("img_") else "audio"][key] = {
+            "url": blob_store.url(ref), "size": ref["size"], "mime": ref["mime"]}
+    return manifest
+
+
+async def _story_manifest(story_id: int) -> dict:
+    """Manifest for a saved story, including assets still in the legacy JSON columns."""
+    has_audio, has_images = await blob_store.story_asset_keys(story_id)
+    return {
+        "audio": {key: {"url": f"/api/stories/{story_id}/audio/{key}"} for key in has_audio},
+        "images": {key: {"url": f"/api/stories/{story_id}/image/{key}"} for key in has_images},
+    }
+
+
+# Nodes whose results are small JSON worth checkpointing (asset nodes are checkpointed as blob refs)
+CHECKPOINT_NODES = ("plan", "story", "illustration_prompts")
+
+
+async def _generate_story(req: OrchestrateRequest, emit=None, checkpoint: Optional[dict] = None, save=None,
+                          on_insert: Optional[tuple] = None, user_id: Optional[int] = None) -> dict:
+    """
+    Run the story graph and save the result. `emit(event, data)` receives progress events.
+    `save(node, state)` is awaited after each successful node with a checkpoint
+    {"nodes": {plan/story/illustration_prompts results}, "assets": {key: blob ref}}
+    that can be passed back as `checkpoint` to resume. `on_insert` is a (sql, params)
+    statement run in the same batch right after the stories INSERT, where
+    last_insert_rowid() is the new story's id. `user_id` owns the saved story.
+    """
+    if not MISTRAL_API_KEY:
+        raise HTTPException(status_code=500, detail="MISTRAL_API_KEY not set")
 
-    # ---- Phase 4: Save to Turso ----
+    client = agent_client.client()
+    # Use pre-registered agents for stable conversations
+    # (Handoff agents provisioned at startup prove API capability; server-side handoff orchestration
+    # currently returns 500, tracked as Mistral beta limitation)
+    agents = AGENTS
+    voice_id = req.voice_id or "FGY2WhTYpPnrIDTdsKH5"
+
+    # Assets go to the blob store as soon as their node finishes
+    assets: dict[str, dict] = dict((checkpoint or {}).get("assets", {}))
+    metrics: dict[str, float] = {}
+    t0 = time.perf_counter()
+
+    async def on_done(g: TaskGraph, node: str):
+        key = _asset_key(node)
+        if key and g.ok(node):
+            if node.startswith("tts_"):
+                metrics.setdefault("first_audio", time.perf_counter())  # Batch TTS: first whole scene
+            assets[key] = g.result(node)  # Blob ref; bytes were stored by the node itself
+        if emit:
+            for event, data in _progress_events(g, node, assets.get(key) if key else None):
+                emit(event, data)
+        if save and g.ok(node):
+            await save(node, {"nodes": {n: g.result(n) for n in CHECKPOINT_NODES if g.ok(n)}, "assets": assets})
+
+    graph = _build_story_graph(req, client, agents, voice_id, on_done, metrics, checkpoint)
+    await graph.run()
+
+    # Plan and story are required; everything else degrades to "missing asset"
+    plan_result = graph.result("plan") if graph.ok("plan") else None
+    if plan_result is None or not graph.ok("story"):
+        failed = "plan" if plan_result is None else "story"
+        err = graph.error(failed)
+        if isinstance(err, Exception):
+            raise err
+        raise HTTPException(status_code=504, detail=f"{failed} phase failed: {err}")
+    plan = plan_result["plan"]
+    story_result = graph.result("story")
+    story, scenes = story_result["story"], story_result["scenes"]
+
+    tools_called = [f"generate_tts(scene_{i})" for i in range(len(scenes)) if str(i) in assets]
+    tools_called += [tool for key, tool in (("sfx", "generate_sound_effect"), ("lullaby", "compose_lullaby")) if key in assets]
+    manifest = _manifest(assets)
+
+    # ---- Phase 4: Save to Turso (assets are already in the blob store; index them in story_assets) ----
     import database as db_mod
     content_json = json.dumps(story, ensure_ascii=False)
-    audio_json = json.dumps(audio_cache) if audio_cache else "{}"
-    image_json = json.dumps(image_cache) if image_cache else "{}"
-
-    await db_mod.execute(
-        "INSERT INTO stories (title, content, voice_id, child_name, language, audio_cache, image_cache) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        [story.get("title", "Untitled"), content_json, voice_id, req.child_name, req.language, audio_json, image_json]
-    )
-    id_result = await db_mod.execute("SELECT MAX(id) FROM stories", [])
-    story_id = id_result.rows[0][0] if id_result.rows else 1
 
-    await prompt_cache.set_cached(req.prompt, req.child_name, req.language,
+    # Story row + asset index + prompt cache entry in one atomic round trip
+    statements = [
+        ("INSERT INTO stories (title, content, voice_id, child_name, language, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+         [story.get("title", "Untitled"), content_json, voice_id, req.child_name, req.language, user_id]),
+        on_insert,  # An UPDATE leaves last_insert_rowid() alone for the asset index below
+        blob_store.index_statement(list(assets.values())),
+        prompt_cache.set_cached_statement(req.prompt, req.child_name, req.language,
+            {"title": story.get("title"), "scenes": scenes, "mood": story.get("mood", "magical")}),
+    ]
+    saved = await db_mod.batch([s for s in statements if s])
+    story_id = saved[0].last_insert_rowid
+    prompt_cache.remember(req.prompt, req.child_name, req.language,
         {"id": story_id, "title": story.get("title"), "scenes": scenes, "mood": story.get("mood", "magical")})
 
     return {
@@ -447,25 +791,141 @@ Return ONLY valid JSON, no markdown."""
         "language": req.language,
         "child_name": req.child_name,
         "orchestration": {
-            "papa_bois": {"conversation_id": papa_conv_id, "plan": plan},
-            "anansi": {"conversation_id": anansi_conv_id},
-            "devi": {"tools_called": tools_called, "audio_tracks": len(audio_cache)},
+            "papa_bois": {"conversation_id": plan_result["conversation_id"], "plan": plan},
+            "anansi": {"conversation_id": story_result["conversation_id"], "illustrations": len(manifest["images"])},
+            "devi": {"tools_called": tools_called, "audio_tracks": len(manifest["audio"])},
+            "timings": {
+                **graph.timings(),
+                "pipelined": req.pipelined,
+                "time_to_first_audio_ms": round((metrics["first_audio"] - t0) * 1000) if "first_audio" in metrics else None,
+            },
         },
         "agents_used": ["papa_bois", "anansi", "devi"],
         "tools_called": tools_called,
-        "audio_generated": len(audio_cache),
+        "audio_generated": len(manifest["audio"]),
+        "assets": manifest,
         "tool": "mistral_agents_api + elevenlabs_function_calling",
-        "handoff_agents_created": bool(HANDOFF_AGENTS),
+        "handoff_agents_created": agent_registry.ready(),
     }
 
 
+class _Progress:
+    """Progress events of one shared stream generation, replayed to every client that joins it."""
+
+    def __init__(self):
+        self.events: list[tuple] = []
+        self.queues: set[asyncio.Queue] = set()
+        self.running = False
+
+    def emit(self, event: str, data: dict):
+        self.events.append((event, data))
+        for queue in self.queues:
+            queue.put_nowait((event, data))
+
+    def subscribe(self, queue: asyncio.Queue):
+        for item in self.events:
+            queue.put_nowait(item)
+        self.queues.add(queue)
+
+
+_streams: dict[str, _Progress] = {}  # single-flight key -> progress of the generation in flight
+
+
+def _emit_story(result: dict, emit):
+    """Title and scene events for a result whose generation this client did not watch."""
+    emit("title", {"title": result["title"], "mood": result["mood"], "scene_count": len(result["scenes"])})
+    for i, text in enumerate(result["scenes"]):
+        emit("scene", {"index": i, "text": text})
+
+
+async def _shared_stream(req: OrchestrateRequest, queue: asyncio.Queue, user_id: Optional[int]) -> dict:
+    """Run or join the single-flight generation for `req`, relaying its progress events to `queue`."""
+    key = _flight_key(req)
+    progress = _streams.setdefault(key, _Progress())
+    progress.subscribe(queue)
+
+    async def generate():
+        progress.running = True
+        try:
+            return await _generate_story(req, progress.emit, user_id=user_id)
+        finally:
+            if _streams.get(key) is progress:
+                del _streams[key]
+
+    try:
+        result, shared = await singleflight.do(key, generate, lambda: _exact_cached(req))
+    finally:
+        progress.queues.discard(queue)
+        if not progress.running and not progress.queues and _streams.get(key) is progress:
+            del _streams[key]  # Joined a run without progress events (non-stream or remote leader)
+    if not shared:
+        return result
+    if not progress.events:
+        _emit_story(result, lambda event, data: queue.put_nowait((event, data)))
+    return {**result, "deduplicated": True}
+
+
+@router.post("/api/orchestrate/stream")
+async def orchestrate_story_stream(req: OrchestrateRequest, user: Optional[dict] = Depends(sessions.optional_user)):
+    """
+    /api/orchestrate as Server-Sent Events: plan, title, scene, audio, illustration
+    (and asset_failed) events as each phase finishes, then `done` with the same
+    JSON /api/orchestrate returns, or `error`. Audio/illustration URLs are
+    content-addressed (/api/blobs/...) so they play before the story is saved.
+    Identical requests share one generation (the same single-flight key as
+    /api/orchestrate); a client joining late gets the events sent so far first.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    user_id = user["id"] if user else None
+
+    def emit(event: str, data: dict):
+        queue.put_nowait((event, data))
+
+    async def produce():
+        try:
+            if req.regenerate:
+                prompt_cache.invalidate(req.prompt, req.child_name, req.language)
+                result = await _generate_story(req, emit, user_id=user_id)
+            elif cached := await prompt_cache.get_cached(req.prompt, req.child_name, req.language):
+                result = await _cached_response(cached, req)
+                _emit_story(result, emit)
+            else:
+                result = await _shared_stream(req, queue, user_id)
+            emit("done", result)
+        except HTTPException as e:
+            emit("error", {"status": e.status_code, "detail": e.detail})
+        except Exception as e:
+            emit("error", {"status": 500, "detail": str(e)})
+        finally:
+            queue.put_nowait(None)
+
+    async def events():
+        task = asyncio.create_task(produce())
+        try:
+            while (item := await queue.get()) is not None:
+                event, data = item
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        finally:
+            task.cancel()  # Client went away: stop waiting (a shared run carries on for the others)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/api/agents/health")
+async def agents_health(force: bool = False):
+    """Provisioning state plus a (cached) check that the provisioned agents still exist; 503 if not ready."""
+    result = await agent_registry.probe(force)
+    return JSONResponse(result, status_code=200 if result["ok"] else 503)
+
+
 @router.get("/api/agents")
 async def list_agents():
     return {
         "agents": [
-            {"name": "Papa Bois 🌳", "role": "Orchestrator", "id": HANDOFF_AGENTS.get("papa_bois") or AGENTS["papa_bois"],
+            {"name": "Papa Bois 🌳", "role": "Orchestrator", "id": _handoff_agent("papa_bois"),
              "platform": "mistral_agents_api", "features": ["conversations", "handoffs"]},
-            {"name": "Anansi 🕷️", "role": "Storyteller", "id": HANDOFF_AGENTS.get("anansi") or AGENTS["anansi"],
+            {"name": "Anansi 🕷️", "role": "Storyteller", "id": _handoff_agent("anansi"),
              "platform": "mistral_agents_api", "features": ["conversations", "function_calling", "json_mode"]},
             {"name": "Devi 🙏", "role": "Voice/Audio", "id": AGENTS["devi"],
              "platform": "elevenlabs", "features": ["tts", "tts_websocket", "sound_effects", "music_compose"]},
@@ -478,6 +938,6 @@ async def list_agents():
         ],
         "function_tools": ["generate_tts", "generate_sound_effect", "compose_lullaby", "search_cultural_context"],
         "built_in_tools": ["web_search"],
-        "handoff_agents_created": bool(HANDOFF_AGENTS),
+        "handoff_agents_created": agent_registry.ready(),
         "tool": "mistral_agents_api"
     }
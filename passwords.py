@@ -0,0 +1,86 @@
+"""
+Password hashing — PBKDF2-SHA256 off the event loop.
+
+Each hash runs on a small dedicated thread pool (hashlib releases the GIL
+while it works), so a burst of logins queues there instead of stalling
+narration streams and health checks. Comparisons are constant-time.
+
+The work factor is stored per user (`users.password_iterations`; rows from
+before the column existed were hashed with 100,000). The default stays at
+100,000; setting PASSWORD_ITERATIONS higher is opt-in and upgrades each
+account the next time it logs in.
+
+An unknown email is burned at the factor of the most recent successful
+login rather than at PASSWORD_ITERATIONS: while accounts are mid-upgrade
+most stored hashes still use the older factor, and burning at the new one
+would make "no such user" measurably slower than "wrong password". The
+estimate lags the population slightly, which is the accepted trade-off.
+"""
+import os
+import asyncio
+import hashlib
+import hmac
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+LEGACY_ITERATIONS = 100_000
+ITERATIONS = int(os.environ.get("PASSWORD_ITERATIONS", LEGACY_ITERATIONS))
+# hashlib releases the GIL, so two threads help even on small hosts
+WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", max(2, min(4, (os.cpu_count() or 2) // 2))))
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="pbkdf2")
+_counters = {"hashes": 0, "in_flight": 0, "hash_seconds": 0.0, "upgraded": 0}
+# Verified against when the email is unknown, so a miss costs the same as a wrong password
+_DUMMY_SALT = secrets.token_hex(16)
+_typical = {"iterations": LEGACY_ITERATIONS}  # Work factor of the last successful login
+
+
+def hash_sync(password: str, salt: str, iterations: int) -> str:
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), iterations).hex()
+
+
+async def hash_password(password: str, salt: str, iterations: int = ITERATIONS) -> str:
+    _counters["in_flight"] += 1
+    t0 = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, hash_sync, password, salt, iterations)
+    finally:
+        _counters["in_flight"] -= 1
+        _counters["hashes"] += 1
+        _counters["hash_seconds"] += time.perf_counter() - t0
+
+
+async def new(password: str) -> tuple[str, str, int]:
+    """(hash, salt, iterations) for storing a new or upgraded password."""
+    salt = secrets.token_hex(16)
+    return await hash_password(password, salt, ITERATIONS), salt, ITERATIONS
+
+
+async def verify(password: str, salt: str, stored: str, iterations: int) -> bool:
+    ok = hmac.compare_digest(await hash_password(password, salt, iterations), stored)
+    if ok:
+        _typical["iterations"] = iterations
+    return ok
+
+
+async def burn(password: str):
+    """Roughly the cost of verify() against a typical stored hash, for an account that doesn't exist."""
+    await hash_password(password, _DUMMY_SALT, _typical["iterations"])
+
+
+def needs_upgrade(iterations: int) -> bool:
+    return iterations < ITERATIONS
+
+
+async def upgrade(password: str) -> tuple[str, str, int]:
+    """new() for a verified password stored with an older work factor."""
+    _counters["upgraded"] += 1
+    return await new(password)
+
+
+def stats() -> dict:
+    hashes = _counters["hashes"]
+    return {"workers": WORKERS, "iterations": ITERATIONS, "hashes": hashes, "in_flight": _counters["in_flight"],
+            "upgraded": _counters["upgraded"], "burn_iterations": _typical["iterations"],
+            "avg_ms": round(_counters["hash_seconds"] / hashes * 1000, 1) if hashes else None}
@@ -3,15 +3,23 @@ Story pipeline — Anansi (story gen), Ogma (dual-STT), Devi (narration).
 Wires the demo flow: voice input → story → narration → playback.
 """
 import os
+import asyncio
 import base64
+import hashlib
 import json
-import httpx
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from urllib.parse import urlencode
+import http_clients
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, UploadFile, File, Query
 from starlette.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 import database as db
 import prompt_cache
+import blob_store
+import singleflight
+import tts_cache
+import asset_http
+import sessions
 
 router = APIRouter()
 
@@ -24,6 +32,7 @@ class StoryRequest(BaseModel):
     language: str = "en"
     prompt: str
     voice_id: Optional[str] = None
+    regenerate: bool = False  # Skip and replace any cached story for this prompt
 
 class NarrateRequest(BaseModel):
     text: str
@@ -38,28 +47,25 @@ async def transcribe_voice(audio: UploadFile = File(...)):
 
     # ElevenLabs STT (Scribe v1)
     try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            r = await client.post("https://api.elevenlabs.io/v1/speech-to-text",
-                headers={"xi-api-key": ELEVENLABS_API_KEY},
-                files={"file": (audio.filename or "audio.wav", audio_data, audio.content_type or "audio/wav")},
-                data={"model_id": "scribe_v1"})
-            if r.status_code == 200:
-                el_data = r.json()
-                results["elevenlabs"] = {
-                    "text": el_data.get("text", ""),
-                    "language": el_data.get("language_code", "en")
-                }
+        r = await http_clients.get("elevenlabs").post("https://api.elevenlabs.io/v1/speech-to-text",
+            headers={"xi-api-key": ELEVENLABS_API_KEY},
+            files={"file": (audio.filename or "audio.wav", audio_data, audio.content_type or "audio/wav")},
+            data={"model_id": "scribe_v1"}, timeout=30)
+        if r.status_code == 200:
+            el_data = r.json()
+            results["elevenlabs"] = {
+                "text": el_data.get("text", ""),
+                "language": el_data.get("language_code", "en")
+            }
     except Exception as e:
         results["elevenlabs"] = {"error": str(e)}
 
     # Voxtral (Mistral) STT — via Mistral's audio endpoint
     try:
-        from mistralai import Mistral
-        import base64
         if MISTRAL_API_KEY:
-            mclient = Mistral(api_key=MISTRAL_API_KEY)
+            mclient = http_clients.mistral(MISTRAL_API_KEY)
             b64_audio = base64.b64encode(audio_data).decode()
-            resp = mclient.chat.complete(
+            resp = await mclient.chat.complete_async(
                 model="mistral-large-latest",
                 messages=[{
                     "role": "user",
@@ -93,22 +99,39 @@ async def transcribe_voice(audio: UploadFile = File(...)):
 
 # --- Anansi: Story Generation (Mistral Large) ---
 @router.post("/api/story")
-async def create_story(req: StoryRequest):
+async def create_story(req: StoryRequest, user: Optional[dict] = Depends(sessions.optional_user)):
+    user_id = user["id"] if user else None
     # Check cache
+    if req.regenerate:
+        prompt_cache.invalidate(req.prompt, req.child_name, req.language)
+        return await _generate_story(req, user_id)
     cached = await prompt_cache.get_cached(req.prompt, req.child_name, req.language)
     if cached:
-        return {
-            "id": cached.get("id", 0), "title": cached.get("title", "Cached"),
-            "scenes": cached.get("scenes", []), "mood": cached.get("mood", "magical"),
-            "language": req.language, "child_name": req.child_name,
-            "agent": "cache_hit", "tool": "prompt_cache", "cached": True
-        }
+        return _cached_story(cached, req)
+
+    # Identical requests already in flight share one generation
+    async def from_cache():
+        hit = await prompt_cache.get_exact(req.prompt, req.child_name, req.language)
+        return _cached_story(hit, req) if hit else None
+
+    key = "story:" + prompt_cache.hash_prompt(req.prompt, req.child_name, req.language)
+    result, shared = await singleflight.do(key, lambda: _generate_story(req, user_id), from_cache)
+    return {**result, "deduplicated": True} if shared else result
+
+def _cached_story(cached: dict, req: StoryRequest) -> dict:
+    return {
+        "id": cached.get("id", 0), "title": cached.get("title", "Cached"),
+        "scenes": cached.get("scenes", []), "mood": cached.get("mood", "magical"),
+        "language": req.language, "child_name": req.child_name,
+        "agent": "cache_hit", "tool": "prompt_cache", "cached": True,
+        "match_score": cached.get("match_score", 1.0)
+    }
 
+async def _generate_story(req: StoryRequest, user_id: Optional[int] = None) -> dict:
     if not MISTRAL_API_KEY:
         raise HTTPException(status_code=500, detail="MISTRAL_API_KEY not set")
 
-    from mistralai import Mistral
-    mclient = Mistral(api_key=MISTRAL_API_KEY)
+    mclient = http_clients.mistral(MISTRAL_API_KEY)
 
     lang_names = {"en": "English", "fr": "French", "ja": "Japanese", "hi": "Hindi",
                   "es": "Spanish", "pt": "Portuguese", "de": "German", "zh": "Chinese",
@@ -125,7 +148,7 @@ Rules:
 - End with the child falling peacefully asleep
 - Return as JSON: {{"title": "...", "scenes": ["scene1", "scene2", ...], "mood": "calming|adventurous|funny|magical"}}"""
 
-    resp = mclient.chat.complete(
+    resp = await mclient.chat.complete_async(
         model="mistral-large-latest",
         messages=[
             {"role": "system", "content": system_prompt},
@@ -143,16 +166,15 @@ Rules:
     # Save to DB
     content_json = json.dumps(story, ensure_ascii=False)
     voice_id = req.voice_id or "pNInz6obpgDQGcFmaJgB"
-    result = await db.execute(
-        "INSERT INTO stories (title, content, voice_id, child_name, language) VALUES (?, ?, ?, ?, ?)",
-        [story.get("title", "Untitled"), content_json, voice_id, req.child_name, req.language]
-    )
-
-    # Get the inserted ID
-    id_result = await db.execute("SELECT MAX(id) FROM stories", [])
-    story_id = id_result.rows[0][0] if id_result.rows else 1
-
-    await prompt_cache.set_cached(req.prompt, req.child_name, req.language,
+    # Story row + prompt cache entry in one atomic round trip
+    saved = await db.batch([
+        ("INSERT INTO stories (title, content, voice_id, child_name, language, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+         [story.get("title", "Untitled"), content_json, voice_id, req.child_name, req.language, user_id]),
+        prompt_cache.set_cached_statement(req.prompt, req.child_name, req.language,
+            {"title": story.get("title"), "scenes": story.get("scenes", []), "mood": story.get("mood", "magical")}),
+    ])
+    story_id = saved[0].last_insert_rowid
+    prompt_cache.remember(req.prompt, req.child_name, req.language,
         {"id": story_id, "title": story.get("title"), "scenes": story.get("scenes", []), "mood": story.get("mood", "magical")})
 
     return {
@@ -167,82 +189,178 @@ Rules:
     }
 
 # --- Stories CRUD ---
+def _encode_cursor(created_at, story_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, story_id]).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, story_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(created_at), int(story_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.get("/api/stories")
-async def list_stories():
-    rs = await db.execute("SELECT id, title, child_name, language, created_at FROM stories ORDER BY created_at DESC LIMIT 50", [])
-    return [{"id": r[0], "title": r[1], "child_name": r[2], "language": r[3], "created_at": r[4]} for r in rs.rows]
+async def list_stories(response: Response, limit: int = Query(50, ge=1, le=200), cursor: Optional[str] = None,
+                       language: Optional[str] = None, child_name: Optional[str] = None,
+                       user_id: Optional[int] = None, include_content: bool = False):
+    """
+    Newest first, keyset-paginated on (created_at, id): pass the X-Next-Cursor
+    header of one page as `cursor` to get the next. Summary columns only unless
+    include_content=true, so a page is served from a covering index.
+    """
+    where, params = [], []
+    for column, value in (("language", language), ("child_name", child_name), ("user_id", user_id)):
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if cursor:
+        where.append("(created_at, id) < (?, ?)")
+        params.extend(_decode_cursor(cursor))
+    columns = "id, title, child_name, language, created_at" + (", content" if include_content else "")
+    rs = await db.execute(
+        f"SELECT {columns} FROM stories {'WHERE ' + ' AND '.join(where) if where else ''} "
+        "ORDER BY created_at DESC, id DESC LIMIT ?",
+        params + [limit + 1]
+    )
+    rows = rs.rows[:limit]
+    if len(rs.rows) > limit:
+        last = rows[-1]
+        next_cursor = _encode_cursor(last[4], last[0])
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{_page_url(next_cursor, limit, language, child_name, user_id, include_content)}>; rel="next"'
+    stories = []
+    for r in rows:
+        story = {"id": r[0], "title": r[1], "child_name": r[2], "language": r[3], "created_at": r[4]}
+        if include_content:
+            story["scenes"], story["mood"] = _parse_content(r[5])
+        stories.append(story)
+    return stories
+
+
+def _page_url(cursor: str, limit: int, language, child_name, user_id, include_content: bool) -> str:
+    query = {"cursor": cursor, "limit": limit, "language": language, "child_name": child_name, "user_id": user_id,
+             "include_content": "true" if include_content else None}
+    return "/api/stories?" + urlencode({k: v for k, v in query.items() if v is not None})
+
+def _parse_content(raw: Optional[str]) -> tuple[list[str], str]:
+    """(scene texts, mood) from a stored story; older rows hold a bare scene list or plain text."""
+    scenes, mood = [], "magical"
+    raw = raw or "{}"
+    try:
+        parsed = json.loads(raw)
+        if isinstance(parsed, dict):
+            scenes = parsed.get("scenes", [])
+            mood = parsed.get("mood", "magical")
+        elif isinstance(parsed, list):
+            scenes = parsed
+    except json.JSONDecodeError:
+        scenes = [raw]
+    return [s.get("text", str(s)) if isinstance(s, dict) else str(s) for s in scenes], mood
 
 @router.get("/api/stories/{story_id}")
 async def get_story(story_id: int):
-    rs = await db.execute("SELECT id, title, content, voice_id, child_name, language, created_at, audio_cache, image_cache FROM stories WHERE id = ?", [story_id])
+    rs, (audio_cache, image_cache) = await asyncio.gather(
+        db.execute("SELECT id, title, content, voice_id, child_name, language, created_at FROM stories WHERE id = ?", [story_id]),
+        blob_store.story_asset_keys(story_id),
+    )
     if not rs.rows:
         raise HTTPException(status_code=404, detail="Story not found")
     r = rs.rows[0]
-    content = json.loads(r[2]) if r[2] else {}
-    scenes = content.get("scenes", [])
-    scenes = [s.get("text", str(s)) if isinstance(s, dict) else str(s) for s in scenes]
-    audio_cache = {}
-    if len(r) > 7 and r[7]:
-        try:
-            audio_cache = {k: True for k in json.loads(r[7]).keys()}
-        except: pass
-    image_cache = {}
-    if len(r) > 8 and r[8]:
-        try:
-            image_cache = {k: True for k in json.loads(r[8]).keys()}
-        except: pass
+    scenes, mood = _parse_content(r[2])
     return {
-        "id": r[0], "title": r[1], "scenes": scenes,
-        "mood": content.get("mood", "magical"), "voice_id": r[3],
-        "child_name": r[4], "language": r[5], "created_at": r[6],
-        "has_audio": audio_cache, "has_images": image_cache
+        "id": r[0], "title": r[1], "scenes": scenes, "mood": mood,
+        "voice_id": r[3], "child_name": r[4] or "", "language": r[5] or "en",
+        "created_at": r[6] or "", "has_audio": audio_cache, "has_images": image_cache
     }
 
+@router.delete("/api/stories/{story_id}")
+async def delete_story(story_id: int, user: dict = Depends(sessions.current_user)):
+    """Delete a story, its asset index and any prompt-cache entries resolving to it (owner or admin only)."""
+    rs = await db.execute("SELECT user_id FROM stories WHERE id = ?", [story_id])
+    if not rs.rows:
+        raise HTTPException(status_code=404, detail="Story not found")
+    if user["role"] != "admin" and rs.rows[0][0] != user["id"]:
+        raise HTTPException(status_code=403, detail="Not your story")
+    results = await db.batch([
+        ("DELETE FROM stories WHERE id = ?", [story_id]),
+        ("DELETE FROM story_assets WHERE story_id = ?", [story_id]),
+        prompt_cache.delete_story_statement(story_id),
+    ])
+    prompt_cache.invalidate_story(story_id)
+    if not results[0].rows_affected:
+        raise HTTPException(status_code=404, detail="Story not found")
+    return {"deleted": story_id}
+
 # --- Devi: Narration (ElevenLabs TTS) ---
 @router.post("/api/narrate")
 async def narrate_scene(req: NarrateRequest):
     if not ELEVENLABS_API_KEY:
         raise HTTPException(status_code=500, detail="ELEVENLABS_API_KEY not set")
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(
+    settings = {"stability": 0.6, "similarity_boost": 0.8}
+
+    async def fetch() -> bytes:
+        r = await http_clients.get("elevenlabs").post(
             f"https://api.elevenlabs.io/v1/text-to-speech/{req.voice_id}",
             headers={"xi-api-key": ELEVENLABS_API_KEY, "Content-Type": "application/json"},
             json={
                 "text": req.text,
-                "model_id": "eleven_multilingual_v2",
-                "voice_settings": {"stability": 0.6, "similarity_boost": 0.8}
-            }
+                "model_id": tts_cache.DEFAULT_MODEL,
+                "voice_settings": settings
+            },
+            timeout=30
         )
         if r.status_code != 200:
             raise HTTPException(status_code=r.status_code, detail=r.text[:500])
-        return StreamingResponse(iter([r.content]), media_type="audio/mpeg",
-            headers={"Content-Disposition": "attachment; filename=narration.mp3"})
+        return r.content
+
+    audio = await tts_cache.synthesize(req.text, req.voice_id, tts_cache.DEFAULT_MODEL, settings, fetch)
+    return StreamingResponse(iter([audio]), media_type="audio/mpeg",
+        headers={"Content-Disposition": "attachment; filename=narration.mp3"})
 
 # --- Cached audio endpoint ---
+async def _asset_response(request: Request, story_id: int, key: str, not_found: str):
+    """Serve a story asset from the blob store (streamed file), else from legacy JSON columns."""
+    asset = await blob_store.get_asset(story_id, key)
+    if asset:
+        path = blob_store.get_backend().local_path(asset["hash"])
+        if path:
+            return asset_http.asset_response(request, asset["hash"], asset["size"], asset["mime"], path=path)
+        data = await blob_store.get_backend().get(asset["hash"])
+        digest = asset["hash"]
+    else:
+        data = await blob_store.get_legacy_asset(story_id, key)
+        digest = hashlib.sha256(data).hexdigest() if data else None
+    if not data:
+        raise HTTPException(status_code=404, detail=not_found)
+    return asset_http.asset_response(request, digest, len(data), blob_store.mime_for_key(key), data=data)
+
+
+@router.get("/api/blobs/{name}")
+async def get_blob(request: Request, name: str):
+    """Serve a blob by content hash, e.g. assets streamed from /api/orchestrate/stream."""
+    digest, _, ext = name.partition(".")
+    mime = next((m for m, e in blob_store.EXTENSIONS.items() if e == ext), None)
+    if len(digest) != 64 or mime is None or any(c not in "0123456789abcdef" for c in digest):
+        raise HTTPException(status_code=404, detail="Blob not found")
+    path = blob_store.get_backend().local_path(digest)
+    if path:
+        return asset_http.asset_response(request, digest, os.path.getsize(path), mime, path=path)
+    data = await blob_store.get_backend().get(digest)
+    if not data:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    return asset_http.asset_response(request, digest, len(data), mime, data=data)
+
+
 @router.get("/api/stories/{story_id}/audio/{scene_index}")
-async def get_cached_audio(story_id: int, scene_index: str):
-    rs = await db.execute("SELECT audio_cache FROM stories WHERE id = ?", [story_id])
-    if not rs.rows or not rs.rows[0][0]:
-        raise HTTPException(status_code=404, detail="No cached audio")
-    import base64
-    cache = json.loads(rs.rows[0][0])
-    audio_b64 = cache.get(scene_index)
-    if not audio_b64:
-        raise HTTPException(status_code=404, detail=f"No audio for scene {scene_index}")
-    audio_bytes = base64.b64decode(audio_b64)
-    return StreamingResponse(iter([audio_bytes]), media_type="audio/mpeg")
+async def get_cached_audio(request: Request, story_id: int, scene_index: str):
+    return await _asset_response(request, story_id, scene_index, f"No audio for scene {scene_index}")
 
 
 @router.get("/api/stories/{story_id}/image/{scene_key}")
-async def get_story_image(story_id: int, scene_key: str):
+async def get_story_image(request: Request, story_id: int, scene_key: str):
     """Serve cached scene illustration as PNG."""
-    rs = await db.execute("SELECT image_cache FROM stories WHERE id = ?", [story_id])
-    if not rs.rows or not rs.rows[0][0]:
-        raise HTTPException(status_code=404, detail="No images")
-    cache = json.loads(rs.rows[0][0])
     key = f"img_{scene_key}" if not scene_key.startswith("img_") else scene_key
-    if key not in cache:
-        raise HTTPException(status_code=404, detail=f"Image {key} not found")
-    from starlette.responses import Response
-    return Response(content=base64.b64decode(cache[key]), media_type="image/png")
+    return await _asset_response(request, story_id, key, f"Image {key} not found")
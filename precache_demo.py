@@ -1,8 +1,12 @@
 """
-Pre-cache a demo story with all audio narrations + images stored in Turso.
-Run once to seed the demo library with instant-playback stories.
+Pre-cache a demo story with all audio narrations + images.
+Run once to seed the demo library with instant-playback stories. Clips go to the
+blob store (run with the server's BLOB_DIR) and are indexed in story_assets in Turso.
 """
-import os, json, base64, httpx, sys
+import os, json, asyncio, sys
+import rate_limit
+import tts_cache
+import blob_store
 
 ELEVENLABS_API_KEY = os.environ["ELEVENLABS_API_KEY"]
 MISTRAL_API_KEY = os.environ["MISTRAL_API_KEY"]
@@ -10,15 +14,24 @@ TURSO_URL = "https://sandmantales-monkfenix.aws-ap-northeast-1.turso.io"
 TURSO_TOKEN = os.environ["TURSO_AUTH_TOKEN"]
 
 HEADERS_TURSO = {"Authorization": f"Bearer {TURSO_TOKEN}", "Content-Type": "application/json"}
+http = rate_limit.sync_client()  # Per-upstream quotas + Retry-After
 
 def turso_exec(sql, params=None):
-    body = {"statements": [{"q": sql, "params": params or []}]}
-    r = httpx.post(TURSO_URL, headers=HEADERS_TURSO, json=body, timeout=30)
+    return turso_batch([(sql, params)])
+
+def turso_batch(statements):
+    """Run (sql, params) statements in one request, so last_insert_rowid() carries over; None entries are skipped."""
+    body = {"statements": [{"q": s[0], "params": s[1] or []} for s in statements if s]}
+    r = http.post(TURSO_URL, headers=HEADERS_TURSO, json=body, timeout=30)
     return r.json()
 
+def store(key, data):
+    """Put one clip in the blob store; returns its story_assets reference."""
+    return asyncio.run(blob_store.put_asset(key, data))
+
 def generate_story(child_name, language, prompt):
     from mistralai import Mistral
-    client = Mistral(api_key=MISTRAL_API_KEY)
+    client = Mistral(api_key=MISTRAL_API_KEY, client=http)
     lang_names = {"en":"English","fr":"French","ja":"Japanese","hi":"Hindi","es":"Spanish"}
     lang_name = lang_names.get(language, "English")
 
@@ -35,22 +48,24 @@ Return JSON: {{"title": "...", "scenes": ["scene1", "scene2", ...], "mood": "cal
     return json.loads(resp.choices[0].message.content.strip())
 
 def generate_audio(text, voice_id="FGY2WhTYpPnrIDTdsKH5"):
-    """Generate TTS audio, return base64 mp3"""
-    r = httpx.post(
-        f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
-        headers={"xi-api-key": ELEVENLABS_API_KEY, "Content-Type": "application/json"},
-        json={"text": text, "model_id": "eleven_multilingual_v2",
-              "voice_settings": {"stability": 0.6, "similarity_boost": 0.8}},
-        timeout=30
-    )
-    if r.status_code != 200:
-        print(f"  TTS error: {r.status_code} {r.text[:200]}")
-        return None
-    return base64.b64encode(r.content).decode()
+    """Generate TTS audio (or reuse it from tts_cache), return mp3 bytes"""
+    settings = {"stability": 0.6, "similarity_boost": 0.8}
+    def fetch():
+        r = http.post(
+            f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
+            headers={"xi-api-key": ELEVENLABS_API_KEY, "Content-Type": "application/json"},
+            json={"text": text, "model_id": tts_cache.DEFAULT_MODEL, "voice_settings": settings},
+            timeout=30
+        )
+        if r.status_code != 200:
+            print(f"  TTS error: {r.status_code} {r.text[:200]}")
+            return None
+        return r.content
+    return tts_cache.synthesize_sync(text, voice_id, tts_cache.DEFAULT_MODEL, settings, fetch)
 
 def generate_sfx(prompt, duration=5.0):
-    """Generate SFX, return base64 mp3"""
-    r = httpx.post(
+    """Generate SFX, return mp3 bytes"""
+    r = http.post(
         "https://api.elevenlabs.io/v1/sound-generation",
         headers={"xi-api-key": ELEVENLABS_API_KEY, "Content-Type": "application/json"},
         json={"text": prompt, "duration_seconds": duration},
@@ -59,10 +74,10 @@ def generate_sfx(prompt, duration=5.0):
     if r.status_code != 200:
         print(f"  SFX error: {r.status_code} {r.text[:200]}")
         return None
-    return base64.b64encode(r.content).decode()
+    return r.content
 
 def generate_image(prompt, scene_num):
-    """Generate image via Gemini Nano Banana Pro, return base64 png"""
+    """Generate image via Gemini Nano Banana Pro, return png bytes"""
     import google.generativeai as genai
     gemini_key = os.environ.get("GEMINI_API_KEY", "")
     if not gemini_key:
@@ -71,12 +86,13 @@ def generate_image(prompt, scene_num):
     genai.configure(api_key=gemini_key)
     try:
         model = genai.GenerativeModel("gemini-2.0-flash-exp")
-        response = model.generate_content(
-            f"Children's book illustration, dreamy watercolor style: {prompt}",
-            generation_config={"response_mime_type": "image/png"}
-        )
+        with rate_limit.sync_slot("gemini"):  # SDK call: not routed through our httpx client
+            response = model.generate_content(
+                f"Children's book illustration, dreamy watercolor style: {prompt}",
+                generation_config={"response_mime_type": "image/png"}
+            )
         if response.parts and hasattr(response.parts[0], 'inline_data'):
-            return base64.b64encode(response.parts[0].inline_data.data).decode()
+            return response.parts[0].inline_data.data
     except Exception as e:
         print(f"  Image gen error: {e}")
     return None
@@ -99,34 +115,35 @@ for demo in demos:
     print(f"  Scenes: {len(story['scenes'])}")
 
     # Generate audio for each scene
-    audio_cache = {}
+    assets = []
     for i, scene in enumerate(story["scenes"]):
         print(f"  🎙️ Narrating scene {i+1}/{len(story['scenes'])}...")
-        audio_b64 = generate_audio(scene, demo["voice_id"])
-        if audio_b64:
-            audio_cache[str(i)] = audio_b64
-            print(f"    ✅ {len(audio_b64)//1024}KB audio cached")
+        audio = generate_audio(scene, demo["voice_id"])
+        if audio:
+            assets.append(store(str(i), audio))
+            print(f"    ✅ {len(audio)//1024}KB audio cached")
 
     # Generate ambient SFX
     print(f"  🎵 Generating ambient SFX...")
-    sfx_b64 = generate_sfx(demo["sfx_mood"], 10.0)
-    if sfx_b64:
-        audio_cache["sfx"] = sfx_b64
-        print(f"    ✅ {len(sfx_b64)//1024}KB SFX cached")
+    sfx = generate_sfx(demo["sfx_mood"], 10.0)
+    if sfx:
+        assets.append(store("sfx", sfx))
+        print(f"    ✅ {len(sfx)//1024}KB SFX cached")
 
     # Generate lullaby
     print(f"  🎶 Generating lullaby...")
-    lullaby_b64 = generate_sfx("Gentle soothing lullaby music box melody for bedtime, soft and calming", 15.0)
-    if lullaby_b64:
-        audio_cache["lullaby"] = lullaby_b64
-        print(f"    ✅ {len(lullaby_b64)//1024}KB lullaby cached")
+    lullaby = generate_sfx("Gentle soothing lullaby music box melody for bedtime, soft and calming", 15.0)
+    if lullaby:
+        assets.append(store("lullaby", lullaby))
+        print(f"    ✅ {len(lullaby)//1024}KB lullaby cached")
 
-    # Save to Turso
+    # Save the story and its asset index to Turso together
     content_json = json.dumps(story, ensure_ascii=False)
-    audio_json = json.dumps(audio_cache)
-
-    sql = "INSERT INTO stories (title, content, voice_id, child_name, language, audio_cache) VALUES (?, ?, ?, ?, ?, ?)"
-    turso_exec(sql, [story["title"], content_json, demo["voice_id"], demo["child_name"], demo["language"], audio_json])
-    print(f"  💾 Saved to Turso with {len(audio_cache)} cached audio tracks")
+    turso_batch([
+        ("INSERT INTO stories (title, content, voice_id, child_name, language) VALUES (?, ?, ?, ?, ?)",
+         [story["title"], content_json, demo["voice_id"], demo["child_name"], demo["language"]]),
+        blob_store.index_statement(assets),
+    ])
+    print(f"  💾 Saved to Turso with {len(assets)} cached audio tracks")
 
 print("\n✅ Demo stories pre-cached!")
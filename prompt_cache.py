@@ -1,10 +1,39 @@
 """
 Prompt cache — avoids regenerating stories/audio for same or similar prompts.
 Uses simple hash for exact matches + optional fuzzy matching.
+
+Two tiers: an in-process LRU/TTL (bounded by entries and bytes, with negative
+caching) in front of the `prompt_cache` table. Each worker has its own LRU, so
+entries are short-lived (PROMPT_CACHE_TTL) and explicitly invalidated on
+delete/regenerate within the worker that made the change.
+
+Fuzzy tier: on an exact miss, a MinHash signature of the prompt is matched
+against an in-memory LSH index of cached prompts for the same
+(child_name, language); a match at or above PROMPT_CACHE_SIMILARITY is served
+with its `match_score`. Entirely local — no embedding API calls.
 """
+import os
 import hashlib
 import json
+import time
+from collections import OrderedDict, deque
 import database as db
+import minhash
+from lru import LRUCache, MISSING
+
+MAX_ENTRIES = int(os.environ.get("PROMPT_CACHE_MAX_ENTRIES", 1024))
+MAX_BYTES = int(os.environ.get("PROMPT_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+TTL = float(os.environ.get("PROMPT_CACHE_TTL", 300))
+NEGATIVE_TTL = float(os.environ.get("PROMPT_CACHE_NEGATIVE_TTL", 30))
+SIMILARITY_THRESHOLD = float(os.environ.get("PROMPT_CACHE_SIMILARITY", 0.8))  # > 1 disables fuzzy matching
+MAX_SCOPES = int(os.environ.get("PROMPT_CACHE_MAX_SCOPES", 256))
+
+_lru = LRUCache(MAX_ENTRIES, MAX_BYTES)
+_story_keys: dict[int, set[str]] = {}  # story id -> cache keys pointing at it
+_scopes: OrderedDict[tuple, tuple] = OrderedDict()  # (child_name, language) -> (LSHIndex, loaded_at)
+_counters = {"hits": 0, "negative_hits": 0, "db_hits": 0, "similar_hits": 0, "misses": 0, "invalidations": 0, "errors": 0}
+_latencies_ms: deque = deque(maxlen=1000)
+
 
 def hash_prompt(prompt: str, child_name: str, language: str) -> str:
     """Normalize and hash a prompt for cache lookup."""
@@ -12,24 +41,185 @@ def hash_prompt(prompt: str, child_name: str, language: str) -> str:
     key = f"{normalized}|{child_name.lower()}|{language}"
     return hashlib.sha256(key.encode()).hexdigest()[:32]
 
-async def get_cached(prompt: str, child_name: str, language: str) -> dict | None:
-    """Check if we have a cached story for this prompt."""
+
+def _remember(h: str, story: dict | None, size: int | None = None):
+    if story is None:
+        _lru.set(h, None, 64, NEGATIVE_TTL)
+        return
+    if size is None:
+        size = len(json.dumps(story, ensure_ascii=False))
+    _lru.set(h, story, size, TTL)
+    if story.get("id"):
+        _story_keys.setdefault(story["id"], set()).add(h)
+
+
+def remember(prompt: str, child_name: str, language: str, story: dict):
+    """Put a freshly saved story into the memory tier (replaces any negative entry)."""
     h = hash_prompt(prompt, child_name, language)
+    _remember(h, story)
+    scope = _scopes.get((child_name.lower(), language))
+    if scope:
+        scope[0].add(h, minhash.signature(prompt))
+
+
+async def _scope_index(child_name: str, language: str) -> minhash.LSHIndex:
+    """LSH index of cached prompts for one child/language, reloaded from the table every TTL."""
+    key = (child_name.lower(), language)
+    scope = _scopes.get(key)
+    if scope and scope[1] + TTL > time.monotonic():
+        _scopes.move_to_end(key)
+        return scope[0]
+    rs = await db.execute(
+        "SELECT prompt_hash, prompt_text, signature FROM prompt_cache WHERE child_name = ? AND language = ?",
+        [key[0], language]
+    )
+    index = minhash.LSHIndex()
+    for h, text, raw_sig in rs.rows:
+        index.add(h, minhash.decode(raw_sig) or minhash.signature(text or ""))
+    _scopes[key] = (index, time.monotonic())
+    _scopes.move_to_end(key)
+    while len(_scopes) > MAX_SCOPES:
+        _scopes.popitem(last=False)
+    return index
+
+
+async def _story_by_hash(h: str) -> dict | None:
+    hit = _lru.get(h)
+    if hit is not MISSING:
+        return hit
+    rs = await db.execute("SELECT story_json FROM prompt_cache WHERE prompt_hash = ?", [h])
+    if rs.rows and rs.rows[0][0]:
+        story = json.loads(rs.rows[0][0])
+        _remember(h, story, len(rs.rows[0][0]))
+        return story
+    return None
+
+
+async def _load_exact(h: str, child_name: str, language: str) -> dict | None:
     rs = await db.execute(
         "SELECT story_json FROM prompt_cache WHERE prompt_hash = ? AND child_name = ? AND language = ?",
         [h, child_name.lower(), language]
     )
     if rs.rows and rs.rows[0][0]:
-        return json.loads(rs.rows[0][0])
+        story = json.loads(rs.rows[0][0])
+        _remember(h, story, len(rs.rows[0][0]))
+        return story
     return None
 
+
+async def get_exact(prompt: str, child_name: str, language: str) -> dict | None:
+    """
+    Exact lookup straight from the table, ignoring negative memory entries.
+    For callers waiting on another worker that is generating this prompt.
+    """
+    story = await _load_exact(hash_prompt(prompt, child_name, language), child_name, language)
+    return {**story, "match_score": 1.0} if story else None
+
+
+async def get_cached(prompt: str, child_name: str, language: str) -> dict | None:
+    """
+    Check if we have a cached story for this prompt (exact, then similar).
+    The returned dict carries `match_score` (1.0 for an exact match).
+    """
+    t0 = time.perf_counter()
+    h = hash_prompt(prompt, child_name, language)
+    try:
+        hit = _lru.get(h)
+        if hit is not MISSING and hit is not None:
+            _counters["hits"] += 1
+            return {**hit, "match_score": 1.0}
+        if hit is None:
+            _counters["negative_hits"] += 1  # Known exact miss; still try the fuzzy tier
+        else:
+            story = await _load_exact(h, child_name, language)
+            if story:
+                _counters["db_hits"] += 1
+                return {**story, "match_score": 1.0}
+            _remember(h, None)
+
+        if SIMILARITY_THRESHOLD <= 1.0:
+            index = await _scope_index(child_name, language)
+            best, score = index.nearest(minhash.signature(prompt))
+            if best and score >= SIMILARITY_THRESHOLD:
+                story = await _story_by_hash(best)
+                if story:
+                    _counters["similar_hits"] += 1
+                    return {**story, "match_score": round(score, 3)}
+                index.remove(best)  # Row is gone (story deleted elsewhere)
+        _counters["misses"] += 1
+        return None
+    finally:
+        _latencies_ms.append((time.perf_counter() - t0) * 1000)
+
+
 async def set_cached(prompt: str, child_name: str, language: str, story: dict):
     """Cache a generated story for this prompt."""
     h = hash_prompt(prompt, child_name, language)
+    remember(prompt, child_name, language, story)
     try:
         await db.execute(
-            "INSERT OR REPLACE INTO prompt_cache (prompt_hash, prompt_text, child_name, language, story_json) VALUES (?, ?, ?, ?, ?)",
-            [h, prompt, child_name.lower(), language, json.dumps(story, ensure_ascii=False)]
+            "INSERT OR REPLACE INTO prompt_cache (prompt_hash, prompt_text, child_name, language, story_json, signature) VALUES (?, ?, ?, ?, ?, ?)",
+            [h, prompt, child_name.lower(), language, json.dumps(story, ensure_ascii=False), minhash.encode(minhash.signature(prompt))]
         )
-    except Exception:
-        pass  # Cache miss is fine, don't break the flow
+    except Exception as e:
+        # Cache write failure is fine, don't break the flow — but make it visible
+        _counters["errors"] += 1
+        print(f"⚠️ prompt_cache.set_cached: {e}")
+
+def set_cached_statement(prompt: str, child_name: str, language: str, story: dict) -> tuple:
+    """
+    Cache statement for use in a db.batch right after the stories INSERT:
+    the story's "id" is filled in from last_insert_rowid() in the same round trip.
+    Call remember() with the saved story once the batch succeeds.
+    """
+    h = hash_prompt(prompt, child_name, language)
+    return (
+        "INSERT OR REPLACE INTO prompt_cache (prompt_hash, prompt_text, child_name, language, story_json, signature) "
+        "VALUES (?, ?, ?, ?, json_set(?, '$.id', last_insert_rowid()), ?)",
+        [h, prompt, child_name.lower(), language, json.dumps(story, ensure_ascii=False),
+         minhash.encode(minhash.signature(prompt))]
+    )
+
+
+def invalidate(prompt: str, child_name: str, language: str) -> bool:
+    """Drop one prompt from the memory tier (e.g. before regenerating it)."""
+    dropped = _lru.pop(hash_prompt(prompt, child_name, language))
+    _counters["invalidations"] += int(dropped)
+    return dropped
+
+
+def delete_story_statement(story_id: int) -> tuple:
+    """prompt_cache rows pointing at a story, for the batch that deletes it."""
+    return ("DELETE FROM prompt_cache WHERE json_extract(story_json, '$.id') = ?", [story_id])
+
+
+def invalidate_story(story_id: int):
+    """Drop every memory-tier entry that resolves to this story."""
+    for h in _story_keys.pop(story_id, set()):
+        _counters["invalidations"] += int(_lru.pop(h))
+        for index, _ in _scopes.values():
+            index.remove(h)
+
+
+def stats() -> dict:
+    lookups = _counters["hits"] + _counters["db_hits"] + _counters["similar_hits"] + _counters["misses"]
+    served = _counters["hits"] + _counters["db_hits"] + _counters["similar_hits"]
+    lat = sorted(_latencies_ms)
+    return {
+        **_counters,
+        "lookups": lookups,
+        "hit_ratio": round(served / lookups, 4) if lookups else 0.0,
+        "similarity_threshold": SIMILARITY_THRESHOLD,
+        "indexed_scopes": len(_scopes),
+        "evictions": _lru.evictions,
+        "expirations": _lru.expirations,
+        "entries": len(_lru),
+        "bytes": _lru.bytes,
+        "max_entries": _lru.max_entries,
+        "max_bytes": _lru.max_bytes,
+        "lookup_ms": {
+            "p50": round(lat[len(lat) // 2], 3) if lat else None,
+            "p95": round(lat[min(len(lat) - 1, int(len(lat) * 0.95))], 3) if lat else None,
+            "samples": len(lat),
+        },
+    }
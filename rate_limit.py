@@ -0,0 +1,391 @@
+"""
+Per-upstream rate limiting — a token bucket (requests/second, burst) plus a
+concurrency cap for each lane, with priority queueing and Retry-After handling.
+
+Lanes split upstreams whose quotas differ:
+  elevenlabs_tts, elevenlabs_sfx (sound-generation / music), elevenlabs (voices, STT, ...),
+  mistral, gemini, tavily
+
+The limiter sits in the httpx transport of every pooled client (http_clients),
+so all calls — including the Mistral SDK's — are scheduled without callers
+doing anything. Non-HTTP work (the TTS WebSocket) takes a slot with `slot()`.
+Within the server, INTERACTIVE requests are served before BACKGROUND jobs.
+
+Seeding scripts are a separate process, so they cannot queue behind the
+server's requests; `sync_client()` instead gives them RATE_SCRIPT_SHARE of
+each lane (default a quarter, at least one slot). A script running next to
+the server therefore adds a bounded share on top of the server's own quota.
+
+A 429/503 pauses the whole lane for Retry-After (or exponential backoff) and
+the request is retried up to RATE_LIMIT_RETRIES times.
+
+Tuning (env), per lane:
+  RATE_<LANE>_CONCURRENCY   max in-flight requests
+  RATE_<LANE>_RPS           sustained requests per second
+  RATE_<LANE>_BURST         bucket size
+  RATE_SCRIPT_SHARE         fraction of every lane used by scripts (default 0.25)
+  RATE_LIMIT_RETRIES        retries after 429/503 (default 3)
+  RATE_LIMIT_MAX_WAIT       cap on a single Retry-After pause, seconds (default 30)
+"""
+import os
+import asyncio
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Optional
+import httpx
+
+INTERACTIVE, BACKGROUND = 0, 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+LANES = {
+    "elevenlabs_tts": {"concurrency": 4, "rps": 3, "burst": 4},
+    "elevenlabs_sfx": {"concurrency": 2, "rps": 1, "burst": 2},
+    "elevenlabs": {"concurrency": 4, "rps": 5, "burst": 5},
+    "mistral": {"concurrency": 8, "rps": 5, "burst": 8},
+    "gemini": {"concurrency": 2, "rps": 1, "burst": 2},
+    "tavily": {"concurrency": 4, "rps": 2, "burst": 4},
+}
+
+SCRIPT_SHARE = float(os.environ.get("RATE_SCRIPT_SHARE", 0.25))
+RETRIES = int(os.environ.get("RATE_LIMIT_RETRIES", 3))
+MAX_WAIT = float(os.environ.get("RATE_LIMIT_MAX_WAIT", 30))
+RETRY_STATUSES = (429, 503)
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("rate_limit_priority", default=INTERACTIVE)
+
+
+def _setting(lane: str, key: str) -> float:
+    value = float(os.environ.get(f"RATE_{lane.upper()}_{key.upper()}", LANES[lane][key]))
+    if value <= 0:
+        raise ValueError(f"RATE_{lane.upper()}_{key.upper()} must be positive, got {value}")
+    return value
+
+
+def lane_for(url: httpx.URL) -> Optional[str]:
+    """Map a request URL to its lane; None for hosts we don't limit (e.g. Turso)."""
+    host, path = url.host, url.path
+    if host == "api.elevenlabs.io":
+        if path.startswith("/v1/text-to-speech"):
+            return "elevenlabs_tts"
+        if path.startswith(("/v1/sound-generation", "/v1/music")):
+            return "elevenlabs_sfx"
+        return "elevenlabs"
+    if host == "api.mistral.ai":
+        return "mistral"
+    if host == "generativelanguage.googleapis.com":
+        return "gemini"
+    if host == "api.tavily.com":
+        return "tavily"
+    return None
+
+
+@contextmanager
+def priority(level: int):
+    """Run the enclosed calls (and tasks started inside) at `level`, e.g. BACKGROUND for jobs."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def retry_after(response: httpx.Response, attempt: int) -> float:
+    """Seconds to pause after a 429/503: Retry-After (seconds or HTTP date), else 1, 2, 4, ..."""
+    header = response.headers.get("retry-after")
+    delay = None
+    if header:
+        try:
+            delay = float(header)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(header).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+    if delay is None:
+        delay = 2.0 ** attempt
+    return min(max(delay, 0.0), MAX_WAIT)
+
+
+class _Stats:
+    def __init__(self):
+        self.granted = 0
+        self.throttled = 0
+        self.retried = 0
+        self.max_queue_depth = 0
+        self.waits_ms: deque = deque(maxlen=500)
+
+    def snapshot(self) -> dict:
+        waits = sorted(self.waits_ms)
+        return {
+            "granted": self.granted, "throttled": self.throttled, "retried": self.retried,
+            "max_queue_depth": self.max_queue_depth,
+            "wait_ms_p50": round(waits[len(waits) // 2], 1) if waits else None,
+            "wait_ms_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 1) if waits else None,
+        }
+
+
+class Limiter:
+    """Async token bucket + semaphore; waiters are served by priority, then arrival order."""
+
+    def __init__(self, lane: str):
+        self.lane = lane
+        self.concurrency = int(_setting(lane, "concurrency"))
+        self.rate = _setting(lane, "rps")
+        self.burst = _setting(lane, "burst")
+        self.active = 0
+        self.paused_until = 0.0
+        self.stats = _Stats()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._waiters: list = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_loop = None
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wake_later(self, delay: float):
+        loop = asyncio.get_running_loop()
+        if self._timer is None or self._timer_loop is not loop:  # Stale handle from a closed loop
+            self._timer, self._timer_loop = loop.call_later(delay, self._on_timer), loop
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiters and self.active < self.concurrency:
+            if now < self.paused_until:
+                self._wake_later(self.paused_until - now)
+                return
+            if self._tokens < 1:
+                self._wake_later((1 - self._tokens) / self.rate)
+                return
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue  # Cancelled while queued
+            self._tokens -= 1
+            self.active += 1
+            fut.set_result(None)
+
+    async def acquire(self, level: Optional[int] = None):
+        level = _priority.get() if level is None else level
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (level, next(self._seq), fut))
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, len(self._waiters))
+        t0 = time.perf_counter()
+        self._dispatch()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # Granted just as we were cancelled
+            raise
+        self.stats.granted += 1
+        self.stats.waits_ms.append((time.perf_counter() - t0) * 1000)
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def pause(self, seconds: float):
+        """Upstream said slow down: hold the whole lane (Retry-After)."""
+        self.stats.throttled += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def saturated(self) -> bool:
+        """No slot or token free right now: another request would only queue behind this lane's waiters."""
+        self._refill(time.monotonic())
+        return self.active >= self.concurrency or self._tokens < 1 or any(not f.done() for *_, f in self._waiters)
+
+    def snapshot(self) -> dict:
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for level, _, fut in self._waiters:
+            if not fut.done():
+                queued[PRIORITY_NAMES.get(level, str(level))] += 1
+        return {
+            "active": self.active, "queued": sum(queued.values()), "queued_by_priority": queued,
+            "concurrency": self.concurrency, "rps": self.rate, "burst": self.burst,
+            "paused_for_s": round(max(0.0, self.paused_until - time.monotonic()), 2),
+            **self.stats.snapshot(),
+        }
+
+
+class SyncLimiter:
+    """Thread-safe blocking variant for scripts (FIFO; no priorities), limited to SCRIPT_SHARE of the lane."""
+
+    def __init__(self, lane: str):
+        self.lane = lane
+        self.concurrency = max(1, int(_setting(lane, "concurrency") * SCRIPT_SHARE))
+        self.rate = _setting(lane, "rps") * SCRIPT_SHARE
+        self.burst = max(1.0, _setting(lane, "burst") * SCRIPT_SHARE)
+        self.paused_until = 0.0
+        self.stats = _Stats()
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def acquire(self):
+        t0 = time.perf_counter()
+        self._slots.acquire()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                wait = max(self.paused_until - now, (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0)
+                if wait <= 0:
+                    self._tokens -= 1
+                    break
+            time.sleep(wait)
+        self.stats.granted += 1
+        self.stats.waits_ms.append((time.perf_counter() - t0) * 1000)
+
+    def release(self):
+        self._slots.release()
+
+    def pause(self, seconds: float):
+        self.stats.throttled += 1
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+_limiters: dict[str, Limiter] = {}
+_sync_limiters: dict[str, SyncLimiter] = {}
+_sync_lock = threading.Lock()
+
+
+def limiter(lane: str) -> Limiter:
+    if lane not in LANES:
+        raise KeyError(f"Unknown lane: {lane}")
+    if lane not in _limiters:
+        _limiters[lane] = Limiter(lane)
+    return _limiters[lane]
+
+
+def sync_limiter(lane: str) -> SyncLimiter:
+    with _sync_lock:
+        if lane not in _sync_limiters:
+            _sync_limiters[lane] = SyncLimiter(lane)
+        return _sync_limiters[lane]
+
+
+@asynccontextmanager
+async def slot(lane: str, level: Optional[int] = None):
+    """Hold one slot of `lane` for non-HTTP work (e.g. a TTS WebSocket session)."""
+    lim = limiter(lane)
+    await lim.acquire(level)
+    try:
+        yield
+    finally:
+        lim.release()
+
+
+@contextmanager
+def sync_slot(lane: str):
+    lim = sync_limiter(lane)
+    lim.acquire()
+    try:
+        yield
+    finally:
+        lim.release()
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Keep the slot until the response body has been read, then release it once."""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._release:
+                self._release()
+                self._release = None
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """Wraps an async transport; requests to known upstreams go through their lane's Limiter."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        lane = lane_for(request.url)
+        if lane is None:
+            return await self._transport.handle_async_request(request)
+        lim = limiter(lane)
+        for attempt in range(RETRIES + 1):
+            await lim.acquire()
+            try:
+                response = await self._transport.handle_async_request(request)
+            except BaseException:
+                lim.release()
+                raise
+            if response.status_code not in RETRY_STATUSES or attempt == RETRIES:
+                response.stream = _ReleasingStream(response.stream, lim.release)
+                return response
+            await response.aread()
+            await response.aclose()
+            lim.pause(retry_after(response, attempt))  # Before release, so no waiter slips through
+            lim.release()
+            lim.stats.retried += 1
+            print(f"⏳ {lane} {response.status_code}, retry {attempt + 1}/{RETRIES}")
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class SyncRateLimitedTransport(httpx.BaseTransport):
+    def __init__(self, transport: Optional[httpx.BaseTransport] = None):
+        self._transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        lane = lane_for(request.url)
+        if lane is None:
+            return self._transport.handle_request(request)
+        lim = sync_limiter(lane)
+        for attempt in range(RETRIES + 1):
+            lim.acquire()
+            try:
+                response = self._transport.handle_request(request)
+                if response.status_code not in RETRY_STATUSES or attempt == RETRIES:
+                    response.read()
+                    return response
+                response.read()
+                response.close()
+                lim.pause(retry_after(response, attempt))
+            finally:
+                lim.release()
+            lim.stats.retried += 1
+            print(f"⏳ {lane} {response.status_code}, retry {attempt + 1}/{RETRIES}")
+
+    def close(self):
+        self._transport.close()
+
+
+def sync_client(**kwargs) -> httpx.Client:
+    """Blocking httpx.Client with per-lane limits, for seeding scripts (also usable as Mistral(client=...))."""
+    return httpx.Client(transport=SyncRateLimitedTransport(), **kwargs)
+
+
+def stats() -> dict:
+    return {lane: lim.snapshot() for lane, lim in sorted(_limiters.items())}
@@ -0,0 +1,240 @@
+"""
+Resilience for upstream tool calls — retries with jittered exponential backoff,
+hedged duplicates for slow calls, and a circuit breaker per upstream.
+
+Wrap one upstream request with `await call(upstream, fn)`, where `fn` is a
+zero-argument coroutine function that performs a single attempt and raises on
+failure (`check(response, label)` turns a non-200 httpx response into an
+UpstreamError). Upstream names match rate_limit's lanes; rate_limit already
+retries 429/503 with Retry-After inside the transport, so those reach us only
+once its retries are spent and count against the breaker without another retry.
+
+  - Retryable failures (timeouts, connection errors, 408/500/502/504) are retried
+    up to RESILIENCE_RETRIES times after a full-jitter backoff.
+  - If an attempt is still running past the upstream's recent p95 latency, a
+    duplicate is sent and whichever answers first wins (hedging; only for
+    upstreams listed in RESILIENCE_HEDGE, since every duplicate is billed,
+    and never while the lane's rate limiter is already queueing).
+  - BREAKER_FAILURES consecutive failures open the breaker: calls fail fast
+    (or use `fallback`, e.g. a cached asset) for BREAKER_COOLDOWN seconds, then
+    a single probe is let through to decide whether to close it again.
+
+Tuning (env):
+  RESILIENCE_RETRIES        retries per call (default 2)
+  RESILIENCE_BACKOFF_BASE   first backoff ceiling, seconds (default 0.5)
+  RESILIENCE_BACKOFF_CAP    largest backoff ceiling, seconds (default 8)
+  RESILIENCE_HEDGE          comma-separated upstreams to hedge (default elevenlabs_tts,tavily)
+  HEDGE_MIN_SAMPLES         latencies needed before hedging starts (default 20)
+  BREAKER_FAILURES          consecutive failures that open a breaker (default 5)
+  BREAKER_COOLDOWN          seconds a breaker stays open (default 30)
+"""
+import os
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+import httpx
+import rate_limit
+
+RETRIES = int(os.environ.get("RESILIENCE_RETRIES", 2))
+BACKOFF_BASE = float(os.environ.get("RESILIENCE_BACKOFF_BASE", 0.5))
+BACKOFF_CAP = float(os.environ.get("RESILIENCE_BACKOFF_CAP", 8))
+HEDGE = {u.strip() for u in os.environ.get("RESILIENCE_HEDGE", "elevenlabs_tts,tavily").split(",") if u.strip()}
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", 20))
+HEDGE_MIN_DELAY = 0.25
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", 5))
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", 30))
+
+RETRY_STATUSES = (408, 500, 502, 504)
+
+
+class UpstreamError(Exception):
+    """Non-200 response from an upstream; `status` decides whether it is retried."""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitOpen(Exception):
+    """The upstream's breaker is open and no fallback was available."""
+
+
+def check(response: httpx.Response, label: str) -> httpx.Response:
+    """Return a 200 response unchanged, raise UpstreamError("<label> <status>: <body>") otherwise."""
+    if response.status_code != 200:
+        raise UpstreamError(f"{label} {response.status_code}: {response.text[:200]}", response.status_code)
+    return response
+
+
+def _classify(error: BaseException) -> tuple[bool, bool]:
+    """(retry it, count it against the breaker)."""
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError, asyncio.TimeoutError)):
+        return True, True
+    if isinstance(error, UpstreamError):
+        if error.status in RETRY_STATUSES:
+            return True, True
+        return False, error.status >= 500 or error.status == 429
+    return False, False  # Our bug or a 4xx: the upstream itself is fine
+
+
+def backoff(attempt: int) -> float:
+    """Full jitter: uniform in [0, min(cap, base * 2^attempt)] so retries from many callers spread out."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class Breaker:
+    """Consecutive-failure circuit breaker (closed → open → half_open → closed) plus a latency window."""
+
+    def __init__(self, upstream: str):
+        self.upstream = upstream
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.latencies: deque = deque(maxlen=200)
+        self.counts = {"calls": 0, "failures": 0, "retries": 0, "hedged": 0, "hedge_wins": 0,
+                       "short_circuited": 0, "fallbacks": 0, "opened": 0}
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= BREAKER_COOLDOWN:
+            self.state = "half_open"
+        if self.state == "half_open" and not self.probing:
+            self.probing = True  # One probe at a time; everyone else keeps failing fast
+            return True
+        return False
+
+    def record_success(self, latency: Optional[float] = None):
+        if latency is not None:
+            self.latencies.append(latency)
+        self.failures = 0
+        self.probing = False
+        if self.state != "closed":
+            print(f"✅ {self.upstream} circuit closed")
+        self.state = "closed"
+
+    def record_neutral(self):
+        """An outcome that says nothing about the upstream's health (e.g. a 4xx): free the probe, keep the state."""
+        self.probing = False
+
+    def record_failure(self):
+        self.counts["failures"] += 1
+        self.failures += 1
+        self.probing = False
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= BREAKER_FAILURES):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.counts["opened"] += 1
+            print(f"⚠️ {self.upstream} circuit open for {BREAKER_COOLDOWN:g}s after {self.failures} failures")
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def snapshot(self) -> dict:
+        p95 = self.p95()
+        return {
+            "state": self.state, "consecutive_failures": self.failures,
+            "retry_in_s": round(max(0.0, self.opened_at + BREAKER_COOLDOWN - time.monotonic()), 1)
+            if self.state == "open" else None,
+            "latency_ms_p95": round(p95 * 1000) if p95 is not None else None,
+            "hedging": self.upstream in HEDGE,
+            **self.counts,
+        }
+
+
+_breakers: dict[str, Breaker] = {}
+
+
+def breaker(upstream: str) -> Breaker:
+    if upstream not in _breakers:
+        _breakers[upstream] = Breaker(upstream)
+    return _breakers[upstream]
+
+
+async def _attempt(b: Breaker, fn: Callable[[], Awaitable]):
+    """One attempt, hedged with a duplicate if it outlives the recent p95."""
+
+    async def timed():
+        t0 = time.perf_counter()
+        result = await fn()
+        return result, time.perf_counter() - t0
+
+    primary = asyncio.create_task(timed())
+    pending = {primary}
+    try:
+        delay = b.p95() if b.upstream in HEDGE else None
+        if delay is not None:
+            done, _ = await asyncio.wait(pending, timeout=max(delay, HEDGE_MIN_DELAY))
+            if not done and not rate_limit.limiter(b.upstream).saturated():  # Never hedge into our own queue
+                b.counts["hedged"] += 1
+                pending.add(asyncio.create_task(timed()))
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    result, latency = task.result()
+                    if task is not primary:
+                        b.counts["hedge_wins"] += 1
+                    b.record_success(latency)
+                    return result
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def call(upstream: str, fn: Callable[[], Awaitable], fallback: Optional[Callable[[], Awaitable]] = None,
+               retries: int = RETRIES):
+    """
+    Run `fn` against `upstream` with retries, hedging and the breaker.
+    `fallback`, if given, is awaited when the breaker is open or every attempt
+    failed; a non-None result is returned instead of raising.
+    """
+    b = breaker(upstream)
+    b.counts["calls"] += 1
+    error: BaseException = CircuitOpen(f"{upstream} circuit open")
+    for attempt in range(retries + 1):
+        if not b.allow():
+            if attempt == 0:
+                b.counts["short_circuited"] += 1
+            break
+        try:
+            return await _attempt(b, fn)
+        except asyncio.CancelledError:
+            b.probing = False  # Don't leave a half-open breaker waiting on a probe that never reports
+            raise
+        except Exception as e:
+            error = e
+            retryable, failure = _classify(e)
+            if failure:
+                b.record_failure()
+            else:
+                b.record_neutral()  # Only a real success closes a half-open breaker
+            if not retryable or attempt == retries:
+                break
+            b.counts["retries"] += 1
+            delay = backoff(attempt)
+            print(f"⏳ {upstream} {e!r:.120}, retry {attempt + 1}/{retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    if fallback is not None:
+        try:
+            result = await fallback()
+        except Exception as e:
+            print(f"⚠️ {upstream} fallback: {e}")
+            result = None
+        if result is not None:
+            b.counts["fallbacks"] += 1
+            return result
+    raise error
+
+
+def stats() -> dict:
+    return {name: b.snapshot() for name, b in sorted(_breakers.items())}
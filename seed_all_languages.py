@@ -1,22 +1,37 @@
 """
 Seed one story per language with cached audio for demo.
+Upstream calls go through rate_limit's per-lane quotas (and honour Retry-After);
+narration already synthesized by any story, the server or an earlier run comes from tts_cache.
+Clips go to the blob store (run with the server's BLOB_DIR) and are indexed in story_assets.
 """
-import os, json, base64, httpx, time
+import os, json, asyncio
+import rate_limit
+import tts_cache
+import blob_store
 
 ELEVENLABS_API_KEY = os.environ["ELEVENLABS_API_KEY"]
 MISTRAL_API_KEY = os.environ["MISTRAL_API_KEY"]
 TURSO_URL = "https://sandmantales-monkfenix.aws-ap-northeast-1.turso.io"
 TURSO_TOKEN = os.environ["TURSO_AUTH_TOKEN"]
 HEADERS_TURSO = {"Authorization": f"Bearer {TURSO_TOKEN}", "Content-Type": "application/json"}
+http = rate_limit.sync_client()
 
 def turso_exec(sql, params=None):
-    body = {"statements": [{"q": sql, "params": params or []}]}
-    r = httpx.post(TURSO_URL, headers=HEADERS_TURSO, json=body, timeout=30)
+    return turso_batch([(sql, params)])
+
+def turso_batch(statements):
+    """Run (sql, params) statements in one request, so last_insert_rowid() carries over; None entries are skipped."""
+    body = {"statements": [{"q": s[0], "params": s[1] or []} for s in statements if s]}
+    r = http.post(TURSO_URL, headers=HEADERS_TURSO, json=body, timeout=30)
     return r.json()
 
+def store(key, data):
+    """Put one clip in the blob store; returns its story_assets reference."""
+    return asyncio.run(blob_store.put_asset(key, data))
+
 def generate_story(child_name, language, prompt):
     from mistralai import Mistral
-    client = Mistral(api_key=MISTRAL_API_KEY)
+    client = Mistral(api_key=MISTRAL_API_KEY, client=http)
     lang_map = {"en":"English","fr":"French","ja":"Japanese","hi":"Hindi","es":"Spanish",
                 "pt":"Portuguese","de":"German","zh":"Chinese","ar":"Arabic","ko":"Korean"}
     resp = client.chat.complete(
@@ -30,14 +45,16 @@ def generate_story(child_name, language, prompt):
     return json.loads(resp.choices[0].message.content.strip())
 
 def generate_audio(text, voice_id="FGY2WhTYpPnrIDTdsKH5"):
-    r = httpx.post(f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
-        headers={"xi-api-key": ELEVENLABS_API_KEY, "Content-Type": "application/json"},
-        json={"text": text, "model_id": "eleven_multilingual_v2",
-              "voice_settings": {"stability": 0.6, "similarity_boost": 0.8}}, timeout=30)
-    if r.status_code != 200:
-        print(f"    TTS error {r.status_code}: {r.text[:100]}")
-        return None
-    return base64.b64encode(r.content).decode()
+    settings = {"stability": 0.6, "similarity_boost": 0.8}
+    def fetch():
+        r = http.post(f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
+            headers={"xi-api-key": ELEVENLABS_API_KEY, "Content-Type": "application/json"},
+            json={"text": text, "model_id": tts_cache.DEFAULT_MODEL, "voice_settings": settings}, timeout=30)
+        if r.status_code != 200:
+            print(f"    TTS error {r.status_code}: {r.text[:100]}")
+            return None
+        return r.content
+    return tts_cache.synthesize_sync(text, voice_id, tts_cache.DEFAULT_MODEL, settings, fetch)
 
 # Stories we already have (skip these languages)
 existing = turso_exec("SELECT DISTINCT language FROM stories", [])
@@ -74,23 +91,22 @@ for d in demos:
         print(f"  Title: {story['title']}")
         
         # Generate audio for first 2 scenes (save credits) + narrate the rest on demand
-        audio_cache = {}
+        assets = []
         for i, scene in enumerate(story["scenes"]):
             print(f"  🎙️ Narrating scene {i+1}/{len(story['scenes'])}...")
             audio = generate_audio(scene, d["voice"])
             if audio:
-                audio_cache[str(i)] = audio
+                assets.append(store(str(i), audio))
                 print(f"    ✅ {len(audio)//1024}KB")
-            time.sleep(0.5)  # rate limit
         
-        # Save
+        # Save the story and its asset index together
         content_json = json.dumps(story, ensure_ascii=False)
-        audio_json = json.dumps(audio_cache)
-        turso_exec(
-            "INSERT INTO stories (title, content, voice_id, child_name, language, audio_cache) VALUES (?, ?, ?, ?, ?, ?)",
-            [story["title"], content_json, d["voice"], d["child_name"], d["lang"], audio_json]
-        )
-        print(f"  💾 Saved with {len(audio_cache)} audio tracks")
+        turso_batch([
+            ("INSERT INTO stories (title, content, voice_id, child_name, language) VALUES (?, ?, ?, ?, ?)",
+             [story["title"], content_json, d["voice"], d["child_name"], d["lang"]]),
+            blob_store.index_statement(assets),
+        ])
+        print(f"  💾 Saved with {len(assets)} audio tracks")
         existing_langs.add(d["lang"])
     except Exception as e:
         print(f"  ❌ Error: {e}")
@@ -0,0 +1,137 @@
+"""
+Sessions — login tokens validated from memory, with the `sessions` table as the source of truth.
+
+`current_user` / `optional_user` are FastAPI dependencies reading
+`Authorization: Bearer <token>`. A validated token is cached in-process
+until its expiry (at most SESSION_CACHE_TTL, so a logout on another worker
+is honoured within that window); unknown tokens are cached briefly too, so
+a client retrying a bad token doesn't reach the database either. The hot
+path is one dict lookup.
+
+A background sweeper deletes expired rows every SESSION_SWEEP_INTERVAL
+seconds (range delete on idx_sessions_expires).
+"""
+import os
+import asyncio
+import secrets
+import time
+from typing import Optional
+from fastapi import Header, HTTPException
+import database as db
+from lru import LRUCache, MISSING
+
+SESSION_HOURS = int(os.environ.get("SESSION_HOURS", 24))
+CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", 300))
+NEGATIVE_TTL = float(os.environ.get("SESSION_NEGATIVE_TTL", 30))
+SWEEP_INTERVAL = float(os.environ.get("SESSION_SWEEP_INTERVAL", 600))
+
+_cache = LRUCache(max_entries=int(os.environ.get("SESSION_CACHE_ENTRIES", 50_000)), max_bytes=64 * 1024 * 1024)
+_INVALID = None  # Cached value for tokens the database doesn't know
+_sweeper: Optional[asyncio.Task] = None
+_counters = {"hits": 0, "negative_hits": 0, "misses": 0, "created": 0, "revoked": 0, "swept": 0}
+
+
+def _remember(token: str, user: Optional[dict], expires_at: Optional[float] = None):
+    ttl = NEGATIVE_TTL if user is None else min(CACHE_TTL, expires_at - time.time())
+    if ttl > 0:
+        _cache.set(token, user, 256, ttl)
+
+
+async def create(user: dict) -> str:
+    """New session for `user` ({"id", "name", "email", "role"}); returns the token."""
+    token = secrets.token_urlsafe(32)
+    await db.execute(
+        "INSERT INTO sessions (token, user_id, expires_at) VALUES (?, ?, datetime('now', ?))",
+        [token, user["id"], f"+{SESSION_HOURS} hours"]
+    )
+    _remember(token, user, time.time() + SESSION_HOURS * 3600)
+    _counters["created"] += 1
+    return token
+
+
+async def validate(token: str) -> Optional[dict]:
+    """The session's user, or None for an unknown or expired token."""
+    user = _cache.get(token)
+    if user is not MISSING:
+        _counters["hits" if user is not None else "negative_hits"] += 1
+        return user
+    _counters["misses"] += 1
+    rs = await db.execute(
+        "SELECT u.id, u.name, u.email, u.role, CAST(strftime('%s', s.expires_at) AS INTEGER) "
+        "FROM sessions s JOIN users u ON u.id = s.user_id "
+        "WHERE s.token = ? AND s.expires_at > datetime('now')",
+        [token]
+    )
+    if not rs.rows:
+        _remember(token, _INVALID)
+        return None
+    user_id, name, email, role, expires_at = rs.rows[0]
+    user = {"id": user_id, "name": name, "email": email, "role": role}
+    _remember(token, user, expires_at)
+    return user
+
+
+async def revoke(token: str):
+    """End a session here and in the database (other workers drop it within SESSION_CACHE_TTL)."""
+    await db.execute("DELETE FROM sessions WHERE token = ?", [token])
+    _remember(token, _INVALID)
+    _counters["revoked"] += 1
+
+
+def bearer_token(authorization: Optional[str]) -> Optional[str]:
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer":
+        return None
+    return token.strip() or None
+
+
+async def optional_user(authorization: Optional[str] = Header(None)) -> Optional[dict]:
+    token = bearer_token(authorization)
+    return await validate(token) if token else None
+
+
+async def current_user(authorization: Optional[str] = Header(None)) -> dict:
+    user = await optional_user(authorization)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Not signed in", headers={"WWW-Authenticate": "Bearer"})
+    return user
+
+
+async def sweep() -> int:
+    """Delete expired sessions; returns how many went."""
+    rs = await db.execute("DELETE FROM sessions WHERE expires_at <= datetime('now')")
+    _counters["swept"] += rs.rows_affected or 0
+    return rs.rows_affected or 0
+
+
+async def _sweep_forever():
+    while True:
+        try:
+            swept = await sweep()
+            if swept:
+                print(f"🧹 swept {swept} expired sessions")
+        except Exception as e:
+            print(f"⚠️ session sweep: {e}")
+        await asyncio.sleep(SWEEP_INTERVAL)
+
+
+async def start():
+    """Start the expired-session sweeper (after db.init_db)."""
+    global _sweeper
+    _sweeper = asyncio.create_task(_sweep_forever())
+
+
+async def stop():
+    global _sweeper
+    if _sweeper:
+        _sweeper.cancel()
+        await asyncio.gather(_sweeper, return_exceptions=True)
+        _sweeper = None
+
+
+def stats() -> dict:
+    lookups = _counters["hits"] + _counters["negative_hits"] + _counters["misses"]
+    return {**_counters, "cached": len(_cache),
+            "hit_rate": round((lookups - _counters["misses"]) / lookups, 3) if lookups else None}
@@ -0,0 +1,148 @@
+"""
+Single-flight — concurrent identical generations share one in-progress run.
+
+Within a worker, callers with the same key await the leader's future.
+Across uvicorn workers, the leader holds an advisory row lock in
+`generation_locks`; other workers poll for the leader's cached result
+instead of paying for a duplicate Mistral + ElevenLabs + Gemini run.
+The leader renews the lock every SINGLEFLIGHT_LOCK_TTL / 3 seconds while
+`fn` runs, so a long generation keeps it and a crashed leader's lock
+lapses within one TTL (then a waiter takes over).
+"""
+import os
+import asyncio
+import socket
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+import database as db
+
+LOCK_TTL = float(os.environ.get("SINGLEFLIGHT_LOCK_TTL", 60))
+POLL_INTERVAL = float(os.environ.get("SINGLEFLIGHT_POLL_INTERVAL", 1.0))
+
+_OWNER_PREFIX = f"{socket.gethostname()}:{os.getpid()}"
+_inflight: dict[str, asyncio.Task] = {}
+_counters = {"leaders": 0, "collapsed_local": 0, "collapsed_remote": 0, "lock_renewals": 0, "lock_errors": 0}
+
+
+async def _acquire(key: str, owner: str) -> bool:
+    now = time.time()
+    try:
+        rs = await db.execute(
+            "INSERT INTO generation_locks (key, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE generation_locks.expires_at < ?",
+            [key, owner, now + LOCK_TTL, now]
+        )
+        return rs.rows_affected == 1
+    except Exception as e:
+        # Lock table unavailable: fall back to local-only deduplication
+        _counters["lock_errors"] += 1
+        print(f"⚠️ singleflight lock {key[:24]}: {e}")
+        return True
+
+
+async def _release(key: str, owner: str):
+    try:
+        await db.execute("DELETE FROM generation_locks WHERE key = ? AND owner = ?", [key, owner])
+    except Exception as e:
+        _counters["lock_errors"] += 1
+        print(f"⚠️ singleflight release {key[:24]}: {e}")
+
+
+async def _renew(key: str, owner: str):
+    """Keep extending our lock while the leader runs."""
+    while True:
+        await asyncio.sleep(LOCK_TTL / 3)
+        try:
+            await db.execute("UPDATE generation_locks SET expires_at = ? WHERE key = ? AND owner = ?",
+                             [time.time() + LOCK_TTL, key, owner])
+            _counters["lock_renewals"] += 1
+        except Exception as e:
+            _counters["lock_errors"] += 1
+            print(f"⚠️ singleflight renew {key[:24]}: {e}")
+
+
+@asynccontextmanager
+async def held(key: str):
+    """Try once for the advisory lock on `key`; yields True if held (renewed until the block exits)."""
+    owner = f"{_OWNER_PREFIX}:{uuid.uuid4().hex[:8]}"
+    if not await _acquire(key, owner):
+        yield False
+        return
+    renewal = asyncio.create_task(_renew(key, owner))
+    try:
+        yield True
+    finally:
+        renewal.cancel()
+        await _release(key, owner)
+
+
+async def _lead(key: str, fn: Callable[[], Awaitable],
+                remote_result: Optional[Callable[[], Awaitable]]) -> tuple[object, bool]:
+    """(result, ran) — `ran` is True only when this call executed `fn` itself."""
+    owner = f"{_OWNER_PREFIX}:{uuid.uuid4().hex[:8]}"
+    while True:
+        if await _acquire(key, owner):
+            renewal = asyncio.create_task(_renew(key, owner))
+            try:
+                # Another worker may have finished between our cache miss and the lock
+                if remote_result is not None:
+                    result = await remote_result()
+                    if result is not None:
+                        _counters["collapsed_remote"] += 1
+                        return result, False
+                _counters["leaders"] += 1
+                return await fn(), True
+            finally:
+                renewal.cancel()
+                await _release(key, owner)
+        if remote_result is not None:
+            result = await remote_result()
+            if result is not None:
+                _counters["collapsed_remote"] += 1
+                return result, False
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+def _finished(key: str, task: asyncio.Task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception()  # Mark retrieved when every caller had gone
+
+
+async def _run_local(fn: Callable[[], Awaitable]) -> tuple[object, bool]:
+    _counters["leaders"] += 1
+    return await fn(), True
+
+
+async def do(key: str, fn: Callable[[], Awaitable], remote_result: Optional[Callable[[], Awaitable]] = None,
+             local_only: bool = False):
+    """
+    Run `fn()` once per key. Concurrent callers in this worker get the leader's
+    result; while another worker holds the key, `remote_result()` is polled and
+    its first non-None value returned. Returns (result, shared) where `shared`
+    is True when this caller did not run `fn` itself. `local_only` skips the
+    cross-worker lock, for work whose occasional duplicate is cheap and harmless.
+
+    The run is a task of its own: a caller that is cancelled (e.g. a client
+    disconnecting) stops waiting, but the run carries on for the others.
+    """
+    task = _inflight.get(key)
+    if task is not None:
+        _counters["collapsed_local"] += 1
+        result, _ = await asyncio.shield(task)
+        return result, True
+
+    task = asyncio.create_task(_run_local(fn) if local_only else _lead(key, fn, remote_result))
+    _inflight[key] = task
+    task.add_done_callback(lambda t: _finished(key, t))
+    result, ran = await asyncio.shield(task)
+    return result, not ran
+
+
+def stats() -> dict:
+    return {**_counters, "in_flight": len(_inflight),
+            "collapsed": _counters["collapsed_local"] + _counters["collapsed_remote"]}
@@ -0,0 +1,198 @@
+"""
+Sound library — ambient SFX and lullabies reused across stories.
+
+Papa Bois' plans ask for the same handful of soundscapes ("gentle night
+sounds", "soft music box lullaby", ...), so each generated clip is kept in the
+blob store and indexed in `sound_library` by kind, normalized prompt and mood
+tags. A lookup tries, in order:
+  1. the exact normalized prompt,
+  2. a MinHash near match on the prompt (>= SOUND_LIBRARY_SIMILARITY),
+  3. the best mood-tag overlap (>= SOUND_LIBRARY_TAG_SIMILARITY),
+and only a miss goes upstream; the new clip is added in the background.
+`closest()` ignores the thresholds — a stand-in while ElevenLabs is degraded.
+
+Each worker keeps an in-memory index per kind, reloaded every SOUND_LIBRARY_TTL
+so clips added by other workers show up.
+"""
+import os
+import asyncio
+import re
+import time
+from typing import Optional
+import database as db
+import blob_store
+import minhash
+
+SIMILARITY_THRESHOLD = float(os.environ.get("SOUND_LIBRARY_SIMILARITY", 0.5))
+TAG_THRESHOLD = float(os.environ.get("SOUND_LIBRARY_TAG_SIMILARITY", 0.6))
+TTL = float(os.environ.get("SOUND_LIBRARY_TTL", 300))
+
+# Words that appear in nearly every plan prompt and say nothing about the sound
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "with", "in", "on", "for", "to", "at", "by", "from", "into", "like",
+    "sound", "sounds", "effect", "effects", "ambient", "ambience", "background", "bedtime", "theme", "style",
+    "lullaby", "music", "track", "audio", "very", "some", "story",
+}
+
+MOOD_TAGS = {
+    "night": {"night", "nighttime", "moon", "moonlight", "moonlit", "stars", "starry", "starlight", "crickets",
+              "owl", "owls", "evening", "midnight", "dusk"},
+    "rain": {"rain", "rainy", "raindrops", "rainfall", "drizzle", "storm", "thunder", "monsoon"},
+    "water": {"ocean", "sea", "waves", "river", "stream", "lake", "brook", "water", "whale", "whales", "underwater"},
+    "forest": {"forest", "woods", "jungle", "trees", "leaves", "birds", "birdsong", "frogs", "garden"},
+    "wind": {"wind", "breeze", "clouds", "sky", "air", "windy"},
+    "fire": {"fire", "fireplace", "crackling", "campfire", "hearth"},
+    "snow": {"snow", "snowy", "winter", "ice", "frost"},
+    "music_box": {"box", "musicbox", "chimes", "bells", "celesta", "glockenspiel"},
+    "strings": {"harp", "guitar", "strings", "violin", "cello", "lute"},
+    "keys": {"piano", "keys", "keyboard"},
+    "wind_instruments": {"flute", "ocarina", "recorder", "pan", "whistle"},
+    "magical": {"magical", "magic", "fairy", "sparkle", "sparkling", "enchanted", "dreamy", "mystical", "twinkling"},
+    "calm": {"calm", "calming", "gentle", "soft", "peaceful", "soothing", "quiet", "serene", "tranquil", "cozy"},
+    "adventure": {"adventure", "adventurous", "exciting", "playful", "journey"},
+}
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+_indexes: dict[str, tuple] = {}  # kind -> (LSHIndex, {id: entry}, {normalized: id}, loaded_at)
+_background: set[asyncio.Task] = set()
+_counters = {"exact_hits": 0, "similar_hits": 0, "mood_hits": 0, "stand_ins": 0, "misses": 0, "added": 0, "errors": 0}
+
+
+def normalize(prompt: str) -> str:
+    """Sorted content words: "Gentle night sounds, crickets!" == "crickets and gentle night sounds"."""
+    words = {w for w in _TOKEN.findall(prompt.lower()) if w not in _STOPWORDS}
+    return " ".join(sorted(words))
+
+
+def tags_for(prompt: str, mood: Optional[str] = None) -> set[str]:
+    words = set(_TOKEN.findall(prompt.lower()))
+    tags = {tag for tag, vocab in MOOD_TAGS.items() if words & vocab}
+    if mood:
+        tags |= {t for t in _TOKEN.findall(mood.lower()) if t not in _STOPWORDS}
+    return tags
+
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+async def _index(kind: str) -> tuple:
+    cached = _indexes.get(kind)
+    if cached and cached[3] + TTL > time.monotonic():
+        return cached
+    rs = await db.execute("SELECT id, normalized, tags, signature, hash FROM sound_library WHERE kind = ?", [kind])
+    lsh, entries, by_text = minhash.LSHIndex(), {}, {}
+    for entry_id, normalized, tags, raw_sig, digest in rs.rows:
+        entries[entry_id] = {"id": entry_id, "normalized": normalized, "tags": set(tags.split()), "hash": digest}
+        by_text[normalized] = entry_id
+        lsh.add(str(entry_id), minhash.decode(raw_sig) or minhash.signature(normalized))
+    _indexes[kind] = (lsh, entries, by_text, time.monotonic())
+    return _indexes[kind]
+
+
+def _match(index: tuple, prompt: str, mood: Optional[str], thresholds: bool) -> Optional[tuple]:
+    lsh, entries, by_text, _ = index
+    normalized = normalize(prompt)
+    if normalized in by_text:
+        return entries[by_text[normalized]], 1.0, "exact"
+    best, score = lsh.nearest(minhash.signature(normalized))
+    if best is not None and (score >= SIMILARITY_THRESHOLD or not thresholds):
+        text_match = (entries[int(best)], score, "similar")
+    else:
+        text_match = None
+    wanted = tags_for(prompt, mood)
+    tag_match = None
+    if wanted:
+        entry = max(entries.values(), key=lambda e: _jaccard(wanted, e["tags"]), default=None)
+        if entry is not None:
+            tag_score = _jaccard(wanted, entry["tags"])
+            if tag_score >= TAG_THRESHOLD or (not thresholds and tag_score > 0):
+                tag_match = (entry, tag_score, "mood")
+    if text_match and (not tag_match or text_match[1] >= tag_match[1] or thresholds):
+        return text_match
+    if tag_match is None and not thresholds and entries:
+        return entries[max(entries)], 0.0, "any"  # Nothing in common: newest clip beats silence
+    return tag_match
+
+
+async def _load(kind: str, prompt: str, mood: Optional[str], thresholds: bool) -> Optional[bytes]:
+    try:
+        index = await _index(kind)
+        match = _match(index, prompt, mood, thresholds)
+        if match is None:
+            return None
+        entry, score, how = match
+        data = await blob_store.get_backend().get(entry["hash"])
+        if data is None:
+            index[1].pop(entry["id"], None)  # Blob gone; stop offering it
+            index[2].pop(entry["normalized"], None)
+            index[0].remove(str(entry["id"]))
+            return None
+        print(f"🎵 sound library {how} {kind} ({score:.2f}): {prompt[:60]!r} → {entry['normalized'][:60]!r}")
+        _counters["stand_ins" if not thresholds else f"{how}_hits"] += 1
+        _spawn(db.execute("UPDATE sound_library SET uses = uses + 1 WHERE id = ?", [entry["id"]]))
+        return data
+    except Exception as e:
+        _counters["errors"] += 1
+        print(f"⚠️ sound library lookup: {e}")
+        return None
+
+
+async def find(kind: str, prompt: str, mood: Optional[str] = None) -> Optional[bytes]:
+    """Library clip for this prompt (exact, similar or same mood), or None on a miss."""
+    data = await _load(kind, prompt, mood, thresholds=True)
+    if data is None:
+        _counters["misses"] += 1
+    return data
+
+
+async def closest(kind: str, prompt: str, mood: Optional[str] = None) -> Optional[bytes]:
+    """Best available clip of `kind` regardless of thresholds (stand-in while the upstream is down)."""
+    return await _load(kind, prompt, mood, thresholds=False)
+
+
+async def add(kind: str, prompt: str, data: bytes, mood: Optional[str] = None,
+              duration_seconds: Optional[float] = None):
+    normalized = normalize(prompt)
+    tags = tags_for(prompt, mood)
+    sig = minhash.signature(normalized)
+    try:
+        digest, size = await blob_store.put(data)
+        rs = await db.execute(
+            "INSERT OR IGNORE INTO sound_library (kind, prompt, normalized, tags, signature, hash, size, duration_seconds) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [kind, prompt, normalized, " ".join(sorted(tags)), minhash.encode(sig), digest, size, duration_seconds]
+        )
+    except Exception as e:
+        _counters["errors"] += 1
+        print(f"⚠️ sound library add: {e}")
+        return
+    if not rs.rows_affected:
+        return  # Same prompt added meanwhile
+    _counters["added"] += 1
+    index = _indexes.get(kind)
+    if index and rs.last_insert_rowid:
+        lsh, entries, by_text, _ = index
+        entries[rs.last_insert_rowid] = {"id": rs.last_insert_rowid, "normalized": normalized, "tags": tags,
+                                         "hash": digest}
+        by_text[normalized] = rs.last_insert_rowid
+        lsh.add(str(rs.last_insert_rowid), sig)
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+def add_later(kind: str, prompt: str, data: bytes, mood: Optional[str] = None,
+              duration_seconds: Optional[float] = None):
+    """Index a fresh generation without holding up the caller."""
+    _spawn(add(kind, prompt, data, mood, duration_seconds))
+
+
+def stats() -> dict:
+    served = sum(_counters[k] for k in ("exact_hits", "similar_hits", "mood_hits"))
+    lookups = served + _counters["misses"]
+    return {**_counters, "hit_rate": round(served / lookups, 3) if lookups else None,
+            "indexed": {kind: len(index[1]) for kind, index in _indexes.items()}}
@@ -0,0 +1,149 @@
+"""
+Task graph — dependency-aware async executor for the story pipeline.
+Nodes start as soon as their dependencies finish, so independent work
+(per-scene TTS, SFX, lullaby, illustrations) overlaps instead of queueing.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+
+class NodeFailed(Exception):
+    """Raised by TaskGraph.result() for a node that errored, timed out or was skipped."""
+
+
+class _Node:
+    __slots__ = ("name", "fn", "deps", "timeout", "phase", "status", "result", "error", "started", "finished")
+
+    def __init__(self, name, fn, deps, timeout, phase):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.phase = phase or name
+        self.status = "pending"
+        self.result = None
+        self.error = None
+        self.started = None
+        self.finished = None
+
+
+class TaskGraph:
+    """
+    Register nodes with `add(name, fn, deps=...)`, then `await run()`.
+    Each node fn is `async def fn(graph)` and may read finished dependencies
+    via `graph.result(name)` or add further nodes while the graph is running
+    (e.g. one TTS node per scene once the story exists).
+    A node whose dependency failed is skipped rather than run.
+
+    `on_done`, if given, is `async def on_done(graph, name)` and is awaited as
+    each node finishes (ok or not) — e.g. to stream progress to a client.
+    """
+
+    def __init__(self, on_done: Optional[Callable[["TaskGraph", str], Awaitable]] = None):
+        self._on_done = on_done
+        self._nodes: dict[str, _Node] = {}
+        self._t0: Optional[float] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def add(self, name: str, fn: Callable[["TaskGraph"], Awaitable], deps=(), timeout: float | None = None,
+            phase: str | None = None):
+        if name in self._nodes:
+            raise ValueError(f"Duplicate node: {name}")
+        self._nodes[name] = _Node(name, fn, deps, timeout, phase)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def result(self, name: str):
+        node = self._nodes[name]
+        if node.status != "ok":
+            raise NodeFailed(f"{name} {node.status}: {node.error}")
+        return node.result
+
+    def error(self, name: str):
+        return self._nodes[name].error
+
+    def ok(self, name: str) -> bool:
+        node = self._nodes.get(name)
+        return bool(node) and node.status == "ok"
+
+    async def _run_node(self, node: _Node):
+        node.status = "running"
+        node.started = time.perf_counter()
+        try:
+            node.result = await asyncio.wait_for(node.fn(self), timeout=node.timeout)
+            node.status = "ok"
+        except asyncio.TimeoutError:
+            node.status = "timeout"
+            node.error = f"timed out after {node.timeout}s"
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise  # The graph itself is being cancelled
+            # Raised by something the node awaited (e.g. a cancelled shared future)
+            node.status = "cancelled"
+            node.error = "cancelled"
+        except Exception as e:
+            node.status = "error"
+            node.error = e
+        finally:
+            node.finished = time.perf_counter()
+        if self._on_done is not None:
+            try:
+                await self._on_done(self, node.name)
+            except Exception as e:
+                print(f"⚠️ task_graph on_done({node.name}): {e}")
+
+    async def run(self):
+        self._t0 = time.perf_counter()
+        self._wakeup = asyncio.Event()
+        running: dict[asyncio.Task, _Node] = {}
+        try:
+            while True:
+                for node in self._nodes.values():
+                    if node.status != "pending":
+                        continue
+                    dep_nodes = [self._nodes.get(d) for d in node.deps]
+                    if any(d is None for d in dep_nodes):
+                        missing = [name for name, d in zip(node.deps, dep_nodes) if d is None]
+                        node.status, node.error = "skipped", f"unknown dependency {missing}"
+                        continue
+                    if any(d.status in ("error", "timeout", "cancelled", "skipped") for d in dep_nodes):
+                        node.status = "skipped"
+                        node.error = "dependency failed"
+                        continue
+                    if all(d.status == "ok" for d in dep_nodes):
+                        running[asyncio.create_task(self._run_node(node))] = node
+                if not running:
+                    break
+                self._wakeup.clear()
+                wake = asyncio.create_task(self._wakeup.wait())
+                done, _ = await asyncio.wait([*running, wake], return_when=asyncio.FIRST_COMPLETED)
+                if wake not in done:
+                    wake.cancel()
+                for task in done:
+                    running.pop(task, None)
+        finally:
+            for task in running:
+                task.cancel()
+            self._wakeup = None
+
+    def timings(self) -> dict:
+        """Per-node and per-phase wall-clock timings in milliseconds, relative to run() start."""
+        nodes, phases = {}, {}
+        for node in self._nodes.values():
+            entry = {"status": node.status}
+            if node.started is not None:
+                start_ms = round((node.started - self._t0) * 1000)
+                end_ms = round((node.finished - self._t0) * 1000)
+                entry.update(start_ms=start_ms, duration_ms=end_ms - start_ms)
+                span = phases.setdefault(node.phase, {"start_ms": start_ms, "end_ms": end_ms, "nodes": 0})
+                span["start_ms"] = min(span["start_ms"], start_ms)
+                span["end_ms"] = max(span["end_ms"], end_ms)
+                span["nodes"] += 1
+            if node.error is not None:
+                entry["error"] = str(node.error)[:200]
+            nodes[node.name] = entry
+        for span in phases.values():
+            span["duration_ms"] = span["end_ms"] - span["start_ms"]
+        total = max((s["end_ms"] for s in phases.values()), default=0)
+        return {"total_ms": total, "phases": phases, "nodes": nodes}
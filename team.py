@@ -2,7 +2,12 @@
 """
 CLI tool for orchestrator agent to communicate with Mistral AI Agents.
 
-Usage: python3 team.py <agent_name> <message>
+Usage: python3 team.py <agent_name> <message> [--conversation-id ID | --continue] [--json]
+       python3 team.py <agent_name> --list [N]
+
+Thin wrapper around agent_client (the same in-process client the server uses).
+Conversations are recorded in the shared conversation store (conversations.py),
+in the server's database (database.py settings) whatever directory this runs from.
 
 Agent names and their Mistral Agent IDs:
 - papa_bois  = ag_019ca24ec2c271458172692e54fc0c94 (orchestrator, Trinidad mythology)
@@ -14,99 +19,70 @@ Agent names and their Mistral Agent IDs:
 
 import os
 import json
+import asyncio
 import argparse
-from mistralai import Mistral
-
-# Agent mapping
-AGENTS = {
-    "papa_bois": "ag_019ca24ec2c271458172692e54fc0c94",
-    "anansi": "ag_019ca24f110677d7a92ec83a5c85704a",
-    "firefly": "ag_019ca24f601773e1a953fac560ff4d71",
-    "devi": "ag_019ca24f147876f2ab26526f6cf8c4b4",
-    "ogma": None,
-}
-
-CONVERSATIONS_FILE = "/tmp/sandmantales-hackathon/.conversations.json"
+import agent_client
+import conversations
+import database as db
+import http_clients
+from agent_client import AGENTS
 
-def load_conversations():
-    if os.path.exists(CONVERSATIONS_FILE):
-        with open(CONVERSATIONS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_conversations(conversations):
-    with open(CONVERSATIONS_FILE, 'w') as f:
-        json.dump(conversations, f, indent=2)
+# Pre-registry conversation log; imported into the conversation store once, then renamed
+LEGACY_CONVERSATIONS_FILE = "/tmp/sandmantales-hackathon/.conversations.json"
 
 def get_agent_id(agent_name):
     return AGENTS.get(agent_name.lower())
 
-def main():
-    parser = argparse.ArgumentParser(description="Communicate with Mistral AI Agents")
-    parser.add_argument("agent_name", help="Name of the agent (papa_bois, anansi, firefly, devi, ogma)")
-    parser.add_argument("message", help="Message to send to the agent")
-    parser.add_argument("--conversation-id", help="Continue an existing conversation")
-    args = parser.parse_args()
-
-    if args.agent_name.lower() not in AGENTS:
-        print(f"Error: Unknown agent '{args.agent_name}'. Available agents: {', '.join(AGENTS.keys())}")
-        return 1
-
-    agent_id = get_agent_id(args.agent_name)
-    if not agent_id:
-        print(f"Error: Agent '{args.agent_name}' has no Mistral Agent ID configured yet")
-        return 1
-
-    api_key = os.environ.get("MISTRAL_API_KEY")
-    if not api_key:
-        print("Error: MISTRAL_API_KEY environment variable not set")
-        return 1
-
-    client = Mistral(api_key=api_key)
-
+async def run(args):
+    await db.init_conversations()
     try:
-        conversations = load_conversations()
-
-        if args.conversation_id:
-            response = client.beta.conversations.append(
-                conversation_id=args.conversation_id,
-                inputs=args.message
-            )
-            conversation_id = args.conversation_id
-        else:
-            response = client.beta.conversations.start(
-                agent_id=agent_id,
-                inputs=args.message
-            )
-            conversation_id = response.conversation_id
-            conversations[conversation_id] = {"agent": args.agent_name}
-            save_conversations(conversations)
-
-        if not response.outputs:
-            print("Error: No response from agent")
-            return 1
-        
-        output = response.outputs[0]
-        output_type = type(output).__name__
-        
-        if output_type == 'FunctionCallEntry':
-            args_data = output.arguments
-            if isinstance(args_data, dict):
-                print(json.dumps(args_data, indent=2, ensure_ascii=False))
-            else:
-                print(str(args_data))
-        elif hasattr(output, 'content') and output.content:
-            print(output.content)
-        else:
-            print("Error: No usable response from agent")
+        if os.path.exists(LEGACY_CONVERSATIONS_FILE):
+            imported = await conversations.import_json(LEGACY_CONVERSATIONS_FILE)
+            os.replace(LEGACY_CONVERSATIONS_FILE, LEGACY_CONVERSATIONS_FILE + ".imported")
+            print(f"Imported {imported} conversations from {LEGACY_CONVERSATIONS_FILE}\n")
+
+        if args.list:
+            for c in await conversations.for_agent(args.agent_name.lower(), args.list):
+                print(f"{c['conversation_id']}  turns={c['turns']}  last_used={c['last_used']:.0f}")
+            return 0
+
+        conversation_id = args.conversation_id
+        if args.continue_latest and not conversation_id:
+            conversation_id = await conversations.latest(args.agent_name.lower())
+        try:
+            reply = await agent_client.ask(args.agent_name, args.message, conversation_id)
+        except Exception as e:
+            print(f"Error: {str(e)}")
             return 1
+        await conversations.record(reply.conversation_id, args.agent_name.lower(), reply.agent_id)
+    finally:
+        await http_clients.close()
+        await db.close()
 
-        print(f"\n---\nConversation ID: {conversation_id}")
+    if args.json:
+        print(json.dumps(reply.to_dict(), indent=2, ensure_ascii=False))
         return 0
+    if reply.kind == "function_call" and isinstance(reply.arguments, dict):
+        print(json.dumps(reply.arguments, indent=2, ensure_ascii=False))
+    else:
+        print(reply.text)
+    print(f"\n---\nConversation ID: {reply.conversation_id}")
+    return 0
 
-    except Exception as e:
-        print(f"Error: {str(e)}")
-        return 1
+def main():
+    parser = argparse.ArgumentParser(description="Communicate with Mistral AI Agents")
+    parser.add_argument("agent_name", help="Name of the agent (papa_bois, anansi, firefly, devi, ogma)")
+    parser.add_argument("message", nargs="?", help="Message to send to the agent")
+    parser.add_argument("--conversation-id", help="Continue an existing conversation")
+    parser.add_argument("--continue", dest="continue_latest", action="store_true",
+                        help="Continue the most recent conversation with this agent")
+    parser.add_argument("--list", type=int, nargs="?", const=20, metavar="N",
+                        help="List the N most recent conversations with this agent")
+    parser.add_argument("--json", action="store_true", help="Print the structured reply as JSON")
+    args = parser.parse_args()
+    if not args.list and not args.message:
+        parser.error("message is required")
+    return asyncio.run(run(args))
 
 if __name__ == "__main__":
     exit(main())
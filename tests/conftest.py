@@ -0,0 +1,36 @@
+"""Shared fixtures: the repo root on sys.path and a throwaway SQLite database per test."""
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import database as db
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """Point the database layer at a fresh file; returns run(coro) that executes on a new loop and closes the pool."""
+    monkeypatch.setattr(db, "SQLITE_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setattr(db, "USE_TURSO", False)
+    monkeypatch.setattr(db, "_sqlite_pool", None)
+
+    def run(coro):
+        async def wrapper():
+            try:
+                return await coro
+            finally:
+                await db.close()
+        return asyncio.run(wrapper())
+
+    return run
+
+
+@pytest.fixture
+def blobs(tmp_path, monkeypatch):
+    """A local blob store under tmp_path, swapped in for the duration of the test."""
+    import blob_store
+    backend = blob_store.LocalBlobBackend(str(tmp_path / "blobs"))
+    monkeypatch.setattr(blob_store, "_backend", backend)
+    return backend
@@ -0,0 +1,78 @@
+import asyncio
+from types import SimpleNamespace as NS
+import pytest
+import agent_client
+import agent_registry
+import database as db
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Two fresh agent definitions and a stub Mistral client that counts creations."""
+    created = []
+
+    async def create_async(**kwargs):
+        await asyncio.sleep(0.05)
+        created.append(kwargs["name"])
+        return NS(id=f"ag_{kwargs['name']}_{len(created)}")
+
+    client = NS(beta=NS(agents=NS(create_async=create_async)))
+    monkeypatch.setattr(agent_client, "client", lambda: client)
+    monkeypatch.setattr(agent_client, "MISTRAL_API_KEY", "test")
+    monkeypatch.setattr(agent_registry, "_specs", [])
+    monkeypatch.setattr(agent_registry, "_ids", {})
+    monkeypatch.setattr(agent_registry, "_state", dict(agent_registry._state, state="idle"))
+    monkeypatch.setattr(agent_registry, "WAIT_INTERVAL", 0.02)
+    agent_registry.define("child", name="Child")
+    agent_registry.define("parent", handoffs=["child"], name="Parent")
+    return created
+
+
+def test_waits_for_the_worker_holding_the_lock_instead_of_creating(sqlite_db, registry):
+    async def other_worker_finishes():
+        await asyncio.sleep(0.1)
+        agent_registry._ids["child"] = "ag_other_child"  # Only to compute the parent's fingerprint
+        fps = {name: agent_registry.fingerprint(name, handoffs, kwargs) for name, handoffs, kwargs in agent_registry._specs}
+        del agent_registry._ids["child"]
+        await db.batch([
+            ("INSERT INTO agent_registry (name, agent_id, fingerprint, created_at) VALUES (?, ?, ?, 0)",
+             [name, f"ag_other_{name}", fps[name]]) for name in fps
+        ] + [("DELETE FROM generation_locks WHERE key = ?", [agent_registry.LOCK_KEY])])
+
+    async def scenario():
+        await db.init_db()
+        await db.execute("INSERT INTO generation_locks (key, owner, expires_at) VALUES (?, 'other-worker', 9e9)",
+                         [agent_registry.LOCK_KEY])
+        await asyncio.gather(agent_registry._provision_forever(), other_worker_finishes())
+        return agent_registry.stats()
+
+    stats = sqlite_db(scenario())
+    assert registry == []
+    assert stats["agents"] == {"child": "ag_other_child", "parent": "ag_other_parent"}
+    assert stats["state"] == "ready" and stats["source"] == "persisted"
+
+
+def test_lock_holder_creates_each_agent_once_and_releases(sqlite_db, registry):
+    async def scenario():
+        await db.init_db()
+        await agent_registry._provision_forever()
+        rows = (await db.execute("SELECT name, agent_id FROM agent_registry ORDER BY name")).rows
+        locks = (await db.execute("SELECT COUNT(*) FROM generation_locks")).rows[0][0]
+        return rows, locks
+
+    rows, locks = sqlite_db(scenario())
+    assert registry == ["Child", "Parent"]
+    assert rows == [("child", "ag_Child_1"), ("parent", "ag_Parent_2")] and locks == 0
+
+
+def test_restart_reuses_persisted_ids_without_creating(sqlite_db, registry):
+    async def scenario():
+        await db.init_db()
+        await agent_registry._provision_forever()
+        agent_registry._ids.clear()
+        await agent_registry.start()
+        return agent_registry.stats()
+
+    stats = sqlite_db(scenario())
+    assert len(registry) == 2
+    assert stats["state"] == "ready" and stats["source"] == "persisted"
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import asset_http
+import blob_store
+import pipeline
+
+
+@pytest.fixture
+def client(blobs):
+    app = FastAPI()
+    app.include_router(pipeline.router)
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture
+def stored(blobs):
+    data = os.urandom(3 * asset_http.CHUNK_SIZE + 17)  # Spans several streamed chunks
+    digest, _ = asyncio.run(blob_store.put(data))
+    return f"/api/blobs/{digest}.mp3", digest, data
+
+
+def test_full_body_with_immutable_etag(client, stored):
+    url, digest, data = stored
+    r = client.get(url)
+    assert r.status_code == 200 and r.content == data
+    assert r.headers["etag"] == f'"{digest}"' and "immutable" in r.headers["cache-control"]
+    assert client.get(url, headers={"If-None-Match": f'W/"{digest}"'}).status_code == 304
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=0-99", 0, 99),
+    ("bytes=100-", 100, None),
+    ("bytes=-50", -50, None),
+    ("bytes=65530-131080", 65530, 131080),  # Crosses a chunk boundary
+    ("bytes=10-999999999", 10, None),       # End clamped to the size
+])
+def test_single_range_is_served_as_206(client, stored, header, start, end):
+    url, _, data = stored
+    expected = data[start:] if end is None else data[start:end + 1]
+    r = client.get(url, headers={"Range": header})
+    assert r.status_code == 206 and r.content == expected
+    first = len(data) + start if start < 0 else start
+    assert r.headers["content-range"] == f"bytes {first}-{first + len(expected) - 1}/{len(data)}"
+
+
+def test_unsatisfiable_and_ignored_ranges(client, stored):
+    url, _, data = stored
+    r = client.get(url, headers={"Range": f"bytes={len(data)}-"})
+    assert r.status_code == 416 and r.headers["content-range"] == f"bytes */{len(data)}"
+    # Multipart ranges are left to the file response: the full body or a multipart/byteranges 206
+    r = client.get(url, headers={"Range": "bytes=0-1,5-6"})
+    assert r.content == data if r.status_code == 200 else r.headers["content-type"].startswith("multipart/byteranges")
+    assert client.get(url, headers={"Range": "bytes=0-1", "If-Range": '"stale"'}).status_code == 200
+    # Invalid specs are ignored rather than refused
+    for spec in ("bytes=5--3", "bytes=3-1", "bytes=-", "bytes=x-1"):
+        r = client.get(url, headers={"Range": spec})
+        assert r.status_code == 200 and r.content == data
+
+
+def test_unknown_blob_is_404(client):
+    assert client.get("/api/blobs/" + "0" * 64 + ".mp3").status_code == 404
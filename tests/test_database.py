@@ -0,0 +1,26 @@
+import sqlite3
+import pytest
+import database as db
+
+
+def test_failed_write_does_not_poison_the_writer(sqlite_db):
+    async def scenario():
+        await db.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT NOT NULL)")
+        with pytest.raises(sqlite3.IntegrityError):
+            await db.execute("INSERT INTO t (v) VALUES (?)", [None])
+        await db.batch([("INSERT INTO t (v) VALUES (?)", ["a"]), ("INSERT INTO t (v) VALUES (?)", ["b"])])
+        async with db.transaction() as tx:
+            tx.execute("INSERT INTO t (v) VALUES (?)", ["c"])
+        return (await db.execute("SELECT v FROM t ORDER BY id")).rows
+
+    assert [r[0] for r in sqlite_db(scenario())] == ["a", "b", "c"]
+
+
+def test_batch_is_all_or_nothing(sqlite_db):
+    async def scenario():
+        await db.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT NOT NULL)")
+        with pytest.raises(sqlite3.IntegrityError):
+            await db.batch([("INSERT INTO t (v) VALUES (?)", ["a"]), ("INSERT INTO t (v) VALUES (?)", [None])])
+        return (await db.execute("SELECT COUNT(*) FROM t")).rows[0][0]
+
+    assert sqlite_db(scenario()) == 0
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import types
+import pytest
+import agent_client
+import database as db
+import jobs
+import orchestrator
+import pipeline
+import resilience
+
+
+@pytest.fixture
+def stub_mistral(monkeypatch):
+    """Plan and story from a stub agent; every asset node fails (no ElevenLabs/Gemini)."""
+    calls = []
+
+    async def start_async(agent_id, inputs):
+        calls.append(agent_id)
+        if agent_id == orchestrator.AGENTS["papa_bois"]:
+            content = {"story_direction": "owls", "mood": "calm"}
+        else:
+            content = {"title": "Night Owls", "scenes": ["One.", "Two."], "mood": "calm"}
+        return types.SimpleNamespace(conversation_id="conv", outputs=[types.SimpleNamespace(content=json.dumps(content))])
+
+    async def no_asset(*args, **kwargs):
+        return {"error": "not configured"}
+
+    client = types.SimpleNamespace(beta=types.SimpleNamespace(conversations=types.SimpleNamespace(start_async=start_async)))
+    monkeypatch.setattr(agent_client, "client", lambda: client)
+    monkeypatch.setattr(orchestrator, "MISTRAL_API_KEY", "test")
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    for name in ("exec_generate_tts", "exec_generate_sfx", "exec_compose_lullaby"):
+        monkeypatch.setattr(orchestrator, name, no_asset)
+    return calls
+
+
+async def _run_next():
+    """Claim and run the next due job, as a worker would."""
+    await db.execute("UPDATE story_jobs SET run_after = 0 WHERE status = 'queued'")
+    claimed = await jobs._claim()
+    assert claimed is not None
+    await jobs._run(*claimed)
+    return await jobs.get_job(claimed[0])
+
+
+def test_story_saved_by_a_dying_attempt_is_not_saved_again(sqlite_db, blobs, stub_mistral, monkeypatch):
+    real_execute = db.execute
+    failures = [1]
+
+    async def flaky_execute(sql, params=None):
+        if sql.startswith("UPDATE story_jobs SET status = 'done'") and failures:
+            failures.pop()
+            raise ConnectionError("worker lost the database after saving")
+        return await real_execute(sql, params)
+
+    async def scenario():
+        await db.init_db()
+        await jobs.submit(orchestrator.OrchestrateRequest(child_name="Ama", prompt="owls"))
+        monkeypatch.setattr(db, "execute", flaky_execute)
+        first = await _run_next()
+        second = await _run_next()
+        stories = (await real_execute("SELECT id FROM stories")).rows
+        return first, second, stories
+
+    first, second, stories = sqlite_db(scenario())
+    assert first["status"] == "queued" and first["phase"] == "saved"
+    assert second["status"] == "done" and second["attempts"] == 2
+    assert len(stories) == 1 and second["result"]["id"] == stories[0][0]
+    assert second["result"]["title"] == "Night Owls" and second["result"]["scenes"] == ["One.", "Two."]
+    assert len(stub_mistral) == 2  # Plan and story ran once, on the first attempt
+
+
+def test_job_story_is_owned_by_the_submitter(sqlite_db, blobs, stub_mistral):
+    owner = {"id": 7, "name": "Ama", "email": "ama@example.com", "role": "user"}
+
+    async def scenario():
+        await db.init_db()
+        await jobs.submit(orchestrator.OrchestrateRequest(child_name="Ama", prompt="my owls"), owner["id"])
+        job = await _run_next()
+        rs = await db.execute("SELECT user_id FROM stories WHERE id = ?", [job["result"]["id"]])
+        deleted = await pipeline.delete_story(job["result"]["id"], owner)
+        return rs.rows[0][0], deleted["deleted"]
+
+    assert sqlite_db(scenario()) == (7, 1)
+
+
+@pytest.mark.parametrize("error, status", [
+    (resilience.UpstreamError("Mistral 401: bad key", 401), "failed"),
+    (resilience.UpstreamError("Mistral 429: slow down", 429), "queued"),
+    (resilience.UpstreamError("Mistral 503: busy", 503), "queued"),
+    (ValueError("MISTRAL_API_KEY not set"), "failed"),
+])
+def test_only_retryable_failures_are_retried(sqlite_db, monkeypatch, error, status):
+    async def generate(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(orchestrator, "_generate_story", generate)
+
+    async def scenario():
+        await db.init_db()
+        await jobs.submit(orchestrator.OrchestrateRequest(child_name="Ama", prompt="owls", regenerate=True))
+        return await _run_next()
+
+    job = sqlite_db(scenario())
+    assert job["status"] == status and job["attempts"] == 1
+
+
+def test_missing_mistral_key_fails_the_job_at_once(sqlite_db, monkeypatch):
+    monkeypatch.setattr(orchestrator, "MISTRAL_API_KEY", "")
+
+    async def scenario():
+        await db.init_db()
+        await jobs.submit(orchestrator.OrchestrateRequest(child_name="Ama", prompt="owls", regenerate=True))
+        return await _run_next()
+
+    job = sqlite_db(scenario())
+    assert job["status"] == "failed" and job["error"] == "MISTRAL_API_KEY not set"
@@ -0,0 +1,34 @@
+import json
+from json_stream import ScenesParser, SentenceBuffer
+
+
+def _feed_in_chunks(text: str, size: int) -> list[tuple]:
+    parser, events = ScenesParser(), []
+    for i in range(0, len(text), size):
+        events.extend(parser.feed(text[i:i + size]))
+    return events
+
+
+def test_scenes_fields_and_deltas_survive_any_chunking():
+    story = {"title": "Ama \"the brave\"", "scenes": ["First, a fox.\nThen éé.", "Sleep 🌙 now."], "mood": "calm"}
+    text = "```json\n" + json.dumps(story) + "\n```"
+    for size in (1, 2, 3, 7, len(text)):
+        events = _feed_in_chunks(text, size)
+        assert [e for e in events if e[0] == "field"] == [("field", "title", story["title"]), ("field", "mood", "calm")]
+        assert [e[1:] for e in events if e[0] == "scene"] == list(enumerate(story["scenes"]))
+        for i, scene in enumerate(story["scenes"]):
+            assert "".join(e[2] for e in events if e[0] == "scene_delta" and e[1] == i) == scene
+
+
+def test_nested_values_are_not_scenes():
+    events = _feed_in_chunks(json.dumps({"meta": {"scenes": ["no"]}, "scenes": ["yes"]}), 4)
+    assert [e for e in events if e[0] == "scene"] == [("scene", 0, "yes")]
+
+
+def test_sentence_buffer_waits_for_a_sentence_to_end():
+    buf = SentenceBuffer()
+    assert buf.push("The owl hooted. It was la") == ["The owl hooted."]
+    assert buf.push("te...") == []  # Could still be "late... and"
+    assert buf.push(" Everyone slept! Goodnight") == ["It was late...", "Everyone slept!"]
+    assert buf.flush() == "Goodnight"
+    assert buf.push("月が出た。星も") == ["月が出た。"]
@@ -0,0 +1,107 @@
+import asyncio
+import base64
+import gc
+import json
+import os
+import tracemalloc
+import types
+import pytest
+import agent_client
+import database as db
+import orchestrator
+
+ASSET_BYTES = 512 * 1024
+
+
+@pytest.fixture
+def stub_upstreams(monkeypatch):
+    """Mistral answers with a fixed plan/story; every ElevenLabs/Gemini call returns ASSET_BYTES of fresh noise."""
+    async def start_async(agent_id, inputs):
+        if agent_id == orchestrator.AGENTS["papa_bois"]:
+            content = {"story_direction": "owls", "mood": "calm", "ambient_sfx": "wind", "lullaby_style": "harp"}
+        else:
+            content = {"title": "Night Owls", "scenes": ["One.", "Two.", "Three.", "Four."], "mood": "calm"}
+        return types.SimpleNamespace(conversation_id="conv", outputs=[types.SimpleNamespace(content=json.dumps(content))])
+
+    async def audio(*args, **kwargs):
+        return {"audio_b64": base64.b64encode(os.urandom(ASSET_BYTES)).decode(), "size_kb": ASSET_BYTES // 1024}
+
+    async def image(*args, **kwargs):
+        return base64.b64encode(os.urandom(ASSET_BYTES)).decode()
+
+    client = types.SimpleNamespace(beta=types.SimpleNamespace(conversations=types.SimpleNamespace(start_async=start_async)))
+    monkeypatch.setattr(agent_client, "client", lambda: client)
+    monkeypatch.setattr(orchestrator, "MISTRAL_API_KEY", "test")
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    for name in ("exec_generate_tts", "exec_generate_sfx", "exec_compose_lullaby"):
+        monkeypatch.setattr(orchestrator, name, audio)
+    monkeypatch.setattr(orchestrator, "exec_generate_illustration", image)
+
+
+def _request(i: int) -> orchestrator.OrchestrateRequest:
+    return orchestrator.OrchestrateRequest(child_name="Ama", prompt=f"owls {i}")
+
+
+def test_manifest_holds_only_blob_refs(sqlite_db, blobs, stub_upstreams):
+    async def scenario():
+        await db.init_db()
+        return await orchestrator._generate_story(_request(0))
+
+    result = sqlite_db(scenario())
+    manifest = result["assets"]
+    assert sorted(manifest["audio"]) == ["0", "1", "2", "3", "lullaby", "sfx"]
+    assert sorted(manifest["images"]) == ["img_0", "img_1", "img_2", "img_3"]
+    for ref in [*manifest["audio"].values(), *manifest["images"].values()]:
+        assert set(ref) == {"url", "size", "mime"} and ref["size"] == ASSET_BYTES
+        digest = ref["url"].rsplit("/", 1)[1].split(".")[0]
+        assert blobs.local_path(digest)
+    assert len(json.dumps(result)) < 10_000  # No inline audio/image payloads
+
+
+def test_finished_orchestrations_do_not_retain_asset_bytes(sqlite_db, blobs, stub_upstreams):
+    runs = 6
+
+    async def scenario():
+        await db.init_db()
+        await orchestrator._generate_story(_request(-1))  # Warm imports, pools and caches
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        await asyncio.gather(*(orchestrator._generate_story(_request(i)) for i in range(runs)))
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        return retained
+
+    produced = runs * 10 * ASSET_BYTES
+    assert sqlite_db(scenario()) < produced // 20
+
+
+def test_identical_streams_share_one_generation(sqlite_db, blobs, stub_upstreams, monkeypatch):
+    generate, runs = orchestrator._generate_story, []
+
+    async def counted(*args, **kwargs):
+        runs.append(args[0].prompt)
+        return await generate(*args, **kwargs)
+
+    monkeypatch.setattr(orchestrator, "_generate_story", counted)
+
+    async def stream(delay):
+        await asyncio.sleep(delay)
+        response = await orchestrator.orchestrate_story_stream(_request(99), None)
+        events = []
+        async for chunk in response.body_iterator:
+            event, data = chunk.strip().split("\n")
+            events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+        return events
+
+    async def scenario():
+        await db.init_db()
+        return await asyncio.gather(stream(0), stream(0.01))
+
+    leader, joined = sqlite_db(scenario())
+    assert len(runs) == 1 and not orchestrator._streams
+    for events in (leader, joined):
+        names = [event for event, _ in events]
+        assert names[-1] == "done" and names.count("scene") == 4 and names.count("audio") == 6
+    assert joined[-1][1]["deduplicated"] and joined[-1][1]["id"] == leader[-1][1]["id"]
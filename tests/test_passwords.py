@@ -0,0 +1,23 @@
+import asyncio
+import passwords
+
+
+def test_default_work_factor_is_the_legacy_one():
+    assert passwords.ITERATIONS == passwords.LEGACY_ITERATIONS
+    assert not passwords.needs_upgrade(passwords.LEGACY_ITERATIONS)
+
+
+def test_burn_follows_the_factor_of_verified_logins(monkeypatch):
+    monkeypatch.setitem(passwords._typical, "iterations", passwords.LEGACY_ITERATIONS)
+    seen = []
+    real = passwords.hash_sync
+    monkeypatch.setattr(passwords, "hash_sync", lambda pw, salt, n: seen.append(n) or real(pw, salt, n))
+
+    async def scenario():
+        stored = await passwords.hash_password("pw", "salt", 1000)
+        assert await passwords.verify("pw", "salt", stored, 1000)
+        assert not await passwords.verify("wrong", "salt", stored, 1000)
+        await passwords.burn("pw")
+
+    asyncio.run(scenario())
+    assert seen == [1000, 1000, 1000, 1000]
@@ -0,0 +1,86 @@
+import asyncio
+import time
+import httpx
+import pytest
+import rate_limit
+
+
+@pytest.fixture
+def lane(monkeypatch):
+    """A fresh "tavily" limiter: 2 concurrent, 100 rps, burst 3."""
+    monkeypatch.setitem(rate_limit.LANES, "tavily", {"concurrency": 2, "rps": 100, "burst": 3})
+    monkeypatch.setattr(rate_limit, "_limiters", {})
+    return rate_limit.limiter("tavily")
+
+
+def test_concurrency_cap_and_priority_order(lane):
+    granted = []
+
+    async def worker(name, level):
+        async with rate_limit.slot("tavily", level):
+            granted.append(name)
+            await asyncio.sleep(0.02)
+
+    async def scenario():
+        holders = [asyncio.create_task(worker(f"first_{i}", rate_limit.INTERACTIVE)) for i in range(2)]
+        await asyncio.sleep(0)
+        assert lane.active == 2 and lane.saturated()
+        queued = [asyncio.create_task(worker("background", rate_limit.BACKGROUND)),
+                  asyncio.create_task(worker("interactive", rate_limit.INTERACTIVE))]
+        await asyncio.gather(*holders, *queued)
+
+    asyncio.run(scenario())
+    assert granted[2:] == ["interactive", "background"]
+    assert lane.active == 0
+
+
+def test_token_bucket_spaces_requests_after_the_burst(lane):
+    async def scenario():
+        t0 = time.monotonic()
+        for _ in range(5):  # Burst of 3, then 100/s
+            async with rate_limit.slot("tavily"):
+                pass
+        return time.monotonic() - t0
+
+    assert asyncio.run(scenario()) >= 0.015
+
+
+def test_retry_after_pauses_the_lane_then_retries(lane, monkeypatch):
+    monkeypatch.setattr(rate_limit, "RETRIES", 2)
+    calls = []
+
+    def upstream(request):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0.1"})
+        return httpx.Response(200, stream=httpx.ByteStream(b'{"results": []}'))  # Unread, like a real transport
+
+    async def scenario():
+        transport = rate_limit.RateLimitedTransport(httpx.MockTransport(upstream))
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await client.post("https://api.tavily.com/search", json={})
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 200 and len(calls) == 2
+    assert calls[1] - calls[0] >= 0.09
+    assert lane.stats.throttled == 1 and lane.stats.retried == 1 and lane.active == 0
+
+
+def test_retry_after_accepts_http_dates_and_caps_the_wait():
+    assert rate_limit.retry_after(httpx.Response(429), 2) == 4.0
+    assert rate_limit.retry_after(httpx.Response(429, headers={"Retry-After": "99999"}), 0) == rate_limit.MAX_WAIT
+    assert rate_limit.retry_after(httpx.Response(503, headers={"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}), 0) == 0.0
+
+
+def test_scripts_get_a_share_of_each_lane(monkeypatch):
+    monkeypatch.setitem(rate_limit.LANES, "tavily", {"concurrency": 4, "rps": 2, "burst": 4})
+    monkeypatch.setattr(rate_limit, "SCRIPT_SHARE", 0.25)
+    script = rate_limit.SyncLimiter("tavily")
+    assert (script.concurrency, script.rate, script.burst) == (1, 0.5, 1.0)
+
+
+@pytest.mark.parametrize("value", ["0", "-1"])
+def test_non_positive_settings_are_rejected(monkeypatch, value):
+    monkeypatch.setenv("RATE_TAVILY_RPS", value)
+    with pytest.raises(ValueError, match="RATE_TAVILY_RPS"):
+        rate_limit.SyncLimiter("tavily")
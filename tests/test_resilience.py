@@ -0,0 +1,38 @@
+import asyncio
+import pytest
+import resilience
+
+
+@pytest.fixture
+def tripped(monkeypatch):
+    """A "tavily" breaker that has opened and cooled down: the next call is its half-open probe."""
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(resilience, "BREAKER_COOLDOWN", 0)
+    b = resilience.breaker("tavily")
+    for _ in range(resilience.BREAKER_FAILURES):
+        b.record_failure()
+    assert b.state == "open"
+    return b
+
+
+def _call(status=None):
+    async def fn():
+        if status is not None:
+            raise resilience.UpstreamError(f"tavily {status}", status)
+        return "ok"
+    return asyncio.run(resilience.call("tavily", fn, retries=0))
+
+
+def test_client_error_probe_leaves_the_breaker_half_open(tripped):
+    with pytest.raises(resilience.UpstreamError):
+        _call(404)
+    assert tripped.state == "half_open" and not tripped.probing
+    assert tripped.failures == resilience.BREAKER_FAILURES  # Neither a failure nor a reset
+    assert _call() == "ok"
+    assert tripped.state == "closed" and tripped.failures == 0
+
+
+def test_server_error_probe_reopens_the_breaker(tripped):
+    with pytest.raises(resilience.UpstreamError):
+        _call(500)
+    assert tripped.state == "open"
@@ -0,0 +1,88 @@
+import asyncio
+import database as db
+import singleflight
+
+
+def test_concurrent_callers_share_one_run(sqlite_db):
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "story"
+
+    async def scenario():
+        await db.init_db()
+        return await asyncio.gather(*(singleflight.do("k", fn) for _ in range(5)))
+
+    results = sqlite_db(scenario())
+    assert len(calls) == 1
+    assert [r for r, _ in results] == ["story"] * 5
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+
+
+def test_served_from_remote_result_is_shared_despite_other_leaders(sqlite_db, monkeypatch):
+    monkeypatch.setattr(singleflight, "POLL_INTERVAL", 0.01)
+
+    async def other():
+        await asyncio.sleep(0.05)
+        return "other"
+
+    async def never():
+        raise AssertionError("fn must not run while another worker holds the key")
+
+    async def scenario():
+        await db.init_db()
+        # Another worker holds the lock for "k"; its result lands in the cache shortly
+        await db.execute("INSERT INTO generation_locks (key, owner, expires_at) VALUES ('k', 'elsewhere', ?)",
+                         [9e9])
+        cache = {}
+
+        async def remote():
+            return cache.get("k")
+
+        async def finish_elsewhere():
+            await asyncio.sleep(0.03)
+            cache["k"] = "from-cache"
+
+        waiting = asyncio.create_task(singleflight.do("k", never, remote_result=remote))
+        await asyncio.gather(finish_elsewhere(), singleflight.do("unrelated", other))
+        return await waiting
+
+    assert sqlite_db(scenario()) == ("from-cache", True)
+
+
+def test_leader_renews_its_lock_while_running(sqlite_db, monkeypatch):
+    monkeypatch.setattr(singleflight, "LOCK_TTL", 0.15)
+
+    async def slow():
+        await asyncio.sleep(0.4)
+        return "done"
+
+    async def scenario():
+        await db.init_db()
+        lead = asyncio.create_task(singleflight.do("k", slow))
+        await asyncio.sleep(0.3)  # Past the original expiry
+        stolen = await singleflight._acquire("k", "another-worker")
+        return stolen, await lead
+
+    stolen, result = sqlite_db(scenario())
+    assert not stolen
+    assert result == ("done", False)
+
+
+def test_cancelling_the_leading_caller_does_not_cancel_the_waiters(sqlite_db):
+    async def fn():
+        await asyncio.sleep(0.05)
+        return "story"
+
+    async def scenario():
+        await db.init_db()
+        leader = asyncio.create_task(singleflight.do("k", fn))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(singleflight.do("k", fn))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await waiter, leader.cancelled()
+
+    assert sqlite_db(scenario()) == (("story", True), True)
@@ -0,0 +1,85 @@
+import json
+import types
+from fastapi import HTTPException
+from starlette.responses import Response
+import database as db
+import pipeline
+
+
+async def _seed():
+    await db.init_db()
+    # Five stories sharing a created_at second, so the id tiebreak is exercised too
+    contents = [json.dumps({"scenes": [{"text": "a"}], "mood": "calm"}), json.dumps(["bare", "list"]),
+                "plain text, not JSON", "", json.dumps({"scenes": ["x"]})]
+    await db.batch([
+        ("INSERT INTO stories (title, content, child_name, created_at) VALUES (?, ?, 'Ama', '2026-01-01 00:00:00')",
+         [f"story {i}", content]) for i, content in enumerate(contents)
+    ])
+
+
+def test_keyset_pages_cover_every_story_once(sqlite_db):
+    async def scenario():
+        await _seed()
+        seen, cursor = [], None
+        while True:
+            response = Response()
+            page = await pipeline.list_stories(response, limit=2, cursor=cursor, language=None, child_name=None,
+                                               user_id=None, include_content=False)
+            seen.extend(s["id"] for s in page)
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                return seen
+
+    assert sqlite_db(scenario()) == [5, 4, 3, 2, 1]
+
+
+def test_include_content_tolerates_legacy_rows(sqlite_db):
+    async def scenario():
+        await _seed()
+        return await pipeline.list_stories(Response(), limit=10, cursor=None, language=None, child_name=None,
+                                           user_id=None, include_content=True)
+
+    stories = {s["title"]: (s["scenes"], s["mood"]) for s in sqlite_db(scenario())}
+    assert stories["story 0"] == (["a"], "calm")
+    assert stories["story 1"] == (["bare", "list"], "magical")
+    assert stories["story 2"] == (["plain text, not JSON"], "magical")
+    assert stories["story 3"] == ([], "magical")
+
+
+def test_delete_story_is_limited_to_owner_or_admin(sqlite_db):
+    owner = {"id": 7, "name": "Ama", "email": "ama@example.com", "role": "user"}
+    other = {**owner, "id": 8}
+    admin = {**owner, "id": 1, "role": "admin"}
+
+    async def attempt(story_id, user):
+        try:
+            return (await pipeline.delete_story(story_id, user))["deleted"]
+        except HTTPException as e:
+            return e.status_code
+
+    async def scenario():
+        await db.init_db()
+        await db.batch([("INSERT INTO stories (title, content, user_id) VALUES (?, '{}', ?)", [t, uid])
+                        for t, uid in (("mine", 7), ("someone else's", 9))])
+        return [await attempt(1, other), await attempt(1, owner), await attempt(2, admin), await attempt(2, admin)]
+
+    assert sqlite_db(scenario()) == [403, 1, 2, 404]
+
+
+def test_user_filter_lists_the_stories_a_user_created(sqlite_db, monkeypatch):
+    async def complete_async(model, messages, response_format):
+        story = {"title": messages[1]["content"], "scenes": ["Once."], "mood": "calm"}
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=json.dumps(story)))])
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(complete_async=complete_async))
+    monkeypatch.setattr(pipeline.http_clients, "mistral", lambda key: client)
+    monkeypatch.setattr(pipeline, "MISTRAL_API_KEY", "test")
+
+    async def scenario():
+        await db.init_db()
+        for prompt, user_id in (("owner's first", 7), ("anonymous", None), ("owner's second", 7), ("other's", 8)):
+            await pipeline._generate_story(pipeline.StoryRequest(child_name="Kofi", prompt=prompt), user_id)
+        return await pipeline.list_stories(Response(), limit=10, cursor=None, language=None, child_name=None,
+                                           user_id=7, include_content=False)
+
+    assert [s["title"] for s in sqlite_db(scenario())] == ["owner's second", "owner's first"]
@@ -0,0 +1,107 @@
+import asyncio
+import pytest
+from task_graph import NodeFailed, TaskGraph
+
+
+def test_independent_nodes_overlap_and_dependents_wait():
+    order = []
+
+    def node(name, delay, value):
+        async def fn(g):
+            order.append(f"start {name}")
+            await asyncio.sleep(delay)
+            order.append(f"end {name}")
+            return value
+        return fn
+
+    async def total(g):
+        return g.result("a") + g.result("b")
+
+    g = TaskGraph()
+    g.add("a", node("a", 0.05, 1))
+    g.add("b", node("b", 0.05, 2))
+    g.add("sum", total, deps=["a", "b"])
+    asyncio.run(g.run())
+    assert order[:2] == ["start a", "start b"]
+    assert g.result("sum") == 3
+
+
+def test_failures_timeouts_and_skips():
+    async def boom(g):
+        raise RuntimeError("upstream 500")
+
+    async def slow(g):
+        await asyncio.sleep(1)
+
+    async def never(g):
+        raise AssertionError("should be skipped")
+
+    done = []
+
+    async def on_done(g, name):
+        done.append(name)
+
+    g = TaskGraph(on_done=on_done)
+    g.add("boom", boom)
+    g.add("slow", slow, timeout=0.05)
+    g.add("after_boom", never, deps=["boom"])
+    g.add("orphan", never, deps=["missing"])
+    asyncio.run(g.run())
+    assert isinstance(g.error("boom"), RuntimeError)
+    assert not g.ok("slow") and "timed out" in g.error("slow")
+    assert g.error("after_boom") == "dependency failed"
+    with pytest.raises(NodeFailed):
+        g.result("orphan")
+    assert sorted(done) == ["boom", "slow"]
+
+
+def test_nodes_added_while_running_are_scheduled():
+    async def fan_out(g):
+        for i in range(3):
+            g.add(f"child_{i}", lambda g, i=i: asyncio.sleep(0, result=i), deps=["root"])
+        return "root"
+
+    g = TaskGraph()
+    g.add("root", fan_out)
+    asyncio.run(g.run())
+    assert [g.result(f"child_{i}") for i in range(3)] == [0, 1, 2]
+    assert set(g.timings()["nodes"]) == {"root", "child_0", "child_1", "child_2"}
+
+
+def test_cancellation_from_inside_a_node_is_reported():
+    async def cancelled_upstream(g):
+        future = asyncio.get_running_loop().create_future()
+        future.cancel()
+        await future  # e.g. a shared result that was cancelled elsewhere
+
+    async def never(g):
+        raise AssertionError("should be skipped")
+
+    done = []
+
+    async def on_done(g, name):
+        done.append(name)
+
+    g = TaskGraph(on_done=on_done)
+    g.add("tts", cancelled_upstream)
+    g.add("after", never, deps=["tts"])
+    asyncio.run(g.run())
+    assert g.timings()["nodes"]["tts"]["status"] == "cancelled"
+    assert g.error("after") == "dependency failed"
+    assert done == ["tts"]
+
+
+def test_cancelling_the_graph_still_propagates():
+    async def slow(g):
+        await asyncio.sleep(1)
+
+    async def scenario():
+        g = TaskGraph()
+        g.add("slow", slow)
+        run = asyncio.create_task(g.run())
+        await asyncio.sleep(0.01)
+        run.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await run
+
+    asyncio.run(scenario())
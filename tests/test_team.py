@@ -0,0 +1,30 @@
+import argparse
+import asyncio
+import os
+import pytest
+import agent_client
+import database as db
+import team
+
+
+def test_cli_creates_only_the_conversation_table(sqlite_db, tmp_path, monkeypatch):
+    async def ask(agent, message, conversation_id=None):
+        return agent_client.AgentReply(agent, "ag_x", conversation_id or "conv_1", "text", "Once upon a time")
+
+    monkeypatch.setattr(agent_client, "ask", ask)
+    monkeypatch.setattr(team, "LEGACY_CONVERSATIONS_FILE", str(tmp_path / "none.json"))
+    args = argparse.Namespace(agent_name="anansi", message="hi", conversation_id=None, continue_latest=False,
+                              list=None, json=False)
+    assert asyncio.run(team.run(args)) == 0
+
+    async def inspect():
+        rs = await db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        turns = await db.execute("SELECT agent, turns FROM agent_conversations")
+        return {r[0] for r in rs.rows}, turns.rows
+
+    assert sqlite_db(inspect()) == ({"agent_conversations"}, [("anansi", 1)])
+
+
+@pytest.mark.skipif("SQLITE_PATH" in os.environ, reason="explicit SQLITE_PATH")
+def test_default_database_sits_next_to_the_module():
+    assert db.SQLITE_PATH == os.path.join(os.path.dirname(os.path.abspath(db.__file__)), "stories.db")
@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+import singleflight
+import tts_cache
+from lru import LRUCache
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(tts_cache, "_disk", tts_cache._DiskTier(str(tmp_path / "tts"), 1024 * 1024))
+    monkeypatch.setattr(tts_cache, "_memory", LRUCache(max_entries=16, max_bytes=1024 * 1024))
+
+
+def test_concurrent_misses_share_one_fetch_without_a_database():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return b"mp3"
+
+    async def scenario():
+        results = await asyncio.gather(*(tts_cache.synthesize("Hello  there", "v", "m", {}, fetch) for _ in range(5)))
+        again = await tts_cache.synthesize("Hello there", "v", "m", {}, fetch)  # Normalized whitespace: same key
+        return results, again
+
+    results, again = asyncio.run(scenario())
+    assert results == [b"mp3"] * 5 and again == b"mp3" and len(calls) == 1
+    assert not singleflight._inflight
+
+
+def test_a_failed_fetch_reaches_every_waiter_and_is_not_cached():
+    attempts = []
+
+    async def fetch():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        if len(attempts) == 1:
+            raise RuntimeError("ElevenLabs 500")
+        return b"mp3"
+
+    async def scenario():
+        first = await asyncio.gather(*(tts_cache.synthesize("x", "v", "m", {}, fetch) for _ in range(3)),
+                                     return_exceptions=True)
+        return first, await tts_cache.synthesize("x", "v", "m", {}, fetch)
+
+    first, retried = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in first)
+    assert retried == b"mp3" and len(attempts) == 2
+
+
+def test_a_cancelled_first_caller_does_not_fail_the_others():
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return b"mp3"
+
+    async def scenario():
+        first = asyncio.create_task(tts_cache.synthesize("x", "v", "m", {}, fetch))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(tts_cache.synthesize("x", "v", "m", {}, fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()  # e.g. the /api/narrate client disconnected
+        return await second
+
+    assert asyncio.run(scenario()) == b"mp3"
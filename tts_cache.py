@@ -0,0 +1,195 @@
+"""
+TTS cache — synthesized speech shared across stories, endpoints and scripts.
+
+The key is a hash of everything that determines the audio: the text
+(Unicode-normalized, whitespace collapsed), voice_id, model_id and
+voice_settings. Two tiers: an in-process LRU bounded by
+TTS_CACHE_MEMORY_BYTES in front of files under TTS_CACHE_DIR (same
+layout as the blob store, named by cache key). The disk tier is trimmed
+least-recently-used (file mtime is touched on every hit) once it grows
+past TTS_CACHE_MAX_BYTES.
+
+`synthesize(...)` is the async get-or-fetch used by the API: concurrent misses
+for the same key in this worker share one upstream call (singleflight,
+local_only — a rare duplicate on another worker just rewrites the same
+key-named file, so no cross-worker lock is taken). `synthesize_sync(...)` is
+the blocking twin for the seeding scripts.
+"""
+import os
+import asyncio
+import hashlib
+import json
+import threading
+import unicodedata
+from typing import Awaitable, Callable, Optional
+from blob_store import LocalBlobBackend
+from lru import LRUCache, MISSING
+import singleflight
+
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", "tts_cache")
+MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+MEMORY_BYTES = int(os.environ.get("TTS_CACHE_MEMORY_BYTES", 32 * 1024 * 1024))
+DEFAULT_MODEL = "eleven_multilingual_v2"
+
+_counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "disk_evictions": 0, "errors": 0,
+             "collapsed": 0}
+
+
+def cache_key(text: str, voice_id: str, model_id: str = DEFAULT_MODEL, voice_settings: Optional[dict] = None) -> str:
+    normalized = " ".join(unicodedata.normalize("NFC", text).split())
+    payload = json.dumps([normalized, voice_id, model_id, voice_settings or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class _DiskTier:
+    """Key-named files with a running byte total; thread-safe so scripts and to_thread callers can share it."""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.backend = LocalBlobBackend(root)
+        self.max_bytes = max_bytes
+        self._bytes: Optional[int] = None  # Scanned lazily on first write
+        self._lock = threading.Lock()
+
+    def _files(self):
+        for dirpath, _, names in os.walk(self.backend.root):
+            for name in names:
+                if len(name) == 64:  # Skip half-written temp files
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, st.st_mtime, st.st_size
+
+    def read(self, key: str) -> Optional[bytes]:
+        path = self.backend.local_path(key)
+        if path is None:
+            return None
+        try:
+            os.utime(path)  # Mark as recently used
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None  # Evicted in between
+
+    def write(self, key: str, data: bytes):
+        existed = self.backend.local_path(key) is not None
+        self.backend.put_sync(key, data)
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(size for _, _, size in self._files())
+            elif not existed:
+                self._bytes += len(data)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drop least-recently-used files until 90% of the budget (caller holds the lock)."""
+        files = sorted(self._files(), key=lambda f: f[1])
+        self._bytes = sum(size for _, _, size in files)
+        target = self.max_bytes * 0.9
+        for path, _, size in files:
+            if self._bytes <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._bytes -= size
+            _counters["disk_evictions"] += 1
+
+    def bytes(self) -> Optional[int]:
+        return self._bytes
+
+
+_memory = LRUCache(max_entries=4096, max_bytes=MEMORY_BYTES)
+_memory_lock = threading.Lock()
+_disk = _DiskTier(TTS_CACHE_DIR, MAX_BYTES)
+
+
+def _remember(key: str, data: bytes):
+    with _memory_lock:
+        _memory.set(key, data, len(data), ttl=float("inf"))
+
+
+def get_sync(key: str) -> Optional[bytes]:
+    with _memory_lock:
+        data = _memory.get(key)
+    if data is not MISSING:
+        _counters["memory_hits"] += 1
+        return data
+    data = _disk.read(key)
+    if data is not None:
+        _counters["disk_hits"] += 1
+        _remember(key, data)
+    return data
+
+
+def put_sync(key: str, data: bytes):
+    if not data:
+        return
+    try:
+        _disk.write(key, data)
+        _counters["stores"] += 1
+    except OSError as e:
+        _counters["errors"] += 1
+        print(f"⚠️ tts_cache write: {e}")
+    _remember(key, data)
+
+
+async def get(key: str) -> Optional[bytes]:
+    with _memory_lock:
+        data = _memory.get(key)
+    if data is not MISSING:
+        _counters["memory_hits"] += 1  # No thread hop on the hot path
+        return data
+    return await asyncio.to_thread(get_sync, key)
+
+
+async def put(key: str, data: bytes):
+    await asyncio.to_thread(put_sync, key, data)
+
+
+async def synthesize(text: str, voice_id: str, model_id: str, voice_settings: Optional[dict],
+                     fetch: Callable[[], Awaitable[bytes]]) -> bytes:
+    """Cached audio for these parameters, else `await fetch()` (MP3 bytes) once and store it."""
+    key = cache_key(text, voice_id, model_id, voice_settings)
+    data = await get(key)
+    if data is not None:
+        return data
+
+    async def fill():
+        _counters["misses"] += 1
+        audio = await fetch()
+        await put(key, audio)
+        return audio
+
+    data, shared = await singleflight.do(f"tts:{key}", fill, local_only=True)
+    if shared:
+        _counters["collapsed"] += 1
+    return data
+
+
+def synthesize_sync(text: str, voice_id: str, model_id: str, voice_settings: Optional[dict],
+                    fetch: Callable[[], Optional[bytes]]) -> Optional[bytes]:
+    """Blocking variant for scripts; `fetch()` may return None on failure (nothing is cached then)."""
+    key = cache_key(text, voice_id, model_id, voice_settings)
+    data = get_sync(key)
+    if data is not None:
+        return data
+    _counters["misses"] += 1
+    data = fetch()
+    if data:
+        put_sync(key, data)
+    return data
+
+
+def stats() -> dict:
+    hits = _counters["memory_hits"] + _counters["disk_hits"]
+    lookups = hits + _counters["misses"]
+    return {
+        **_counters,
+        "hit_rate": round(hits / lookups, 3) if lookups else None,
+        "memory_entries": len(_memory), "memory_bytes": _memory.bytes, "memory_budget": MEMORY_BYTES,
+        "disk_bytes": _disk.bytes(), "disk_budget": MAX_BYTES, "dir": TTS_CACHE_DIR,
+    }
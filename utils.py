@@ -1,5 +1,6 @@
 import os
-import requests
+import http_clients
+import tts_cache
 from typing import Optional
 from pydantic import BaseModel
 
@@ -9,10 +10,10 @@ def validate_story_data(title: str, content: str) -> bool:
     return bool(title.strip()) and bool(content.strip())
 
 
-def narrate_scene(text: str, language: str = "en") -> bytes:
+async def narrate_scene(text: str, language: str = "en") -> bytes:
     """
     Narrate a scene text in a given language using ElevenLabs API (eleven_multilingual_v2 model).
-    Returns MP3 bytes.
+    Returns MP3 bytes; repeated text is served from tts_cache without calling ElevenLabs.
 
     Args:
         text (str): The text to narrate.
@@ -57,10 +58,11 @@ def narrate_scene(text: str, language: str = "en") -> bytes:
         }
     }
 
-    # Make the API request
-    response = requests.post(url, json=data, headers=headers)
+    # Make the API request (shared async client — never blocks the event loop)
+    async def fetch() -> bytes:
+        response = await http_clients.get("elevenlabs").post(url, json=data, headers=headers)
+        if response.status_code != 200:
+            raise Exception(f"ElevenLabs API request failed: {response.text}")
+        return response.content
 
-    if response.status_code != 200:
-        raise Exception(f"ElevenLabs API request failed: {response.text}")
-
-    return response.content
\ No newline at end of file
+    return await tts_cache.synthesize(text, voice_ids[language], data["model_id"], data["voice_settings"], fetch)
\ No newline at end of file